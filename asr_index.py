@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+This script parses all ASR output (.json) under the asr directory once into one table
+of segments and words, with columns rec_id, level ('segment' or 'word'), segment (number of the
+segment a word belongs to, -1 if unknown), start, end (s) and text.
+Regular Whisper (WhisperT) output and WhisperX output, including its separate timestamps files, are supported.
+The table is stored next to the ASR output, so diagnostics and story segmentation can look up
+timestamps without parsing every .json file again. The rec_ids in the table are listed in a
+.rec_ids file next to it (recordings without any ASR output have no rows). The stored table is rebuilt automatically
+when ASR output is added, removed or changed. With a project catalog (see catalog.py), the ASR output
+is looked up in the catalog instead of walking the ASR directory.
+
+Expected input: 1) ASR directory, 2) optional -o/--outfile for the stored table
+"""
+
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (parquet engine for pandas)
+    ASR_INDEX_NAME = "asr_index.parquet"
+except ImportError:
+    ASR_INDEX_NAME = "asr_index.pkl"
+
+COLUMNS = ["rec_id", "level", "segment", "start", "end", "text"]
+
+
+def find_asr_files(asr_dir, catalog = None):
+    """
+    Returns a dict with items 'rec_id': 'ASR output path' for all .json files under asr_dir (from catalog, if given).
+    WhisperX writes a separate timestamps file per recording; it is used instead of the regular file when present.
+    """
+    if catalog is not None:
+        paths = catalog.find("asr", asr_dir)
+    else:
+        paths = [os.path.join(dirpath, filename) for dirpath, dirnames, filenames in os.walk(asr_dir)
+                 for filename in filenames]
+    asr_files = {}
+    for path in paths:
+        filename = os.path.basename(path)
+        if filename.endswith(".json"):
+            rec_id = filename.split(".")[0]
+            if 'timestamps' in rec_id:
+                asr_files[rec_id.replace('_timestamps', '').replace('-timestamps', '')] = path
+            else:
+                asr_files.setdefault(rec_id, path)
+    return asr_files
+
+
+def word_row(rec_id, segment_nr, word):
+    """Returns the row of 1 ASR word; WhisperX leaves out timestamps of words it could not align (e.g. numbers)."""
+    return (rec_id, "word", segment_nr, float(word.get("start", np.nan)), float(word.get("end", np.nan)),
+            str(word.get("word", word.get("text", ""))).strip())
+
+
+def read_asr(rec_id, asr_file):
+    """
+    Parses 1 ASR output file into a list of rows (see COLUMNS).
+    Words nested in segments (WhisperX, or Whisper with word timestamps) keep their segment number,
+    words that are only listed in 'word_segments' (WhisperX timestamps files) get segment -1.
+    """
+    with open(asr_file, "r", encoding="utf-8") as asr_in:
+        asr = json.load(asr_in)
+
+    rows = []
+    for segment_nr, segment in enumerate(asr.get("segments") or []):
+        rows.append((rec_id, "segment", segment_nr, float(segment.get("start", np.nan)),
+                     float(segment.get("end", np.nan)), str(segment.get("text", "")).strip()))
+        for word in segment.get("words") or []:
+            rows.append(word_row(rec_id, segment_nr, word))
+    if not any(row[1] == "word" for row in rows):
+        for word in asr.get("word_segments") or []:
+            rows.append(word_row(rec_id, -1, word))
+    return rows
+
+
+def load_asr(asr_files, jobs = None):
+    """
+    Takes a dict with items 'rec_id': 'ASR output path' and parses all files on a pool
+    of `jobs` worker processes (default: number of cores).
+    Returns 1 DataFrame with COLUMNS; the parsed rec_ids are kept in its attrs (also those without any output).
+    """
+    rows = []
+    if asr_files:
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            for file_rows in pool.map(read_asr, asr_files.keys(), asr_files.values(), chunksize=256):
+                rows += file_rows
+    table = pd.DataFrame(rows, columns=COLUMNS).astype({"segment": "int64", "start": "float64", "end": "float64"})
+    table.attrs["rec_ids"] = sorted(asr_files)
+    return table
+
+
+def rec_ids_path(store_path):
+    """Returns the path of the file next to a stored ASR table that lists its rec_ids."""
+    return f"{store_path}.rec_ids"
+
+
+def save_asr_index(table, store_path):
+    """
+    Writes the ASR table to store_path as parquet (.parquet) or pickle (any other extension),
+    and its rec_ids (attrs are not kept by every parquet engine) to a .rec_ids file (JSON) next to it.
+    """
+    # a crash while writing the table leaves no list of rec_ids, so the table is rebuilt in the next run
+    if os.path.isfile(rec_ids_path(store_path)):
+        os.remove(rec_ids_path(store_path))
+    if store_path.endswith(".parquet"):
+        table.to_parquet(store_path)
+    else:
+        table.to_pickle(store_path)
+    with open(rec_ids_path(store_path), "w", encoding="utf-8") as rec_ids_out:
+        json.dump(list(table.attrs.get("rec_ids", [])), rec_ids_out)
+
+
+def read_asr_index(store_path):
+    """Reads an ASR table written by save_asr_index, with its rec_ids in attrs (None if they were not written)."""
+    if store_path.endswith(".parquet"):
+        table = pd.read_parquet(store_path)
+    else:
+        table = pd.read_pickle(store_path)
+    table.attrs["rec_ids"] = None
+    if os.path.isfile(rec_ids_path(store_path)):
+        with open(rec_ids_path(store_path), "r", encoding="utf-8") as rec_ids_in:
+            table.attrs["rec_ids"] = json.load(rec_ids_in)
+    return table
+
+
+def get_asr_index(asr_dir, store_path = None, jobs = None, catalog = None):
+    """
+    Returns the ASR table for all ASR output under asr_dir.
+    The stored table at store_path (default: asr_dir/asr_index.parquet or .pkl) is used
+    when it contains exactly the ASR files on disk and none of them changed since it was written.
+    Otherwise the files are parsed again and the stored table is replaced.
+    The ASR files are looked up in catalog (a catalog.Catalog), if given.
+    """
+    store_path = store_path or os.path.join(asr_dir, ASR_INDEX_NAME)
+    asr_files = find_asr_files(asr_dir, catalog)
+
+    if os.path.isfile(store_path):
+        store_mtime = os.stat(store_path).st_mtime_ns
+        if all(os.stat(asr_file).st_mtime_ns <= store_mtime for asr_file in asr_files.values()):
+            table = read_asr_index(store_path)
+            if table.attrs["rec_ids"] == sorted(asr_files):
+                return table
+
+    table = load_asr(asr_files, jobs)
+    save_asr_index(table, store_path)
+    return table
+
+
+def first_word_starts(table):
+    """
+    Returns a Series 'rec_id': time (s) of the first recognised word of each recording,
+    falling back to the start of its first segment when no word has a timestamp.
+    """
+    timed = table[table["start"].notna()]
+    word_starts = timed[timed["level"] == "word"].groupby("rec_id", sort=False)["start"].first()
+    segment_starts = timed[timed["level"] == "segment"].groupby("rec_id", sort=False)["start"].first()
+    return word_starts.combine_first(segment_starts)
+
+
+def split_asr(table, level):
+    """Returns a dict with items 'rec_id': rows of that recording at level ('segment' or 'word')."""
+    rows = table[table["level"] == level]
+    return {rec_id: rec_rows.reset_index(drop=True) for rec_id, rec_rows in rows.groupby("rec_id", sort=False)}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('asr_dir', help = "Directory with the ASR output, e.g. $project/asr")
+    parser.add_argument('-o', '--outfile', default=None,
+                        help = f"Where to store the ASR table. Default = asr_dir/{ASR_INDEX_NAME}")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help = "Number of ASR files parsed in parallel. Default = number of cores")
+    args = parser.parse_args()
+
+    asr_table = get_asr_index(args.asr_dir, args.outfile, args.jobs)
+    print(f"ASR table with {(asr_table['level'] == 'segment').sum()} segments and "
+          f"{(asr_table['level'] == 'word').sum()} words from {len(asr_table.attrs.get('rec_ids', []))} files.")
@@ -0,0 +1,438 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+Small in-process audio I/O helpers for the SERDA .wav files produced by serda_data_sel.py.
+These read and write RIFF/WAVE files without starting a sox or ffmpeg process,
+so recordings can be opened once and sliced into many segments.
+Recordings are memory-mapped, so segments are views on the file and never copies of it.
+The output format of converted recordings (sample rate, bit depth, .wav or .flac) is an AudioFormat;
+.flac files can only be probed here, they are cut with sox.
+"""
+
+import io
+import os
+import mmap
+import struct
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# subformat GUID tail shared by all WAVE_FORMAT_EXTENSIBLE subtypes
+_KSDATAFORMAT_TAIL = b"\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+
+
+class WavError(Exception):
+    """Raised when a file cannot be parsed as a PCM .wav (or .flac) file."""
+
+
+WavInfo = namedtuple("WavInfo", ["format_tag", "channels", "sample_rate",
+                                 "bits_per_sample", "data_offset", "data_size"])
+
+# output format of converted recordings: sample rate (None = keep the source rate), bits per sample, extension
+AudioFormat = namedtuple("AudioFormat", ["sample_rate", "bits_per_sample", "extension"])
+# the original SERDA output: 32-bit .wav at the source sample rate
+DEFAULT_FORMAT = AudioFormat(None, 32, ".wav")
+# extensions of converted recordings
+AUDIO_EXTENSIONS = (".wav", ".flac")
+
+
+def audio_format(sample_rate = None, bits_per_sample = 32, container = "wav"):
+    """Returns the AudioFormat for a sample rate (None = source rate), a bit depth and a container ('wav' or 'flac')."""
+    if container not in {"wav", "flac"}:
+        raise ValueError(f"Unsupported container '{container}', use 'wav' or 'flac'")
+    if bits_per_sample not in ({16, 24} if container == "flac" else {16, 24, 32}):
+        raise ValueError(f"{bits_per_sample}-bit audio is not supported for .{container}")
+    return AudioFormat(sample_rate, bits_per_sample, f".{container}")
+
+
+def ffmpeg_args(audio_format):
+    """Returns the ffmpeg output options (codec, sample format and rate) for an AudioFormat."""
+    if audio_format.extension == ".flac":
+        args = ["-c:a", "flac", "-sample_fmt", "s16" if audio_format.bits_per_sample == 16 else "s32"]
+        if audio_format.bits_per_sample == 24:
+            args += ["-bits_per_raw_sample", "24"]
+    else:
+        args = ["-c:a", f"pcm_s{audio_format.bits_per_sample}le"]
+    if audio_format.sample_rate:
+        args += ["-ar", str(audio_format.sample_rate)]
+    return args
+
+
+def block_align(info):
+    """Number of bytes per frame (1 sample for every channel)."""
+    return info.channels * info.bits_per_sample // 8
+
+
+def n_frames(info):
+    """Number of complete frames in the data chunk."""
+    return info.data_size // block_align(info)
+
+
+def duration(info):
+    """Duration of the data chunk in seconds."""
+    return n_frames(info) / info.sample_rate
+
+
+def read_header(wav_in):
+    """
+    Takes an open binary file object positioned at the start of a .wav file
+    and walks its RIFF chunks until the data chunk is found.
+    Returns a WavInfo tuple. The data size is clamped to the actual file size,
+    so truncated files (sox: "Premature EOF") can still be read up to their end.
+    """
+    riff = wav_in.read(12)
+    if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+        raise WavError(f"{getattr(wav_in, 'name', 'input')} is not a RIFF/WAVE file")
+
+    fmt = None
+    while True:
+        chunk_header = wav_in.read(8)
+        if len(chunk_header) < 8:
+            raise WavError(f"{getattr(wav_in, 'name', 'input')} has no data chunk")
+        chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+
+        if chunk_id == b"fmt ":
+            fmt_chunk = wav_in.read(chunk_size + chunk_size % 2)
+            format_tag, channels, sample_rate, _, _, bits_per_sample = struct.unpack("<HHIIHH", fmt_chunk[:16])
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt_chunk) >= 40:
+                # the real format tag is stored in the first 2 bytes of the subformat GUID
+                format_tag = struct.unpack("<H", fmt_chunk[24:26])[0]
+            if format_tag not in {WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT}:
+                raise WavError(f"Unsupported wav format tag {format_tag:#06x}")
+            fmt = (format_tag, channels, sample_rate, bits_per_sample)
+
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise WavError("data chunk found before fmt chunk")
+            data_offset = wav_in.tell()
+            wav_in.seek(0, 2)
+            data_size = min(chunk_size, wav_in.tell() - data_offset)
+            wav_in.seek(data_offset)
+            return WavInfo(*fmt, data_offset, data_size)
+
+        else:
+            wav_in.seek(chunk_size + chunk_size % 2, 1)
+
+
+def read_flac_header(flac_in):
+    """
+    Takes an open binary file object positioned at the start of a .flac file and reads its STREAMINFO block.
+    Returns a tuple (sample rate, channels, bits per sample, total number of frames).
+    """
+    if flac_in.read(4) != b"fLaC":
+        raise WavError(f"{getattr(flac_in, 'name', 'input')} is not a FLAC file")
+    block_header = flac_in.read(4)
+    streaminfo = flac_in.read(34)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0 or len(streaminfo) < 34:
+        raise WavError(f"{getattr(flac_in, 'name', 'input')} has no STREAMINFO block")
+    # 20 bits sample rate, 3 bits channels - 1, 5 bits bits per sample - 1, 36 bits total frames
+    packed = int.from_bytes(streaminfo[10:18], "big")
+    return packed >> 44, ((packed >> 41) & 0x7) + 1, ((packed >> 36) & 0x1F) + 1, packed & 0xFFFFFFFFF
+
+
+def probe_duration(path):
+    """Reads only the header of a .wav (or .flac) file and returns its duration in seconds (like `soxi -D`)."""
+    with open(path, "rb") as audio_in:
+        if path.endswith(".flac"):
+            sample_rate, channels, bits_per_sample, frames = read_flac_header(audio_in)
+            return frames / sample_rate
+        return duration(read_header(audio_in))
+
+
+def probe_durations(paths, jobs = None):
+    """
+    Probes the duration of many .wav files on a thread pool of `jobs` workers (default: number of cores).
+    Returns a dict with items 'path': duration in seconds, or None for files that could not be read.
+    """
+    def probe(path):
+        try:
+            return probe_duration(path)
+        except (OSError, WavError, struct.error):
+            return None
+
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        return dict(zip(paths, pool.map(probe, paths)))
+
+
+def sample_dtype(info):
+    """Returns the numpy dtype of a single sample in the format of info."""
+    if info.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        return np.dtype(f"<f{info.bits_per_sample // 8}")
+    if info.bits_per_sample == 8:
+        return np.dtype("u1")
+    if info.bits_per_sample in {16, 32, 64}:
+        return np.dtype(f"<i{info.bits_per_sample // 8}")
+    # e.g. 24-bit: no numeric dtype, but slicing and writing still work on raw sample bytes (see unpack_samples)
+    return np.dtype(f"V{info.bits_per_sample // 8}")
+
+
+def unpack_samples(samples):
+    """
+    Takes a (frames x channels) array of raw little-endian integer samples of up to 4 bytes (e.g. 24-bit,
+    see sample_dtype) and returns them as int32, scaled like the original format (full scale 2 ** (bits - 1)).
+    """
+    width = samples.dtype.itemsize
+    raw = np.ascontiguousarray(samples).view(np.uint8).reshape(samples.shape + (width,))
+    # put the sample bytes in the high bytes of an int32, so the sign is kept, then shift them back down
+    padded = np.zeros(samples.shape + (4,), dtype=np.uint8)
+    padded[..., 4 - width:] = raw
+    return padded.view("<i4").reshape(samples.shape) >> (8 * (4 - width))
+
+
+def time_to_frame(seconds, sample_rate):
+    """Converts a time in seconds to a frame index, rounding like sox does."""
+    return int(seconds * sample_rate + 0.5)
+
+
+def frame_range(info, start, end):
+    """
+    Takes a start and end time in seconds and returns the matching
+    (first frame, last frame) pair, clamped to the frames available in the file.
+    """
+    total = n_frames(info)
+    first = min(max(time_to_frame(start, info.sample_rate), 0), total)
+    last = min(max(time_to_frame(end, info.sample_rate), first), total)
+    return first, last
+
+
+def full_scale(info):
+    """Returns the absolute value of a full scale sample in the format of info."""
+    if info.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        return 1.0
+    if info.bits_per_sample == 8:
+        return 128.0
+    return float(2 ** (info.bits_per_sample - 1))
+
+
+def amplitude(samples, info):
+    """
+    Takes a (frames x channels) array of samples in the format of info and returns
+    the peak amplitude of each frame over all channels, relative to full scale (0.0 - 1.0).
+    """
+    if samples.dtype.kind == "V":
+        if samples.dtype.itemsize > 4:
+            raise WavError(f"Cannot compute amplitudes for {info.bits_per_sample}-bit audio")
+        samples = unpack_samples(samples)
+    values = samples.astype(np.float64)
+    if info.bits_per_sample == 8 and info.format_tag == WAVE_FORMAT_PCM:
+        values -= 128.0
+    return np.abs(values).max(axis=1) / full_scale(info)
+
+
+def silence_starts(samples, info, noise_levels, min_duration):
+    """
+    Vectorized equivalent of ffmpeg's silencedetect filter on a block of samples.
+    Takes a list of noise levels (in dB) and a minimal silence duration (in s) and
+    returns a dict with items 'noise level': array of start times (s, relative to the first sample)
+    of all runs of at least min_duration where every channel stays below that noise level.
+    The amplitude of the block is computed once and shared by all noise levels.
+    """
+    peak = amplitude(samples, info)
+    min_frames = max(time_to_frame(min_duration, info.sample_rate), 1)
+    starts = {}
+    for noise_level in noise_levels:
+        quiet = np.concatenate(([False], peak < 10 ** (noise_level / 20), [False]))
+        edges = np.diff(quiet.astype(np.int8))
+        run_starts = np.flatnonzero(edges == 1)
+        run_ends = np.flatnonzero(edges == -1)
+        long_runs = run_starts[(run_ends - run_starts) >= min_frames]
+        starts[noise_level] = long_runs / info.sample_rate
+    return starts
+
+
+class WavReader:
+    """
+    Memory-mapped .wav reader. The RIFF header is parsed once on opening and
+    the data chunk is exposed as `samples`, a read-only (frames x channels) numpy array
+    backed by the page cache instead of process memory.
+    Use as a context manager:
+
+        with WavReader(path) as wav:
+            segment = wav.segment(1.5, 2.3)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self.info = read_header(self._file)
+        except WavError:
+            self._file.close()
+            raise
+        self._mmap = None
+        dtype = sample_dtype(self.info)
+        frames = n_frames(self.info)
+        if frames == 0:
+            self.samples = np.empty((0, self.info.channels), dtype=dtype)
+        else:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.samples = np.frombuffer(self._mmap, dtype=dtype, count=frames * self.info.channels,
+                                         offset=self.info.data_offset).reshape(frames, self.info.channels)
+
+    @property
+    def duration(self):
+        """Duration of the recording in seconds."""
+        return duration(self.info)
+
+    def segment(self, start, end):
+        """Returns a zero-copy view of the samples between start and end (in seconds)."""
+        first, last = frame_range(self.info, start, end)
+        return self.samples[first:last]
+
+    def close(self):
+        """Releases the memory map. Views handed out earlier must not be used afterwards."""
+        self.samples = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # views are still referenced somewhere, the map is released once they are collected
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_header(info, data_size):
+    """
+    Builds a .wav header for data_size bytes of audio in the format of info.
+    Formats over 16 bits or over 2 channels are written as WAVE_FORMAT_EXTENSIBLE,
+    the same way ffmpeg and sox do.
+    """
+    align = block_align(info)
+    byte_rate = info.sample_rate * align
+    if info.bits_per_sample > 16 or info.channels > 2:
+        fmt_chunk = struct.pack("<HHIIHHHHIH14s", WAVE_FORMAT_EXTENSIBLE, info.channels, info.sample_rate,
+                                byte_rate, align, info.bits_per_sample, 22, info.bits_per_sample, 0,
+                                info.format_tag, _KSDATAFORMAT_TAIL)
+    else:
+        fmt_chunk = struct.pack("<HHIIHH", info.format_tag, info.channels, info.sample_rate,
+                                byte_rate, align, info.bits_per_sample)
+    riff_size = 4 + (8 + len(fmt_chunk)) + (8 + data_size + data_size % 2)
+    return (struct.pack("<4sI4s", b"RIFF", riff_size, b"WAVE")
+            + struct.pack("<4sI", b"fmt ", len(fmt_chunk)) + fmt_chunk
+            + struct.pack("<4sI", b"data", data_size))
+
+
+def write_wav(path, info, data, pad = 0.0):
+    """
+    Writes data (bytes or a WavReader segment in the format of info) to a .wav file at path.
+    Optionally pads the audio with `pad` seconds of silence on both sides,
+    like `sox ... pad {pad} {pad}`.
+    """
+    # silence is 0, except for 8-bit PCM, which is unsigned with silence at 128
+    silence = b"\x80" if info.bits_per_sample == 8 and info.format_tag == WAVE_FORMAT_PCM else b"\x00"
+    pad_bytes = silence * (time_to_frame(pad, info.sample_rate) * block_align(info))
+    data = memoryview(np.ascontiguousarray(data).view(np.uint8).reshape(-1)) if isinstance(data, np.ndarray) else memoryview(data)
+    data_size = data.nbytes + 2 * len(pad_bytes)
+    with open(path, "wb") as wav_out:
+        wav_out.write(build_header(info, data_size))
+        wav_out.write(pad_bytes)
+        wav_out.write(data)
+        wav_out.write(pad_bytes)
+        if data_size % 2:
+            wav_out.write(b"\x00")
+
+
+# a .wav stream is parsed once this many bytes came in (any .wav header is shorter)
+STREAM_HEADER_BYTES = 4096
+
+
+class WavStream:
+    """
+    Writable binary file-like object that takes a .wav byte stream, e.g. the stdout of
+    `ffmpeg ... -f wav -`, whose header can't contain the right sizes while streaming.
+    The audio is written to path with a correct header once the stream is closed, and the frames
+    between keep_start and keep_end (in s) are also kept in memory, so they can be searched
+    without reading the file again. After closing, `info` describes the written file.
+    """
+
+    def __init__(self, path, keep_start = None, keep_end = None):
+        self.path = path
+        self.keep_start = keep_start
+        self.keep_end = keep_end
+        self.info = None
+        self.kept = bytearray()
+        self._buffer = bytearray()
+        self._data_size = 0
+        self._keep = (0, 0)
+        self._out = open(path, "wb")
+
+    def _start(self):
+        """Parses the header of the buffered stream and writes the buffered audio."""
+        try:
+            self.info = read_header(io.BytesIO(bytes(self._buffer)))
+        except struct.error:
+            raise WavError(f"The audio stream for {self.path} ended inside its header")
+        except WavError as err:
+            raise WavError(f"The audio stream for {self.path} can't be read: {err}")
+        if self.keep_start is not None:
+            align = block_align(self.info)
+            self._keep = (time_to_frame(self.keep_start, self.info.sample_rate) * align,
+                          time_to_frame(self.keep_end, self.info.sample_rate) * align)
+        self._out.write(build_header(self.info, 0))
+        data = bytes(self._buffer[self.info.data_offset:])
+        self._buffer = None
+        self._write_data(data)
+
+    def _write_data(self, data):
+        """Writes audio bytes and keeps the part of them between keep_start and keep_end."""
+        offset = self._data_size
+        first, last = max(self._keep[0] - offset, 0), min(self._keep[1] - offset, len(data))
+        if first < last:
+            self.kept += data[first:last]
+        self._out.write(data)
+        self._data_size += len(data)
+
+    def write(self, chunk):
+        if self.info is None:
+            self._buffer += chunk
+            if len(self._buffer) >= STREAM_HEADER_BYTES:
+                self._start()
+        else:
+            self._write_data(chunk)
+        return len(chunk)
+
+    @property
+    def duration(self):
+        """Duration (s) of the audio written so far."""
+        return duration(self.info._replace(data_size=self._data_size)) if self.info else 0.0
+
+    def kept_samples(self):
+        """Returns the kept frames as a (frames x channels) array and the time (s) of the first one."""
+        frames = len(self.kept) // block_align(self.info)
+        samples = np.frombuffer(bytes(self.kept[:frames * block_align(self.info)]), dtype=sample_dtype(self.info))
+        return samples.reshape(frames, self.info.channels), self._keep[0] / block_align(self.info) / self.info.sample_rate
+
+    def close(self):
+        """Writes the final header. Raises WavError if the stream did not contain a .wav header."""
+        if self._out.closed:
+            return
+        try:
+            if self.info is None:
+                self._start()
+            if self._data_size % 2:
+                self._out.write(b"\x00")
+            header = build_header(self.info, self._data_size)
+            self._out.seek(0)
+            self._out.write(header)
+            self.info = WavInfo(*self.info[:4], len(header), self._data_size)
+        finally:
+            self._out.close()
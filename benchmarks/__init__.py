@@ -0,0 +1,4 @@
+"""
+Benchmarks for the SERDA pipeline: a synthetic cohort generator (synth.py),
+an end-to-end stage benchmark (run.py) and a text filter benchmark (text_filter.py).
+"""
@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+End-to-end benchmark of the SERDA pipeline on a synthetic cohort (see synth.py).
+Every stage is timed separately and reported with its throughput (items/s and MB/s where it applies)
+and memory: the peak resident set size of this process and of its worker processes so far,
+and optionally (--trace-memory) the peak of Python allocations within the stage, which slows the stage down.
+The results are written as JSON together with the git commit, so runs of different versions can be compared
+(--baseline prints the change per stage against an earlier results file).
+The output audio format (--out-sample-rate, --out-bit-depth, --out-format) applies to the convert stage,
+so runs with different formats can be compared on time and on the storage of the converted recordings.
+
+Stages: ingest (zip streaming), convert (webm > wav, only with ffmpeg), probe (durations), trim (long stories),
+log_store, prepare (prompts + word segments), text_filter (no-unk, worker pool), text_filter_adapt,
+asr_index, diagnose_speed, segment_stories (alignment + story segments).
+
+Expected input: optional -n/--speakers, -j/--jobs, -w/--workdir, -o/--outfile, --baseline, --trace-memory, --keep,
+--out-sample-rate, --out-bit-depth, --out-format
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import resource
+import tracemalloc
+from subprocess import run, CalledProcessError
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import audio_io
+import log_store
+from catalog import Catalog, CATALOG_NAME
+import preflight
+import asr_index
+import diagnostics
+import segment_stories_ASR
+import serda_data_sel as data_sel
+import serda_data_prep as data_prep
+import string_norm
+from text_filter_adapt import TextNormalizer
+from benchmarks.synth import generate_cohort
+
+
+def peak_rss_mb(who):
+    """Peak resident set size in MB of this process (RUSAGE_SELF) or its finished children (RUSAGE_CHILDREN)."""
+    kilobytes = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    return kilobytes / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+@contextmanager
+def timed_stage(name, results, trace_memory = False):
+    """
+    Times the code in the with block as stage `name` and appends its record to results.
+    The block can fill in record["items"] and record["bytes"] to get the throughput.
+    """
+    record = {"stage": name, "items": 0, "bytes": 0}
+    if trace_memory:
+        tracemalloc.start()
+    print(f"\t{name}...")
+    start = time.perf_counter()
+    yield record
+    record["seconds"] = time.perf_counter() - start
+    if trace_memory:
+        record["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    record["items_per_s"] = record["items"] / record["seconds"] if record["seconds"] else None
+    record["mb_per_s"] = record["bytes"] / 2 ** 20 / record["seconds"] if record["seconds"] and record["bytes"] else None
+    record["peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_SELF)
+    record["peak_rss_children_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    results.append(record)
+
+
+def files_under(directory, extension):
+    """Returns all files with extension (or any of a tuple of extensions) under directory."""
+    return [os.path.join(dirpath, filename) for dirpath, dirnames, filenames in os.walk(directory)
+            for filename in filenames if filename.endswith(extension)]
+
+
+def total_size(paths):
+    """Total size in bytes of a list of files."""
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def git_commit():
+    """Returns the current git commit of the repository (with -dirty for local changes), or None."""
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        return run(["git", "describe", "--always", "--dirty"], cwd=repo_dir, check=True,
+                   capture_output=True, text=True).stdout.strip()
+    except (OSError, CalledProcessError):
+        return None
+
+
+def run_benchmark(workdir, n_speakers = 4, jobs = None, sample_rate = 16000, trace_memory = False,
+                  audio_format = audio_io.DEFAULT_FORMAT):
+    """
+    Generates a cohort of n_speakers in workdir and runs every pipeline stage on it,
+    converting the recordings to audio_format (only when ffmpeg is available).
+    Returns the cohort info (see synth.generate_cohort) with the storage of the converted recordings
+    and a list with 1 record per stage.
+    """
+    results = []
+    cohort_dir = os.path.join(workdir, "cohort")
+    project_dir = os.path.join(workdir, "project")
+    audio_path = os.path.join(project_dir, "audio")
+    logs_path = os.path.join(project_dir, "logs")
+    prompts_path = os.path.join(project_dir, "prompts")
+    audio_words_path = os.path.join(audio_path, "words", "full")
+    audio_stories_path = os.path.join(audio_path, "stories")
+    for mydir in [audio_words_path, audio_stories_path, os.path.join(audio_path, "long_stories"),
+                  os.path.join(logs_path, "words"), os.path.join(logs_path, "stories")]:
+        os.makedirs(mydir, exist_ok=True)
+
+    print(f"Generating a synthetic cohort of {n_speakers} speakers...")
+    with timed_stage("generate", results) as record:
+        cohort = generate_cohort(cohort_dir, n_speakers, sample_rate)
+        record["items"] = cohort["recordings"]
+    print("Running the pipeline stages...")
+
+    # 1. data selection
+    with timed_stage("ingest", results, trace_memory) as record:
+        audio_members = data_sel.extract_zip(cohort["audio_zip"], cohort["audio_extension"],
+                                             audio_words_path, audio_stories_path)
+        log_members = data_sel.extract_zip(cohort["log_zip"], ".csv",
+                                           os.path.join(logs_path, "words"), os.path.join(logs_path, "stories"))
+        record["items"] = len(audio_members) + len(log_members)
+        record["bytes"] = total_size(audio_members) + total_size(log_members)
+
+    fused_stories = {}
+    if cohort["audio_extension"] == ".webm":
+        # .wav stories take the fused path: converted, measured and trimmed with a single decode
+        fused = audio_format.extension == ".wav"
+        with timed_stage("convert", results, trace_memory) as record:
+            wav_files, failed = data_sel.convert_audio([f for f in audio_members if not fused or "story" not in f],
+                                                       set(), jobs, audio_format)
+            story_wavs = []
+            if fused:
+                story_wavs, story_failed, fused_stories = data_sel.process_stories(
+                    [f for f in audio_members if "story" in f], set(), os.path.join(audio_path, "long_stories"),
+                    jobs, audio_format)
+            record["items"] = len(wav_files) + len(story_wavs)
+            record["bytes"] = total_size(wav_files + story_wavs)
+    elif audio_format != audio_io.DEFAULT_FORMAT:
+        print("	WARNING: the output audio format is only applied when ffmpeg is available")
+    wav_files = files_under(audio_path, audio_io.AUDIO_EXTENSIONS)
+
+    with timed_stage("preflight", results, trace_memory) as record:
+        preflight.scan_audio(wav_files, jobs=jobs)
+        record["items"] = len(wav_files)
+    with timed_stage("probe", results, trace_memory) as record:
+        durations = audio_io.probe_durations(wav_files, jobs)
+        record["items"] = len(durations)
+    recordings = [path for path in wav_files if "long_stories" not in path]
+    cohort["storage"] = {"bytes": total_size(recordings),
+                         "kb_per_audio_second": total_size(recordings) / 1000 / sum(durations[path] for path in recordings)}
+
+    long_stories = {os.path.basename(path).split('.')[0]: (path, duration) for path, duration in durations.items()
+                    if "story" in path and "long_stories" not in path and duration > data_sel.STORY_MAX}
+    # stories of the fused path were trimmed while converting them
+    long_stories = {rec_id: story for rec_id, story in long_stories.items() if rec_id not in fused_stories}
+    with timed_stage("trim", results, trace_memory) as record:
+        data_sel.trim_long_stories(long_stories, audio_path, "python" if audio_format.extension == ".wav" else "ffmpeg", jobs)
+        record["items"] = len(long_stories)
+        record["bytes"] = total_size(path for path, duration in long_stories.values())
+
+    # 2. data preparation
+    with timed_stage("log_store", results, trace_memory) as record:
+        logs = log_store.get_log_store(logs_path, jobs=jobs)
+        record["items"] = logs.index.get_level_values("rec_id").nunique()
+
+    catalog = Catalog(os.path.join(project_dir, CATALOG_NAME))
+    with timed_stage("prepare", results, trace_memory) as record:
+        full_dict = data_sel.gen_clean_dict(audio_path, logs_path, cohort["recs_to_ignore"], False, catalog=catalog)
+        data_prep.prepare_data(True, full_dict, audio_path, logs_path, cohort["raw_prompts"], prompts_path,
+                               catalog=catalog)
+        segments = files_under(os.path.join(audio_path, "words", "segments"), audio_io.AUDIO_EXTENSIONS)
+        record["items"] = len(segments)
+        record["bytes"] = total_size(segments)
+
+    # finding the recordings and logs of a non-clean run, by walking the project dirs and from the catalog
+    with timed_stage("discover_walk", results, trace_memory) as record:
+        record["items"] = len(data_sel.gen_clean_dict(audio_path, logs_path, cohort["recs_to_ignore"], False))
+    with timed_stage("discover_catalog", results, trace_memory) as record:
+        record["items"] = len(data_sel.gen_clean_dict(audio_path, logs_path, cohort["recs_to_ignore"], False,
+                                                      catalog=catalog))
+    catalog.close()
+
+    # 3. after ASR
+    txt_files = files_under(cohort["asr_words"], ".txt") + files_under(cohort["asr_stories"], ".txt")
+    filtered_dir = os.path.join(workdir, "asr_filtered")
+    os.makedirs(filtered_dir, exist_ok=True)
+    file_pairs = [(path, os.path.join(filtered_dir, os.path.basename(path))) for path in txt_files]
+    with timed_stage("text_filter", results, trace_memory) as record:
+        string_norm.normalize_files(file_pairs, False, jobs)
+        record["items"] = len(file_pairs)
+        record["bytes"] = total_size(txt_files)
+
+    with timed_stage("text_filter_adapt", results, trace_memory) as record:
+        normalizer = TextNormalizer(unk=True, features_file=cohort["features_file"])
+        for in_out in file_pairs:
+            normalizer.normalize_file(*in_out)
+        record["items"] = len(file_pairs)
+        record["bytes"] = total_size(txt_files)
+
+    asr_dir = os.path.dirname(cohort["asr_words"])
+    with timed_stage("asr_index", results, trace_memory) as record:
+        asr_files = asr_index.find_asr_files(asr_dir)
+        asr_index.save_asr_index(asr_index.load_asr(asr_files, jobs), os.path.join(asr_dir, asr_index.ASR_INDEX_NAME))
+        record["items"] = len(asr_files)
+        record["bytes"] = total_size(asr_files.values())
+
+    with timed_stage("diagnose_speed", results, trace_memory) as record:
+        matrix = diagnostics.diagnose_speed(cohort["asr_words"], logs_path, os.path.join(workdir, "speed.csv"), jobs=jobs)
+        record["items"] = int(matrix.notna().to_numpy().sum())
+
+    with timed_stage("segment_stories", results, trace_memory) as record:
+        story_segments = segment_stories_ASR.segment_stories(cohort["asr_stories"], os.path.join(prompts_path, "stories"),
+                                                             audio_stories_path, jobs=jobs)
+        record["items"] = len(story_segments)
+        record["bytes"] = total_size(files_under(os.path.join(audio_stories_path, "segments"), audio_io.AUDIO_EXTENSIONS))
+
+    return cohort, results
+
+
+def compare(results, config, baseline_file):
+    """Prints the change in time per stage against the results in baseline_file."""
+    with open(baseline_file, "r", encoding="utf-8") as baseline_in:
+        baseline = json.load(baseline_in)
+    baseline_seconds = {record["stage"]: record["seconds"] for record in baseline["stages"]}
+    print(f"\nCompared to {baseline_file} ({baseline.get('commit')}):")
+    if baseline.get("config") != config:
+        print(f"\tWARNING: the baseline was run with a different config: {baseline.get('config')}")
+    for record in results:
+        if record["stage"] in baseline_seconds:
+            ratio = record["seconds"] / baseline_seconds[record["stage"]]
+            print(f"\t{record['stage']:<18} {baseline_seconds[record['stage']]:8.3f}s > {record['seconds']:8.3f}s  ({ratio:.2f}x)")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--speakers', type=int, default=4, help = "Number of synthetic speakers. Default = 4")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help = "Number of parallel jobs. Default = number of cores")
+    parser.add_argument('--sample-rate', type=int, default=16000, help = "Sample rate of the synthetic audio. Default = 16000")
+    parser.add_argument('--out-sample-rate', type=int, default=None,
+                        help = "Sample rate of the converted recordings. Default = the source sample rate")
+    parser.add_argument('--out-bit-depth', type=int, choices=[16, 24, 32], default=32,
+                        help = "Bits per sample of the converted recordings. Default = 32")
+    parser.add_argument('--out-format', choices=['wav', 'flac'], default='wav',
+                        help = "File format of the converted recordings. Default = 'wav'")
+    parser.add_argument('-w', '--workdir', default=None, help = "Directory to run in. Default = a new temporary directory")
+    parser.add_argument('-o', '--outfile', default=None,
+                        help = "JSON file to write the results to. Default = benchmark_results.json in the workdir")
+    parser.add_argument('--baseline', default=None, help = "Earlier results file to compare with")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help = "Also trace the peak of Python allocations per stage (slower)")
+    parser.add_argument('--keep', action='store_true', help = "Keep the workdir (always kept when given with -w)")
+    args = parser.parse_args()
+    try:
+        out_format = audio_io.audio_format(args.out_sample_rate, args.out_bit_depth, args.out_format)
+    except ValueError as err:
+        parser.error(str(err))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="serda_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    cohort_info, stage_results = run_benchmark(workdir, args.speakers, args.jobs, args.sample_rate, args.trace_memory,
+                                               out_format)
+
+    report = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {"speakers": args.speakers, "jobs": args.jobs, "sample_rate": args.sample_rate,
+                   "trace_memory": args.trace_memory, "out_format": out_format._asdict()},
+        "cohort": {key: cohort_info[key] for key in ["recordings", "long_stories", "audio_seconds", "audio_extension",
+                                                      "storage"]},
+        "stages": stage_results,
+    }
+    outfile = args.outfile or os.path.join(workdir, "benchmark_results.json")
+    with open(outfile, "w", encoding="utf-8") as results_out:
+        json.dump(report, results_out, indent=2)
+
+    print("\nStage               seconds     items/s      MB/s  peak RSS (MB)")
+    for stage_record in stage_results:
+        items_per_s = f"{stage_record['items_per_s']:10.1f}" if stage_record['items_per_s'] else f"{'-':>10}"
+        mb_per_s = f"{stage_record['mb_per_s']:9.1f}" if stage_record['mb_per_s'] else f"{'-':>9}"
+        print(f"{stage_record['stage']:<18} {stage_record['seconds']:8.3f}  {items_per_s}  {mb_per_s}"
+              f"  {stage_record['peak_rss_mb']:.0f} (workers {stage_record['peak_rss_children_mb']:.0f})")
+    print(f"\nRecordings take {cohort_info['storage']['bytes'] / 2 ** 20:.1f} MB"
+          f" ({cohort_info['storage']['kb_per_audio_second']:.1f} kB per second of audio).")
+    print(f"Results are in {outfile}.")
+
+    if args.baseline:
+        compare(stage_results, report["config"], args.baseline)
+    if not args.workdir and not args.keep:
+        shutil.rmtree(workdir)
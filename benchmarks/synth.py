@@ -0,0 +1,264 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+Generates a synthetic SERDA cohort offline, for benchmarking the pipeline.
+Every speaker reads 6 tasks (words_1-3 with 50 items each, story_1-3) and gets:
+- audio: 32-bit .wav (or .webm when ffmpeg is available) with low noise and louder "speech" bursts
+  where the words are read; stories that run over 180s get a planted silence just after 180s
+- logs: ;-delimited .csv with prompt_id/prompt/start_speak/stop_speak in ms, named like the admin export
+- ASR-like output: WhisperT .json + .txt per word segment, WhisperX .json (with word timestamps) + .txt per story
+Audio and logs are zipped like the raw downloads, next to the story prompts, an empty ignore list
+and a small ADAPT features file for the text filter.
+
+Expected input: 1) output directory, 2) optional -n/--speakers, --sample-rate, --seed and --no-webm
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import zipfile
+import argparse
+import pathlib
+from subprocess import run
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import audio_io
+from serda_data_prep import FIRST_ITEMS, WORD_APPEAR_OFFSET
+
+TASKS = ["words_1", "words_2", "words_3", "story_1", "story_2", "story_3"]
+N_WORD_ITEMS = 50
+N_STORY_LINES = 40
+VOCABULARY = ["de", "kat", "zat", "op", "mat", "hond", "liep", "naar", "huis", "een", "mooie", "dag", "boom",
+              "fiets", "school", "juf", "appel", "café", "één", "twee", "vogel", "zon", "regen", "water",
+              "koud", "warm", "lezen", "boek", "rood", "groen", "vis", "zee", "strand", "zand", "kasteel"]
+# ASR quirks the text filters have to deal with
+ASR_NOISE = ["xxx", "ggg", "12", "3de", "Hé!", "ok?", "naïve", "eh", "[noise]", "dat=is"]
+ADAPT_SYMBOLS = "abcdefghijklmnopqrstuvwxyz'éèëïöü"
+NOISE_LEVEL = 10 ** (-65 / 20)
+SPEECH_LEVEL = 10 ** (-20 / 20)
+
+
+def speaker_ids(n_speakers, rng):
+    """Returns n_speakers unique 5-character IDs like the SERDA user IDs (e.g. 2RRDV)."""
+    alphabet = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+    ids = set()
+    while len(ids) < n_speakers:
+        ids.add("".join(rng.choice(alphabet) for _ in range(5)))
+    return sorted(ids)
+
+
+def render(duration, bursts, sample_rate, rng, silences = ()):
+    """
+    Returns duration seconds of int32 audio (frames x 1) with a -65dB noise floor, -20dB noise in each
+    (start, end) burst in seconds and digital silence in each (start, end) of silences.
+    """
+    n = int(duration * sample_rate)
+    signal = rng.standard_normal(n, dtype=np.float32) * NOISE_LEVEL
+    for start, end in bursts:
+        first, last = int(start * sample_rate), min(int(end * sample_rate), n)
+        signal[first:last] = rng.standard_normal(max(last - first, 0), dtype=np.float32) * SPEECH_LEVEL
+    for start, end in silences:
+        signal[int(start * sample_rate):int(end * sample_rate)] = 0
+    return (np.clip(signal, -1, 1) * (2 ** 31 - 1)).astype("<i4").reshape(-1, 1)
+
+
+def asr_text(words, rng):
+    """Makes an ASR-like transcription of words, with capitals, punctuation and some noise tokens."""
+    out = []
+    for word in words:
+        if rng.random() < 0.05:
+            out.append(rng.choice(ASR_NOISE))
+        out.append(word.capitalize() if rng.random() < 0.1 else word)
+    return " ".join(out) + rng.choice(["", ".", "?", "!"])
+
+
+def word_task(rec_id, task_nr, rng):
+    """
+    Returns the log rows (prompt_id, prompt, start_speak, stop_speak in ms), the speech bursts (s)
+    and the duration (s) of 1 word task recording.
+    """
+    rows, bursts = [], []
+    stop = 0
+    for item in range(N_WORD_ITEMS):
+        prompt_id = task_nr * 100 + item + 1
+        if prompt_id in FIRST_ITEMS:
+            start = rng.randint(1000, 2000)
+        else:
+            start = stop + WORD_APPEAR_OFFSET + rng.randint(200, 1500)
+        stop = start + rng.randint(400, 1200)
+        rows.append((prompt_id, rng.choice(VOCABULARY), start, stop))
+        # speech starts a little after the button press and ends before the next press
+        bursts.append(((start + rng.randint(50, 300)) / 1000, (stop - rng.randint(0, 100)) / 1000))
+    return rows, bursts, stop / 1000 + 1.0
+
+
+def story_task(prompt_lines, rng):
+    """
+    Returns the timed words (word, start, end in s), the speech bursts and the duration (s) of 1 story recording.
+    Readers differ in speed, so some stories run over 180s.
+    """
+    tempo = rng.uniform(0.8, 1.2)
+    t = rng.uniform(1.0, 3.0)
+    timed_words = []
+    for line in prompt_lines:
+        for word in line.rstrip(".").split():
+            length = 0.35 * tempo * rng.uniform(0.7, 1.3)
+            timed_words.append((word, t, t + length))
+            t += length + 0.1 * tempo
+        t += 0.8 * tempo
+    bursts = [(start, end) for word, start, end in timed_words]
+    return timed_words, bursts, t + 1.0
+
+
+def write_log(path, speaker, rows):
+    """Writes a ;-delimited task log like the SERDA admin export."""
+    with open(path, "w", encoding="utf-8") as log_out:
+        log_out.write("User_id;prompt_id;prompt;start_speak;stop_speak\n")
+        for prompt_id, prompt, start, stop in rows:
+            log_out.write(f"{speaker};{prompt_id};{prompt};{start};{stop}\n")
+
+
+def write_json(path, segments, words = None):
+    """Writes ASR output in the WhisperT layout (segments only) or the WhisperX layout (with word timestamps)."""
+    asr = {"segments": segments}
+    if words is not None:
+        asr["word_segments"] = words
+    with open(path, "w", encoding="utf-8") as asr_out:
+        json.dump(asr, asr_out)
+
+
+def to_webm(wav_path):
+    """Encodes a .wav file to .webm (opus) with ffmpeg and removes the .wav. Returns the .webm path."""
+    webm_path = f"{os.path.splitext(wav_path)[0]}.webm"
+    run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", wav_path, "-c:a", "libopus", webm_path],
+        check=True, capture_output=True)
+    os.remove(wav_path)
+    return webm_path
+
+
+def generate_cohort(out_dir, n_speakers = 4, sample_rate = 16000, seed = 1, webm = None):
+    """
+    Generates a synthetic cohort of n_speakers x 6 tasks under out_dir:
+    audio.zip, logs.zip, raw_prompts/, recs_to_ignore.txt, features.txt,
+    asr/words and asr/stories. Audio is converted to .webm when webm is True
+    (default: when ffmpeg is available). Returns a dict with the paths and counts.
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    webm = shutil.which("ffmpeg") is not None if webm is None else webm
+    info = audio_io.WavInfo(audio_io.WAVE_FORMAT_PCM, 1, sample_rate, 32, 0, 0)
+
+    raw_audio = os.path.join(out_dir, "raw", "audio")
+    raw_logs = os.path.join(out_dir, "raw", "logs")
+    raw_prompts = os.path.join(out_dir, "raw_prompts")
+    asr_words_dir = os.path.join(out_dir, "asr", "words")
+    asr_stories_dir = os.path.join(out_dir, "asr", "stories")
+    for mydir in [raw_audio, raw_logs, raw_prompts, asr_words_dir, asr_stories_dir]:
+        pathlib.Path(mydir).mkdir(parents=True, exist_ok=True)
+
+    # story prompts: 1 sentence per line
+    stories = {}
+    for story_nr in [1, 2, 3]:
+        stories[story_nr] = [" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(5, 11))).capitalize() + "."
+                             for _ in range(N_STORY_LINES)]
+        with open(os.path.join(raw_prompts, f"story{story_nr}_clean.txt"), "w", encoding="utf-8") as prompt_out:
+            prompt_out.write("\n".join(stories[story_nr]) + "\n")
+
+    # features file: ADAPT reads the symbol in the first column of the first 93 lines
+    features_file = os.path.join(out_dir, "features.txt")
+    with open(features_file, "w", encoding="utf-8") as features_out:
+        for symbol in ADAPT_SYMBOLS:
+            features_out.write(f"{symbol} 0 0 0\n")
+
+    ignore_file = os.path.join(out_dir, "recs_to_ignore.txt")
+    open(ignore_file, "w", encoding="utf-8").close()
+
+    n_recordings = n_long = audio_seconds = 0
+    for spk_nr, speaker in enumerate(speaker_ids(n_speakers, rng)):
+        for task_nr, task in enumerate(TASKS):
+            stamp = f"202301{spk_nr % 28 + 1:02d}{9 + task_nr:02d}{rng.randint(0, 59):02d}{rng.randint(0, 59):02d}{rng.randint(0, 999):03d}"
+            rec_id = f"{speaker}-{task}-{stamp}"
+            wav_path = os.path.join(raw_audio, f"{rec_id}.wav")
+
+            if task.startswith("words"):
+                rows, bursts, duration = word_task(rec_id, int(task[-1]), rng)
+                silences = []
+                # WhisperT output for every word segment, named like the segments of serda_data_prep.segment_words
+                segment_chunks = rec_id.rsplit("-", 1)
+                for prompt_id, prompt, start, stop in rows:
+                    tags = [f"{prompt_id}_taskstart", f"{prompt_id}_logstamp"] if prompt_id in FIRST_ITEMS else [str(prompt_id)]
+                    for tag in tags:
+                        segment_id = f"{segment_chunks[0]}_{tag}-{segment_chunks[1]}"
+                        text = asr_text([prompt], rng)
+                        asr_start = round(rng.uniform(0.3, 1.0), 2)
+                        write_json(os.path.join(asr_words_dir, f"{segment_id}.json"),
+                                   [{"id": 0, "start": asr_start, "end": asr_start + 0.5, "text": f" {text}"}])
+                        with open(os.path.join(asr_words_dir, f"{segment_id}.txt"), "w", encoding="utf-8") as txt_out:
+                            txt_out.write(text + "\n")
+            else:
+                story_nr = int(task[-1])
+                timed_words, bursts, duration = story_task(stories[story_nr], rng)
+                silences = []
+                if duration > 180:
+                    # planted silence for the long story trimmer to find
+                    silences = [(180.3, 180.8)]
+                    n_long += 1
+                rows = [(1, f"story{story_nr}", 0, int(duration * 1000))]
+                # WhisperX output with word timestamps for the whole story, in segments of 10 words
+                words = [{"word": word, "start": round(start, 3), "end": round(end, 3)} for word, start, end in timed_words]
+                segments = [{"start": chunk[0]["start"], "end": chunk[-1]["end"],
+                             "text": " " + " ".join(word["word"] for word in chunk), "words": chunk}
+                            for chunk in (words[i:i + 10] for i in range(0, len(words), 10))]
+                write_json(os.path.join(asr_stories_dir, f"{rec_id}.json"), segments, words)
+                with open(os.path.join(asr_stories_dir, f"{rec_id}.txt"), "w", encoding="utf-8") as txt_out:
+                    txt_out.write(asr_text([word for word, start, end in timed_words], rng) + "\n")
+
+            audio_io.write_wav(wav_path, info, render(duration, bursts, sample_rate, np_rng, silences))
+            if webm:
+                to_webm(wav_path)
+            # the admin export adds a redundant '-$...' part to log filenames
+            write_log(os.path.join(raw_logs, f"{rec_id}-${rng.randint(0, 10 ** 6):06d}.csv"), speaker, rows)
+            n_recordings += 1
+            audio_seconds += duration
+
+    audio_zip = os.path.join(out_dir, "audio.zip")
+    log_zip = os.path.join(out_dir, "logs.zip")
+    with zipfile.ZipFile(audio_zip, "w", zipfile.ZIP_STORED) as zipped:
+        for filename in sorted(os.listdir(raw_audio)):
+            zipped.write(os.path.join(raw_audio, filename), f"audio/{filename}")
+    with zipfile.ZipFile(log_zip, "w", zipfile.ZIP_DEFLATED) as zipped:
+        for filename in sorted(os.listdir(raw_logs)):
+            zipped.write(os.path.join(raw_logs, filename), f"logs/{filename}")
+    # the zips are the raw downloads; the unzipped files are not needed anymore
+    shutil.rmtree(os.path.join(out_dir, "raw"))
+
+    return {"audio_zip": audio_zip, "log_zip": log_zip, "audio_extension": ".webm" if webm else ".wav",
+            "raw_prompts": raw_prompts, "recs_to_ignore": ignore_file, "features_file": features_file,
+            "asr_words": asr_words_dir, "asr_stories": asr_stories_dir,
+            "speakers": n_speakers, "recordings": n_recordings, "long_stories": n_long,
+            "audio_seconds": audio_seconds}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('out_dir', help = "Directory to generate the cohort in")
+    parser.add_argument('-n', '--speakers', type=int, default=4, help = "Number of speakers. Default = 4")
+    parser.add_argument('--sample-rate', type=int, default=16000, help = "Sample rate of the audio. Default = 16000")
+    parser.add_argument('--seed', type=int, default=1, help = "Random seed. Default = 1")
+    parser.add_argument('--no-webm', action='store_true',
+                        help = "Keep the audio as .wav, also when ffmpeg is available")
+    args = parser.parse_args()
+
+    cohort = generate_cohort(args.out_dir, args.speakers, args.sample_rate, args.seed, False if args.no_webm else None)
+    print(f"Generated {cohort['recordings']} recordings ({cohort['audio_seconds']:.0f}s of audio,"
+          f" {cohort['long_stories']} stories over 180s) for {cohort['speakers']} speakers in {args.out_dir}.")
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+Benchmark of the compiled text normalisation (TextNormalizer.normalize_line) against the
+word-by-word filters (normalize_line_legacy = clean_word + remove_accents_from_lower),
+for both the ADAPT (<unk>) and the no-unk variant. Also checks that both give identical output.
+
+Expected input: optional text files to normalise (default: synthetic ASR-like lines),
+optional --features ADAPT features file, optional -n number of synthetic lines
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "string_norm"))
+from text_filter_adapt import TextNormalizer, FEATURES_FILE
+
+WORDS = ["de", "kat", "zat", "op", "mat", "één", "café", "naïve", "Straße", "xxx", "ggg", "3de",
+         "21", "1000", "12.5", "-3", "a1b", "[noise]", "wo*rd", "dat=is", "het’s", "Hallo!", "ok?", "ñandu"]
+
+
+def synthetic_lines(n_lines, seed = 1):
+    """Generates n_lines of ASR-like text from a small vocabulary with symbols, digits and accents."""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 20))) for _ in range(n_lines)]
+
+
+def time_lines(normalize, lines, repeats):
+    """Returns the best time in seconds of `repeats` runs of normalize over all lines, and the output."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = [normalize(line) for line in lines]
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def bench(lines, features_file, repeats = 3):
+    """Benchmarks both variants on lines and returns a list of result dicts."""
+    results = []
+    for unk in [True, False]:
+        if unk and not os.path.isfile(features_file):
+            print(f"ADAPT features file {features_file} not found, skipping the <unk> variant.")
+            continue
+        normalizer = TextNormalizer(unk=unk, features_file=features_file)
+        legacy_time, legacy_output = time_lines(normalizer.normalize_line_legacy, lines, repeats)
+        # clear the per-character cache, so the compiled run includes filling it
+        normalizer.char_table.clear()
+        compiled_time, compiled_output = time_lines(normalizer.normalize_line, lines, repeats)
+        results.append({
+            "variant": "adapt" if unk else "no-unk",
+            "lines": len(lines),
+            "legacy_s": legacy_time,
+            "compiled_s": compiled_time,
+            "speedup": legacy_time / compiled_time if compiled_time else float("inf"),
+            "identical": legacy_output == compiled_output,
+        })
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('infiles', nargs='*', help = "Text files to normalise. Default = synthetic lines")
+    parser.add_argument('--features', default=FEATURES_FILE, help = "ADAPT features file")
+    parser.add_argument('-n', '--lines', type=int, default=20000, help = "Number of synthetic lines. Default = 20000")
+    parser.add_argument('-r', '--repeats', type=int, default=3, help = "Number of timed runs (best is kept)")
+    args = parser.parse_args()
+
+    if args.infiles:
+        text_lines = []
+        for infile in args.infiles:
+            with open(infile, "r", encoding="utf-8") as text_in:
+                text_lines += text_in.readlines()
+    else:
+        text_lines = synthetic_lines(args.lines)
+
+    for result in bench(text_lines, args.features, args.repeats):
+        print(f"{result['variant']:>7}: {result['lines']} lines, legacy {result['legacy_s']:.3f}s,"
+              f" compiled {result['compiled_s']:.3f}s, speedup {result['speedup']:.1f}x,"
+              f" identical output: {result['identical']}")
@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+Project catalog for the SERDA scripts: 1 SQLite file that lists every recording, long story original,
+log, prompt, segment and ASR output of a project with its rec_id, task type, speaker, size and duration.
+Stages add the files they write, so later stages and non-clean runs can look files up with a query
+instead of walking (NFS) directories. A directory that is not in the catalog yet is walked once
+the first time it is queried; run this script with -s/--scan to pick up files that were added
+or removed by hand (e.g. new ASR output).
+
+Expected input: 1) path of the catalog (e.g. myproject/serda_catalog.sqlite), 2) optional -s/--scan
+with a kind and a directory to scan again (can be repeated)
+"""
+
+import os
+import sqlite3
+import argparse
+import audio_io
+
+CATALOG_NAME = "serda_catalog.sqlite"
+
+# extensions of each kind of file and directories that are left out when a directory is scanned for it
+KINDS = {
+    "recording": (audio_io.AUDIO_EXTENSIONS, {"segments", "long_stories", "kaldi"}),
+    "long_story": (audio_io.AUDIO_EXTENSIONS, set()),
+    "segment": (audio_io.AUDIO_EXTENSIONS, set()),
+    "log": ((".csv",), set()),
+    "prompt": ((".prompt",), set()),
+    "asr": ((".json", ".txt"), set()),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    rec_id TEXT,
+    task TEXT,
+    speaker TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS files_kind ON files (kind, path);
+CREATE INDEX IF NOT EXISTS files_rec_id ON files (rec_id);
+CREATE TABLE IF NOT EXISTS scans (
+    kind TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    PRIMARY KEY (kind, directory)
+);
+"""
+
+
+def file_rec_id(path):
+    """Returns the recording ID of a recording, log, story prompt or ASR output file from its name."""
+    rec_id = os.path.basename(path).split('.')[0]
+    return rec_id.replace('_timestamps', '').replace('-timestamps', '')
+
+
+def task_of(rec_id):
+    """Returns the task type ('words' or 'story') of a recording ID, or None."""
+    if "words" in rec_id:
+        return "words"
+    if "story" in rec_id:
+        return "story"
+    return None
+
+
+class Catalog:
+    """
+    Maps file paths (stored relative to the directory of the catalog) to their kind (see KINDS),
+    rec_id, task, speaker, size, mtime and duration. Changes are written to disk with save().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(path)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.executescript(SCHEMA)
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.root or os.curdir)
+
+    def add(self, kind, paths, rec_id = None, durations = None):
+        """
+        Adds (or updates) existing files of kind to the catalog. rec_id is taken from each filename
+        unless it is given (e.g. for segments), durations is an optional dict 'path': duration in seconds.
+        """
+        rows = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            path_rec_id = rec_id or file_rec_id(path)
+            rows.append((self._relative(path), kind, path_rec_id, task_of(path_rec_id), path_rec_id.split("-")[0],
+                         stat.st_size, stat.st_mtime_ns, (durations or {}).get(path)))
+        self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def set_durations(self, durations):
+        """Stores the durations (dict 'path': duration in seconds) of files in the catalog."""
+        self.connection.executemany("UPDATE files SET duration = ? WHERE path = ?",
+                                    [(duration, self._relative(path)) for path, duration in durations.items()])
+
+    def remove(self, paths):
+        """Removes files from the catalog."""
+        self.connection.executemany("DELETE FROM files WHERE path = ?", [(self._relative(path),) for path in paths])
+
+    def remove_under(self, directory, kind = None):
+        """Removes all files (of kind) under directory from the catalog."""
+        query, params = self._under(directory)
+        if kind is not None:
+            query, params = f"{query} AND kind = ?", params + [kind]
+        self.connection.execute(f"DELETE FROM files WHERE {query}", params)
+
+    def _under(self, directory):
+        """Returns a WHERE clause and its parameters for all paths under directory (a range on the primary key)."""
+        relative_dir = self._relative(directory)
+        if relative_dir == os.curdir:
+            return "1", []
+        # '0' is the character after '/', so this range holds exactly the paths that start with relative_dir/
+        return "path >= ? AND path < ?", [f"{relative_dir}/", f"{relative_dir}0"]
+
+    def is_scanned(self, kind, directory):
+        """Checks whether directory (or a directory above it) was scanned for kind."""
+        relative_dir = self._relative(directory)
+        scanned = [row[0] for row in self.connection.execute("SELECT directory FROM scans WHERE kind = ?", (kind,))]
+        return any(scanned_dir == os.curdir or relative_dir == scanned_dir or relative_dir.startswith(f"{scanned_dir}/")
+                   for scanned_dir in scanned)
+
+    def scan(self, kind, directory):
+        """
+        Walks directory once and replaces the files of kind under it in the catalog by the files on disk,
+        leaving out the directories KINDS excludes for kind. Returns the number of files found.
+        """
+        extensions, excluded_dirs = KINDS[kind]
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [dirname for dirname in dirnames if dirname not in excluded_dirs]
+            paths += [os.path.join(dirpath, filename) for filename in filenames if filename.endswith(extensions)]
+        self.remove_under(directory, kind)
+        self.add(kind, paths)
+        self.connection.execute("INSERT OR REPLACE INTO scans VALUES (?, ?)", (kind, self._relative(directory)))
+        return len(paths)
+
+    def find(self, kind, directory):
+        """
+        Returns the sorted paths of all files of kind under directory, starting with directory as it is given.
+        The directory is scanned first if it is not in the catalog yet, or scanned again when the catalog
+        has no files under it (e.g. a directory that was copied in by hand).
+        """
+        query, params = self._under(directory)
+        select = f"SELECT path FROM files WHERE kind = ? AND {query} ORDER BY path"
+        rows = self.connection.execute(select, [kind] + params).fetchall() if self.is_scanned(kind, directory) else []
+        if not rows:
+            self.scan(kind, directory)
+            rows = self.connection.execute(select, [kind] + params).fetchall()
+        # strip the relative directory (and its '/') from the stored paths
+        n_strip = len(params[0]) if params else 0
+        return [os.path.join(directory, row[0][n_strip:]) for row in rows]
+
+    def summary(self):
+        """Returns a dict with items 'kind': (number of files, bytes, seconds of audio)."""
+        rows = self.connection.execute("SELECT kind, COUNT(*), SUM(size), SUM(duration) FROM files GROUP BY kind")
+        return {kind: (n_files, n_bytes or 0, seconds or 0.0) for kind, n_files, n_bytes, seconds in rows}
+
+    def merge(self, other_path, other_root = None):
+        """
+        Adds all files and scans of the catalog at other_path, with paths relative to this catalog.
+        The paths of the other catalog are taken relative to other_root (default: the directory of other_path),
+        e.g. other_root = the directory of this catalog rebases the paths of a shard catalog onto this project.
+        """
+        if other_root is None:
+            other_root = os.path.dirname(other_path)
+        prefix = self._relative(other_root or os.curdir)
+        prefix = "" if prefix == os.curdir else f"{prefix}/"
+        self.connection.execute("ATTACH DATABASE ? AS other", (other_path,))
+        self.connection.execute("INSERT OR REPLACE INTO files SELECT ? || path, kind, rec_id, task, speaker, size,"
+                                " mtime_ns, duration FROM other.files", (prefix,))
+        self.connection.execute("INSERT OR REPLACE INTO scans SELECT kind, CASE directory WHEN '.' THEN ?"
+                                " ELSE ? || directory END FROM other.scans", (prefix.rstrip("/") or os.curdir, prefix))
+        self.connection.commit()
+        self.connection.execute("DETACH DATABASE other")
+
+    def save(self):
+        """Writes all changes to disk."""
+        self.connection.commit()
+
+    def close(self):
+        """Writes all changes to disk and closes the catalog."""
+        self.connection.commit()
+        self.connection.close()
+
+
+def open_catalog(project_dir):
+    """Returns the Catalog of project_dir if it has one, or None."""
+    path = os.path.join(project_dir, CATALOG_NAME)
+    return Catalog(path) if os.path.isfile(path) else None
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('catalog', help = f"Path of the catalog, e.g. myproject/{CATALOG_NAME}")
+    parser.add_argument('-s', '--scan', nargs=2, action='append', default=[], metavar=('KIND', 'DIR'),
+                        help = f"Scan DIR again for files of KIND ({', '.join(KINDS)}), e.g. -s asr myproject/asr")
+    args = parser.parse_args()
+    for kind, directory in args.scan:
+        if kind not in KINDS:
+            parser.error(f"Unknown kind '{kind}', choose from {', '.join(KINDS)}.")
+
+    project_catalog = Catalog(args.catalog)
+    for kind, directory in args.scan:
+        print(f"Found {project_catalog.scan(kind, directory)} {kind} files in {directory}.")
+    for kind, (n_files, n_bytes, seconds) in sorted(project_catalog.summary().items()):
+        print(f"\t{kind:<12} {n_files:8} files, {n_bytes / 2 ** 20:10.1f} MB"
+              + (f", {seconds / 3600:.1f} hours" if seconds else ""))
+    project_catalog.close()
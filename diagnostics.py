@@ -5,7 +5,7 @@
 @Author:        Bo Molenaar
 @Date:          5 April 2023
 
-@Last edited:    12 April 2023
+@Last edited:    18 October 2026
 
 This script takes ASR output aligned with prompts 
 for a collection of SERDA oral reading task data 
@@ -16,133 +16,198 @@ and wrangles it into two output files:
 
 import os
 import argparse
-import json
+import numpy as np
 import pandas as pd
+import log_store
+import instrument
+import asr_index
+from catalog import Catalog
+from serda_data_prep import FIRST_ITEMS, WORD_APPEAR_OFFSET, SEGMENT_PAD
 
-parser = argparse.ArgumentParser()
-parser.add_argument('asr_dir',
-                    help = "The directory where your ASR transcriptions are located.")
-parser.add_argument('log_dir',
-                    help = "The directory where the reading prompts are located.")
-parser.add_argument('adaptfile',
-                    help = "File containing ADAPT alignments of your ASR transcriptions"
-                    "and reading prompts.")
-parser.add_argument('correct_outfile',
-                    help = "File to write ASR correctness judgements to.")
-parser.add_argument('speed_outfile',
-                    help = "File to write reading speed values to.")
-args = parser.parse_args()
-ALIGNMENTS = args.adaptfile
-AO_DIR = args.asr_dir
-LOGS_DIR = args.log_dir
-COR_OUT = args.correct_outfile
-SPEED_OUT = args.speed_outfile
-
-def diagnose_correctness(alignments, outfile):
+
+def read_table(path, columns = None):
+    """
+    Reads a table by its extension: .csv, .tsv/.txt (tab separated), .parquet, .pkl or .xlsx/.xls.
+    Only `columns` are read where the format allows it.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return pd.read_csv(path, usecols=columns)
+    if extension in [".tsv", ".txt"]:
+        return pd.read_csv(path, sep="\t", usecols=columns)
+    if extension == ".parquet":
+        return pd.read_parquet(path, columns=columns)
+    if extension == ".pkl":
+        table = pd.read_pickle(path)
+        return table[columns] if columns else table
+    return pd.read_excel(path, usecols=columns)
+
+
+def write_table(table, path):
+    """Writes a table by the extension of path: .parquet, .pkl, .tsv/.txt or .csv (any other extension)."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        table.columns = table.columns.astype(str)
+        table.to_parquet(path)
+    elif extension == ".pkl":
+        table.to_pickle(path)
+    elif extension in [".tsv", ".txt"]:
+        table.to_csv(path, sep="\t")
+    else:
+        table.to_csv(path)
+
+
+def split_wav_ids(wav_ids):
+    """
+    Breaks up wav_ids (<speaker ID>-<item ID>-...) into the identification components we need.
+    Returns two arrays: speaker IDs and item IDs.
+    """
+    id_comps = pd.Series(wav_ids).astype(str).str.split('-', n=2, expand=True)
+    if id_comps.shape[1] < 2 or id_comps[1].isna().any():
+        raise ValueError("Every wav_id should look like <speaker ID>-<item ID>[-...]")
+    return id_comps[0].to_numpy(), id_comps[1].to_numpy()
+
+
+def item_speaker_matrix(items, speakers, values):
+    """
+    Builds the item x speaker matrix of values directly from their codes
+    (sorted on both axes like pivot; if an item occurs twice for a speaker, the last value is kept).
+    Returns the matrix and the item and speaker code of each value.
+    """
+    item_codes, item_ids = pd.factorize(items, sort=True)
+    speaker_codes, speaker_ids = pd.factorize(speakers, sort=True)
+    matrix = np.full((len(item_ids), len(speaker_ids)), np.nan)
+    matrix[item_codes, speaker_codes] = values
+    matrix = pd.DataFrame(matrix, index=pd.Index(item_ids, name='Item ID'),
+                          columns=pd.Index(speaker_ids, name='Speaker ID'))
+    return matrix, item_codes, speaker_codes
+
+
+def summarize(codes, labels, values, label_name):
+    """Per-label count and mean of values (NaN values are left out), computed with bincount."""
+    valid = ~np.isnan(values)
+    counts = np.bincount(codes[valid], minlength=len(labels))
+    sums = np.bincount(codes[valid], weights=values[valid], minlength=len(labels))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return pd.DataFrame({"n": counts, "mean": means}, index=pd.Index(labels, name=label_name))
+
+
+def write_diagnostics(items, speakers, values, outfile, item_summary = None, speaker_summary = None):
+    """
+    Writes the item x speaker matrix of values to outfile and, optionally,
+    per-item and per-speaker summaries (count and mean) from the same codes.
+    """
+    matrix, item_codes, speaker_codes = item_speaker_matrix(items, speakers, values)
+    write_table(matrix, outfile)
+    if item_summary:
+        write_table(summarize(item_codes, matrix.index, values, 'Item ID'), item_summary)
+    if speaker_summary:
+        write_table(summarize(speaker_codes, matrix.columns, values, 'Speaker ID'), speaker_summary)
+    return matrix
+
+
+def diagnose_correctness(alignments, outfile, item_summary = None, speaker_summary = None):
     """
     get automatic accuracy diagnostics for pairs of ASR output and reading prompts, using their ADAPT alignments
+    alignments can be .csv, .tsv, .parquet, .pkl or .xlsx (slow); outfile is written in the format of its extension
+    """
+    df = read_table(alignments, columns=['wav_id', 'correct'])
+    spk_ids, item_ids = split_wav_ids(df['wav_id'])
+    correct = pd.to_numeric(df['correct'], errors='coerce').to_numpy(dtype=float)
+
+    return write_diagnostics(item_ids, spk_ids, correct, outfile, item_summary, speaker_summary)
+
+def word_times(logs):
     """
-    df = pd.read_excel(alignments).set_index('wav_id')
-    full_data = []
-
-    for wav_id, row in df.iterrows():    # elicit the information we want into a dict with wav_id as keys
-        correct = row['correct']
-
-        # break up wav_id into all idenfication components it contains
-        id_comps = str(wav_id).split('-')
-        spk_id, item_specifier = id_comps[0], id_comps[1]
-        # task_comps = task_specifier.split('_')
-        # task_type = task_comps[0]
-        # task_id = task_comps[:1]
-        # prompt_id = task_comps[:-1]
-
-        # now we make a list of tuples that includes item ID, speaker ID and correct
-        # using wav_id to get unique combinations
-        full_data.append((item_specifier, spk_id, correct))
-    
-    # some pandas magic
-    # load tuples as columns
-    df2 = pd.DataFrame(full_data, columns=['Item ID', 'Speaker ID', 'Correct'])
-    # now use pivot to set tuple columns to index, columns and values :)
-    df_final = df2.pivot(index='Item ID', columns='Speaker ID', values='Correct')
-
-    df_final.to_csv(outfile)
-
-def diagnose_speed(ao_dir, log_dir, outfile):
+    Takes the log table and returns 1 row per word item (indexed like the log table) with
+    the ID of the segment ASR was run on, when the word appeared on screen (= prev word end + 1323ms,
+    which is also where its segment starts in the recording) and the start_speak timestamp, both in s.
+    First items of a task use the segment that starts at the beginning of the recording (taskstart),
+    so their appearance is 0.
+    """
+    words = logs[logs['task'] == 'words']
+    rec_ids = words.index.get_level_values('rec_id').to_series(index=words.index)
+    prompt_ids = words.index.get_level_values('prompt_id').to_series(index=words.index)
+    first_item = prompt_ids.isin(FIRST_ITEMS).to_numpy()
+
+    # same names as the segments written by serda_data_prep.segment_words
+    segment_chunks = rec_ids.str.rsplit('-', n=1, expand=True)
+    segment_tags = prompt_ids.astype(str).where(~first_item, prompt_ids.astype(str) + '_taskstart')
+    segment_ids = segment_chunks[0] + '_' + segment_tags + '-' + segment_chunks[1]
+
+    prev_stop = words.groupby(level='rec_id', sort=False)['stop_speak'].shift().to_numpy()
+    appearance = np.where(first_item, 0, (prev_stop + WORD_APPEAR_OFFSET) / 1000)
+    return pd.DataFrame({'segment_id': segment_ids, 'appearance': appearance,
+                         'start_speak': words['start_speak'].to_numpy() / 1000}, index=words.index)
+
+
+def diagnose_speed(ao_dir, log_dir, outfile, item_summary = None, speaker_summary = None, jobs = None, catalog = None):
     """
     get automatic speed diagnostics for pairs of ASR output and reading prompts, using SERDA logs and ASR timestamps
+    reading time = time between word appearance and start speaking (either button press or asr timestamp,
+    whichever is sooner); outfile is written in the format of its extension.
+    Logs and ASR output are looked up in catalog (a catalog.Catalog), if given
     """
-    # collect log files in a list and dict
-    log_filelist = []
-    log_files = {}
-    for dirpath, dirnames, filenames in os.walk(log_dir):
-        for filename in filenames:
-            if filename.endswith(".csv"):
-                log_filelist.append(filename)
-                rec_id = filename.split('.')[0]
-                log_files[rec_id] = os.path.join(dirpath, filename)
-    
-    # collect asr output files in a list and dict
-    ao_filelist = []
-    ao_files = {}
-    for dirpath, dirnames, filenames in os.walk(ao_dir):
-        for filename in filenames:
-            if filename.endswith(".json"):
-                if 'whisperx' in ao_dir:  # specifically get timestamped files for whisperX
-                    if 'timestamps' not in filename:
-                        continue
-                else:
-                    ao_filelist.append(filename)
-                    rec_id = filename.split(".")[0]
-                    ao_files[rec_id] = os.path.join(dirpath, filename)
-
-    full_data = []
-    for rec_id, log_file in log_files.items():
-        timestamps = {}
-
-        # TODO get timestamps from log for words 1-50
-        log_data = pd.read_csv(log_file, delimiter=";", index_col="user_id")
-        for speaker_id, row in log_data.iterrows():
-            prompt_id = row['prompt_id']
-            start_time_log = row['start_speak']/1000
-            end_time_log = row['stop_speak']/1000
-
-        # TODO get timestamps from ASR for words 1-50
-        # TODO exception case for whisperX because the timestamped files have different structure
-        # following works for regular .json (whisperT)
-        ao_file = ""
-        with open(ao_file, 'r', encoding='utf-8') as ao_in:
-            ao = json.load(ao_in)
-            # subtract 0.3 seconds from first timestamp because there is 0.3s silence buffer around asr input audio
-            start_time_ao = min(ao['segments'][0]['start']-0.3, 0)
-
-        # TODO calculate time between word appearance and start speaking (either button press or asr timestamp, which ever is sooner)
-    
-    # then construct a dataframe similar to diagnose_correctness
-    mylist = []
-    for wav_id, row in enumerate(mylist):    # elicit the information we want into a dict with wav_id as keys
-        
-        speed = ""
-
-        # break up wav_id into all idenfication components it contains
-        id_comps = str(wav_id).split('-')
-        spk_id, item_specifier = id_comps[0], id_comps[1]
-        # task_comps = task_specifier.split('_')
-        # task_type = task_comps[0]
-        # task_id = task_comps[:1]
-        # prompt_id = task_comps[:-1]
-
-        # now we make a list of tuples that includes item ID, speaker ID and correct
-        # using wav_id to get unique combinations
-        full_data.append((item_specifier, spk_id, speed))
-    
-    # some pandas magic
-    # load tuples as columns
-    df2 = pd.DataFrame(full_data, columns=['Item ID', 'Speaker ID', 'Reading time'])
-    # now use pivot to set tuple columns to index, columns and values :)
-    df_final = df2.pivot(index='Item ID', columns='Speaker ID', values='Reading time')
-
-    df_final.to_csv(outfile)
-
-# diagnose_correctness(ALIGNMENTS, COR_OUT)
-diagnose_speed(AO_DIR, LOGS_DIR, SPEED_OUT)
+    # load all logs at once (or from the stored log table)
+    words = word_times(log_store.get_log_store(log_dir, jobs=jobs, catalog=catalog))
+
+    # look up the first timestamp of each word segment in the ASR table (parsed in parallel when it is outdated)
+    asr_table = asr_index.get_asr_index(ao_dir, jobs=jobs, catalog=catalog)
+    asr_start = words['segment_id'].map(asr_index.first_word_starts(asr_table))
+    asr_start = asr_start.to_numpy(dtype=float)
+    print(f"\tFound ASR timestamps for {np.isfinite(asr_start).sum()} of {len(words)} word segments.")
+
+    # subtract 0.3 seconds from the ASR timestamp because there is 0.3s silence buffer around asr input audio
+    onset = words['appearance'].to_numpy() + np.maximum(asr_start - SEGMENT_PAD, 0)
+    # fmin ignores a missing value on either side, so a word without ASR output still gets the log time
+    reading_time = np.fmin(words['start_speak'].to_numpy(), onset) - words['appearance'].to_numpy()
+
+    # then construct the item x speaker matrix like diagnose_correctness
+    spk_ids, item_ids = split_wav_ids(words['segment_id'])
+    return write_diagnostics(item_ids, spk_ids, reading_time, outfile, item_summary, speaker_summary)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('asr_dir',
+                        help = "The directory where your ASR transcriptions are located.")
+    parser.add_argument('log_dir',
+                        help = "The directory where the reading prompts are located.")
+    parser.add_argument('adaptfile',
+                        help = "File containing ADAPT alignments of your ASR transcriptions"
+                        " and reading prompts (.csv, .tsv, .parquet, .pkl or .xlsx).")
+    parser.add_argument('correct_outfile',
+                        help = "File to write ASR correctness judgements to"
+                        " (.csv, .tsv, .parquet or .pkl, by extension).")
+    parser.add_argument('speed_outfile',
+                        help = "File to write reading speed values to.")
+    parser.add_argument('--item-summary', default=None,
+                        help = "Optional file to write the number of words and mean correctness per item to.")
+    parser.add_argument('--speaker-summary', default=None,
+                        help = "Optional file to write the number of words and mean correctness per speaker to.")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help = "Number of ASR files parsed in parallel. Default = number of cores")
+    parser.add_argument('--report', default=None,
+                        help = "Optional JSON file to write a run report (time and CPU time per stage) to.")
+    parser.add_argument('--catalog', default=None,
+                        help = "Optional project catalog (see catalog.py) to look up logs and ASR output in,"
+                        " instead of walking asr_dir and log_dir.")
+    args = parser.parse_args()
+    ALIGNMENTS = args.adaptfile
+    AO_DIR = args.asr_dir
+    LOGS_DIR = args.log_dir
+    COR_OUT = args.correct_outfile
+    SPEED_OUT = args.speed_outfile
+    ITEM_SUMMARY = args.item_summary
+    SPEAKER_SUMMARY = args.speaker_summary
+
+    with instrument.stage("correctness"):
+        diagnose_correctness(ALIGNMENTS, COR_OUT, ITEM_SUMMARY, SPEAKER_SUMMARY)
+        instrument.add_files(1, instrument.file_sizes([COR_OUT]))
+    with instrument.stage("speed"):
+        diagnose_speed(AO_DIR, LOGS_DIR, SPEED_OUT, jobs=args.jobs, catalog=Catalog(args.catalog) if args.catalog else None)
+        instrument.add_files(1, instrument.file_sizes([SPEED_OUT]))
+    if args.report:
+        instrument.print_summary(instrument.write_report(args.report))
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+Run instrumentation for the SERDA scripts.
+Stages (with stage(...)) record their wall time, the CPU time of this process and of its child processes
+(ffmpeg, sox, unzip and finished worker processes, which process_time() leaves out),
+the files and bytes they processed (add_files) and the external commands they started (count_command).
+Recordings (with recording(...)) record their wall time and external commands per stage,
+so the slowest recordings can be flagged. Everything is collected in this module for the
+current run and can be written as a JSON run report with write_report.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+RUN_REPORT_NAME = "serda_run_report.json"
+# number of slowest recordings listed in the run report
+N_SLOWEST = 10
+
+_lock = threading.Lock()
+_local = threading.local()
+_totals = {"files": 0, "bytes": 0, "subprocesses": 0, "subprocess_s": 0.0}
+_stages = []
+_recordings = {}
+_commands = {}
+_info = {}
+_started = (time.time(), time.perf_counter())
+
+
+def child_cpu_time():
+    """User + system CPU time (s) of all child processes that finished and were waited for."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _counters():
+    """Snapshot of all counters a stage reports the change of."""
+    with _lock:
+        return dict(_totals, wall_s=time.perf_counter(), cpu_s=time.process_time(), child_cpu_s=child_cpu_time())
+
+
+def add_files(n_files, n_bytes = 0):
+    """Counts n_files files (of n_bytes bytes in total) as processed by the running stage(s)."""
+    with _lock:
+        _totals["files"] += n_files
+        _totals["bytes"] += n_bytes
+
+
+def set_info(name, value):
+    """Stores a JSON-serialisable value (e.g. the audio format and storage) under name in the run report."""
+    with _lock:
+        _info[name] = value
+
+
+def file_sizes(paths):
+    """Total size in bytes of the existing files in paths."""
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+
+@contextmanager
+def stage(name):
+    """
+    Records the code in the with block as stage `name`. Stages can be nested;
+    an outer stage includes everything its inner stages record.
+    """
+    before = _counters()
+    try:
+        yield
+    finally:
+        after = _counters()
+        record = {"stage": name}
+        for key in ["wall_s", "cpu_s", "child_cpu_s", "subprocesses", "subprocess_s", "files", "bytes"]:
+            record[key] = after[key] - before[key]
+        with _lock:
+            _stages.append(record)
+
+
+def add_recording(stage_name, rec_id, seconds, subprocesses = 0):
+    """Adds seconds and subprocesses (external commands) to the record of 1 recording in stage stage_name."""
+    with _lock:
+        rec_record = _recordings.setdefault(stage_name, {}).setdefault(rec_id, {"seconds": 0.0, "subprocesses": 0})
+        rec_record["seconds"] += seconds
+        rec_record["subprocesses"] += subprocesses
+
+
+@contextmanager
+def recording(stage_name, rec_id):
+    """
+    Records the wall time and the external commands of 1 recording in stage stage_name.
+    Commands counted with count_command in the same thread are counted for this recording.
+    """
+    _local.subprocesses = 0
+    _local.recording = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.recording = False
+        add_recording(stage_name, rec_id, time.perf_counter() - start, _local.subprocesses)
+
+
+def count_command(args0, seconds, failed):
+    """
+    Counts 1 finished external command (by tool name, from its first argument) and its wall time
+    for the run report, and for the current recording, if any. See scheduler.py.
+    """
+    tool = os.path.basename(str(args0))
+    with _lock:
+        _totals["subprocesses"] += 1
+        _totals["subprocess_s"] += seconds
+        command = _commands.setdefault(tool, {"count": 0, "seconds": 0.0, "failed": 0})
+        command["count"] += 1
+        command["seconds"] += seconds
+        command["failed"] += failed
+    if getattr(_local, "recording", False):
+        _local.subprocesses += 1
+
+
+def slowest_recordings(n = N_SLOWEST):
+    """Returns the n slowest recordings over all stages as a list of dicts (stage, rec_id, seconds, subprocesses)."""
+    with _lock:
+        rec_records = [{"stage": stage_name, "rec_id": rec_id, **rec_record}
+                       for stage_name, stage_recordings in _recordings.items()
+                       for rec_id, rec_record in stage_recordings.items()]
+    return sorted(rec_records, key=lambda rec_record: rec_record["seconds"], reverse=True)[:n]
+
+
+def report():
+    """Returns the run report of everything recorded so far as a dict."""
+    with _lock:
+        run_report = {
+            "command": sys.argv,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(_started[0])),
+            "wall_s": time.perf_counter() - _started[1],
+            "cpu_s": time.process_time(),
+            "child_cpu_s": child_cpu_time(),
+            "files": _totals["files"],
+            "bytes": _totals["bytes"],
+            "info": dict(_info),
+            "stages": list(_stages),
+            "commands": dict(_commands),
+            "recordings": {stage_name: dict(stage_recordings) for stage_name, stage_recordings in _recordings.items()},
+        }
+    run_report["slowest_recordings"] = slowest_recordings()
+    return run_report
+
+
+def write_report(path):
+    """Writes the run report to path as JSON and returns it."""
+    run_report = report()
+    with open(path, "w", encoding="utf-8") as report_out:
+        json.dump(run_report, report_out, indent=2)
+    return run_report
+
+
+def print_summary(run_report):
+    """Prints the time per stage, the external commands and the slowest recordings of a run report."""
+    print(f"Elapsed time: {run_report['wall_s']:.1f} s (CPU: {run_report['cpu_s']:.1f} s in this process,"
+          f" {run_report['child_cpu_s']:.1f} s in child processes)")
+    for record in run_report["stages"]:
+        print(f"\t{record['stage']:<16} {record['wall_s']:8.1f} s, {record['files']} files"
+              f" ({record['bytes'] / 2 ** 20:.1f} MB, {record['bytes'] / 2 ** 20 / max(record['wall_s'], 1e-9):.1f} MB/s),"
+              f" {record['subprocesses']} commands")
+    for tool, command in sorted(run_report["commands"].items()):
+        print(f"\t{tool}: {command['count']} calls, {command['seconds']:.1f} s, {command['failed']} failed")
+    if run_report["slowest_recordings"]:
+        print("\tSlowest recordings:")
+        for rec_record in run_report["slowest_recordings"]:
+            print(f"\t\t{rec_record['rec_id']} ({rec_record['stage']}): {rec_record['seconds']:.2f} s,"
+                  f" {rec_record['subprocesses']} commands")
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+This script loads all SERDA task logs (logs/words and logs/stories) into one table,
+indexed by (rec_id, prompt_id) with typed start_speak and stop_speak columns (ms).
+The table is stored next to the logs, so later stages and diagnostics can query it
+without parsing every log .csv again. The stored table is rebuilt automatically
+when logs are added, removed or changed. With a project catalog (see catalog.py), the logs are
+looked up in the catalog instead of walking the log directory.
+
+Expected input: 1) log directory, 2) optional -o/--outfile for the stored table
+"""
+
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (parquet engine for pandas)
+    LOG_STORE_NAME = "log_store.parquet"
+except ImportError:
+    LOG_STORE_NAME = "log_store.pkl"
+
+
+def find_logs(log_dir, catalog = None):
+    """Returns a dict with items 'rec_id': 'log path' for all .csv logs under log_dir (from catalog, if given)."""
+    if catalog is not None:
+        return {os.path.basename(path).split('.')[0]: path for path in catalog.find("log", log_dir)}
+    log_files = {}
+    for dirpath, dirnames, filenames in os.walk(log_dir):
+        for filename in filenames:
+            if filename.endswith(".csv"):
+                log_files[filename.split('.')[0]] = os.path.join(dirpath, filename)
+    return log_files
+
+
+def read_log(rec_id, log_file):
+    """Reads 1 task log and adds its rec_id and task type as columns."""
+    log_data = pd.read_csv(log_file, delimiter=";")
+    log_data["start_speak"] = pd.to_numeric(log_data["start_speak"], errors="coerce").astype("float64")
+    log_data["stop_speak"] = pd.to_numeric(log_data["stop_speak"], errors="coerce").astype("float64")
+    log_data.insert(0, "rec_id", rec_id)
+    log_data.insert(1, "task", "words" if "words" in rec_id else "story")
+    return log_data
+
+
+def load_logs(log_files, jobs = None):
+    """
+    Takes a dict with items 'rec_id': 'log path' and parses all logs on a thread pool
+    of `jobs` workers (default: number of cores).
+    Returns 1 DataFrame indexed by (rec_id, prompt_id). Rows keep the order of the log files.
+    """
+    if not log_files:
+        return pd.DataFrame(columns=["task", "start_speak", "stop_speak"],
+                            index=pd.MultiIndex.from_arrays([[], []], names=["rec_id", "prompt_id"]))
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        frames = list(pool.map(read_log, log_files.keys(), log_files.values()))
+    return pd.concat(frames, ignore_index=True).set_index(["rec_id", "prompt_id"])
+
+
+def save_log_store(logs, store_path):
+    """Writes the log table to store_path as parquet (.parquet) or pickle (any other extension)."""
+    if store_path.endswith(".parquet"):
+        logs.to_parquet(store_path)
+    else:
+        logs.to_pickle(store_path)
+
+
+def read_log_store(store_path):
+    """Reads a log table written by save_log_store."""
+    if store_path.endswith(".parquet"):
+        return pd.read_parquet(store_path)
+    return pd.read_pickle(store_path)
+
+
+def get_log_store(log_dir, store_path = None, jobs = None, catalog = None):
+    """
+    Returns the log table for all logs under log_dir.
+    The stored table at store_path (default: log_dir/log_store.parquet or .pkl) is used
+    when it contains exactly the logs on disk and none of them changed since it was written.
+    Otherwise the logs are parsed again and the stored table is replaced.
+    The logs are looked up in catalog (a catalog.Catalog), if given.
+    """
+    store_path = store_path or os.path.join(log_dir, LOG_STORE_NAME)
+    log_files = find_logs(log_dir, catalog)
+
+    if os.path.isfile(store_path):
+        store_mtime = os.stat(store_path).st_mtime_ns
+        if all(os.stat(log_file).st_mtime_ns <= store_mtime for log_file in log_files.values()):
+            logs = read_log_store(store_path)
+            if set(logs.index.unique(level="rec_id")) == set(log_files):
+                return logs
+
+    logs = load_logs(log_files, jobs)
+    save_log_store(logs, store_path)
+    return logs
+
+
+def split_logs(logs):
+    """Returns a dict with items 'rec_id': log table of that recording (indexed by prompt_id)."""
+    return {rec_id: rec_log.droplevel("rec_id") for rec_id, rec_log in logs.groupby(level="rec_id", sort=False)}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('log_dir', help = "Directory with the task logs, e.g. $project/logs")
+    parser.add_argument('-o', '--outfile', default=None,
+                        help = f"Where to store the log table. Default = log_dir/{LOG_STORE_NAME}")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help = "Number of logs parsed in parallel. Default = number of cores")
+    args = parser.parse_args()
+
+    table = get_log_store(args.log_dir, args.outfile, args.jobs)
+    print(f"Log table with {len(table)} prompts from {table.index.get_level_values('rec_id').nunique()} logs.")
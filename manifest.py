@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+Content manifest for incremental uber_serda.py runs.
+For each recording ID and processing stage the manifest records the state of the inputs
+(zip member CRC + size, or file size + mtime) and the outputs the stage produced.
+A stage only needs to be redone for a recording when its inputs changed or one of its outputs is missing.
+"""
+
+import os
+import json
+
+
+MANIFEST_NAME = "serda_manifest.json"
+
+
+def file_state(path):
+    """Returns [size, mtime in ns] for an existing file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Manifest:
+    """
+    Maps 'rec_id' -> 'stage' -> {'inputs': {key: state}, 'outputs': {path: state}}.
+    Input keys can be file paths or other identifiers (e.g. 'audio.zip:member.webm'),
+    outputs are always file paths. The manifest is stored as JSON at `path`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as manifest_in:
+                self.records = json.load(manifest_in)
+
+    def get(self, rec_id, stage):
+        """Returns the stored record for rec_id and stage, or None."""
+        return self.records.get(rec_id, {}).get(stage)
+
+    def is_fresh(self, rec_id, stage, inputs):
+        """
+        Checks whether stage was completed for rec_id with exactly these inputs
+        (dict of 'key': state) and all of its outputs are still in place, unchanged.
+        """
+        record = self.get(rec_id, stage)
+        if record is None or record["inputs"] != inputs:
+            return False
+        return all(file_state(path) == state for path, state in record["outputs"].items())
+
+    def record(self, rec_id, stage, inputs, outputs):
+        """Stores inputs (dict of 'key': state) and the current state of each output path for rec_id and stage."""
+        self.records.setdefault(rec_id, {})[stage] = {
+            "inputs": inputs,
+            "outputs": {path: file_state(path) for path in outputs},
+        }
+
+    def discard(self, rec_id, stage = None):
+        """Forgets one stage (or all stages) of rec_id, so it is redone in the next run."""
+        if stage is None:
+            self.records.pop(rec_id, None)
+        else:
+            self.records.get(rec_id, {}).pop(stage, None)
+
+    def save(self):
+        """Writes the manifest to disk. A crash while saving leaves the previous version intact."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as manifest_out:
+            json.dump(self.records, manifest_out)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+Pre-flight check for SERDA recordings, to find bad recordings before any expensive step runs.
+Reads the listings of the audio and log zips (central directory only, nothing is extracted)
+and/or the headers of converted .wav/.flac recordings in parallel, and flags recordings that are
+empty, smaller than --min-kb, shorter than --min-seconds or truncated (the data chunk of a .wav file
+is cut off before its declared size, which sox reports as "Premature EOF").
+The flagged recording IDs can be merged with an existing list of recordings to ignore into a new one.
+
+Expected input: optional -a/--audiozip, -l/--logzip, -d/--audio-dirs, -i/--ignore (existing list of
+recordings to ignore), -o/--outfile (merged list), --min-seconds, --min-kb and -j/--jobs
+"""
+
+import os
+import struct
+import zipfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import audio_io
+
+# recordings shorter than this (s) are flagged
+MIN_SECONDS = 60.0
+# data chunk sizes that mean "unknown" (written by encoders that can't seek back, e.g. to a pipe)
+UNKNOWN_DATA_SIZES = {0, 0xFFFFFFFF}
+
+
+def member_rec_id(filename):
+    """Returns the recording ID of a zip member or file, without the redundant '-$...' part of log filenames."""
+    filename = os.path.basename(filename)
+    if "$" in filename:
+        filename = filename.split('-$')[0]
+    return filename.split('.')[0]
+
+
+def scan_zip(zip_path, extension, min_bytes = 0):
+    """
+    Reads the central directory of zip_path and flags the members with the given extension
+    that are empty or smaller than min_bytes. Returns a dict with items 'rec_id': 'reason'.
+    """
+    flagged = {}
+    with zipfile.ZipFile(zip_path) as zipped:
+        for member in zipped.infolist():
+            if member.is_dir() or not member.filename.endswith(extension):
+                continue
+            if member.file_size == 0:
+                flagged[member_rec_id(member.filename)] = f"empty {extension}"
+            elif member.file_size < min_bytes:
+                flagged[member_rec_id(member.filename)] = f"small {extension} ({member.file_size / 1000:.0f} kB)"
+    return flagged
+
+
+def check_audio(path, min_seconds = MIN_SECONDS, min_bytes = 0):
+    """Checks the header of 1 .wav or .flac recording. Returns the reason to flag it, or None."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return "empty"
+    try:
+        with open(path, "rb") as audio_in:
+            if path.endswith(".flac"):
+                sample_rate, channels, bits_per_sample, frames = audio_io.read_flac_header(audio_in)
+                audio_length = frames / sample_rate if frames else None
+            else:
+                info = audio_io.read_header(audio_in)
+                audio_in.seek(info.data_offset - 4)
+                declared_size = struct.unpack("<I", audio_in.read(4))[0]
+                if info.data_size == 0:
+                    return "empty"
+                if declared_size not in UNKNOWN_DATA_SIZES and info.data_size < declared_size:
+                    return f"truncated ({info.data_size} of {declared_size} bytes of audio)"
+                if info.data_size % audio_io.block_align(info):
+                    return "truncated (ends in the middle of a sample)"
+                audio_length = audio_io.duration(info)
+    except (audio_io.WavError, struct.error, ZeroDivisionError) as err:
+        return f"unreadable ({err or type(err).__name__})"
+    if audio_length is not None and audio_length < min_seconds:
+        return f"short ({audio_length:.1f} s)"
+    if size < min_bytes:
+        return f"small ({size / 1000:.0f} kB)"
+    return None
+
+
+def scan_audio(paths, min_seconds = MIN_SECONDS, min_bytes = 0, jobs = None):
+    """
+    Checks the headers of many recordings on a thread pool of `jobs` workers (default: number of cores).
+    Returns a dict with items 'rec_id': 'reason' for the flagged recordings.
+    """
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        reasons = pool.map(lambda path: check_audio(path, min_seconds, min_bytes), paths)
+        return {member_rec_id(path): reason for path, reason in zip(paths, reasons) if reason is not None}
+
+
+def find_recordings(audio_dir):
+    """Returns the converted recordings under audio_dir, leaving out segments and the original long stories."""
+    return [os.path.join(dirpath, filename) for dirpath, dirnames, filenames in os.walk(audio_dir)
+            for filename in filenames if filename.endswith(audio_io.AUDIO_EXTENSIONS)
+            and 'segments' not in dirpath and 'long_stories' not in dirpath]
+
+
+def read_ignore_list(path):
+    """Returns the recording IDs in a list of recordings to ignore (1 per line), in order."""
+    with open(path, "r", encoding="utf-8") as recs:
+        return [line.strip("\n ") for line in recs if line.strip("\n ")]
+
+
+def write_ignore_list(path, ignored, flagged):
+    """
+    Writes the recording IDs in ignored (in order), followed by the flagged recording IDs
+    that are not in it yet (sorted), to path. Returns the number of recording IDs that were added.
+    """
+    new_recs = sorted(set(flagged) - set(ignored))
+    with open(path, "w", encoding="utf-8") as recs:
+        for rec_id in list(ignored) + new_recs:
+            recs.write(f"{rec_id}\n")
+    return len(new_recs)
+
+
+def preflight(audio_zip = None, log_zip = None, audio_dirs = (), min_seconds = MIN_SECONDS, min_bytes = 0, jobs = None):
+    """
+    Scans the listings of audio_zip (.webm members) and log_zip (.csv members) at the same time,
+    and the headers of the recordings under audio_dirs. Returns a dict with items 'rec_id': 'reason(s)'.
+    """
+    scans = []
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        if audio_zip is not None:
+            scans.append(pool.submit(scan_zip, audio_zip, ".webm", min_bytes))
+        if log_zip is not None:
+            scans.append(pool.submit(scan_zip, log_zip, ".csv"))
+        scans = [scan.result() for scan in scans]
+    for audio_dir in audio_dirs:
+        scans.append(scan_audio(find_recordings(audio_dir), min_seconds, min_bytes, jobs))
+
+    flagged = {}
+    for scan in scans:
+        for rec_id, reason in scan.items():
+            flagged[rec_id] = f"{flagged[rec_id]}; {reason}" if rec_id in flagged else reason
+    return flagged
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a', '--audiozip', help = "Path to raw audio zip")
+    parser.add_argument('-l', '--logzip', help = "Path to raw log zip")
+    parser.add_argument('-d', '--audio-dirs', nargs='+', default=[],
+                        help = "Audio dirs with converted recordings (.wav/.flac) to check, e.g. myproject/audio")
+    parser.add_argument('-i', '--ignore', help = "Existing list of recordings to ignore")
+    parser.add_argument('-o', '--outfile',
+                        help = "Write the recordings of --ignore and the flagged recordings to this file."
+                        " Can be the same file as --ignore")
+    parser.add_argument('--min-seconds', type=float, default=MIN_SECONDS,
+                        help = f"Flag recordings shorter than this (s). Default = {MIN_SECONDS:.0f}")
+    parser.add_argument('--min-kb', type=float, default=0,
+                        help = "Flag recordings (and .webm zip members) smaller than this (kB). Default = 0")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help = "Number of parallel header reads. Default = number of cores")
+    args = parser.parse_args()
+    if args.audiozip is None and args.logzip is None and not args.audio_dirs:
+        parser.error("Give at least one of -a/--audiozip, -l/--logzip and -d/--audio-dirs.")
+
+    ignored = read_ignore_list(args.ignore) if args.ignore else []
+    flagged = preflight(args.audiozip, args.logzip, args.audio_dirs, args.min_seconds, args.min_kb * 1000, args.jobs)
+
+    ignored_set = set(ignored)
+    print(f"Flagged {len(flagged)} recording(s), {len(set(flagged) - ignored_set)} of which are not ignored yet:")
+    for rec_id, reason in sorted(flagged.items()):
+        print(f"\t{rec_id}\t{reason}{' (already ignored)' if rec_id in ignored_set else ''}")
+    if args.outfile:
+        n_added = write_ignore_list(args.outfile, ignored, flagged)
+        print(f"Added {n_added} recording(s) to {args.outfile}.")
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+Runs the external commands (ffmpeg, sox, unzip) of the SERDA scripts.
+Commands are argument lists that are started without a shell, so paths are passed as they are.
+A batch of commands runs on an asyncio event loop with at most `jobs` commands at the same time.
+Every command has a timeout and is started again when it fails or times out (up to `retries` times),
+its stdout and stderr are captured (or its stdout is streamed into a file-like object)
+and it is counted in the run report (see instrument.py).
+"""
+
+import os
+import time
+import asyncio
+import subprocess
+import instrument
+
+# seconds before a command is killed (None = no limit)
+TIMEOUT = 600
+# number of times a failed or timed out command is started again
+RETRIES = 1
+# bytes read from a streamed stdout at a time
+CHUNK_SIZE = 1024 * 1024
+
+
+async def stream_stdout(process, stdout_file):
+    """
+    Copies the stdout of process into stdout_file (a writable binary file-like object) chunk by chunk,
+    while collecting its stderr. stdout_file is closed once the process has finished. Returns stderr.
+    """
+    async def copy():
+        while True:
+            chunk = await process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            stdout_file.write(chunk)
+
+    try:
+        stderr = (await asyncio.gather(copy(), process.stderr.read()))[1]
+        await process.wait()
+    finally:
+        stdout_file.close()
+    return stderr
+
+
+async def run_async(key, args, semaphore, timeout, retries, stdout_to = None):
+    """
+    Runs 1 command as soon as semaphore allows it, retrying it when it fails.
+    Returns a subprocess.CompletedProcess of the last attempt and the total time (s) of all attempts.
+    A command that can't be started (e.g. ffmpeg is not installed) gets returncode 127 and is not retried.
+    With stdout_to, the stdout of each attempt is streamed into stdout_to(key) instead of being captured;
+    an error raised while writing it fails the attempt with the error as stderr.
+    """
+    seconds = 0.0
+    async with semaphore:
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE,
+                                                               stderr=asyncio.subprocess.PIPE)
+            except OSError as err:
+                instrument.count_command(args[0], time.perf_counter() - start, True)
+                return subprocess.CompletedProcess(args, 127, b"", str(err).encode("utf-8")), seconds
+            try:
+                if stdout_to is None:
+                    stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+                else:
+                    stdout, stderr = b"", await asyncio.wait_for(stream_stdout(process, stdout_to(key)), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                stdout, stderr = await process.communicate()
+                stderr += f"\n{os.path.basename(args[0])} timed out after {timeout} s".encode("utf-8")
+                result = subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+            except Exception as err:
+                # raised by stdout_to or the object it returned: the attempt fails, even if the command succeeded
+                if process.returncode is None:
+                    process.kill()
+                await process.wait()
+                result = subprocess.CompletedProcess(args, process.returncode or 1, b"", str(err).encode("utf-8"))
+            else:
+                result = subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+            elapsed = time.perf_counter() - start
+            seconds += elapsed
+            instrument.count_command(args[0], elapsed, result.returncode != 0)
+            if result.returncode == 0:
+                break
+    return result, seconds
+
+
+async def run_batch(commands, jobs, timeout, retries, stdout_to = None):
+    """Runs all commands (a dict with items 'key': [args]) with at most `jobs` at the same time."""
+    semaphore = asyncio.Semaphore(jobs)
+    outcomes = await asyncio.gather(*(run_async(key, [str(arg) for arg in args], semaphore, timeout, retries, stdout_to)
+                                      for key, args in commands.items()))
+    return dict(zip(commands, outcomes))
+
+
+def run_commands(commands, jobs = None, timeout = TIMEOUT, retries = RETRIES, check = False, stage_name = None,
+                 stdout_to = None):
+    """
+    Takes a dict with items 'key': [command arguments] and runs all commands, at most `jobs`
+    (default: number of cores) at the same time. Each attempt is killed after `timeout` s
+    and a failed command is started again up to `retries` times.
+    When stage_name is given, the keys are recording IDs and each command's time is recorded
+    for that recording in the run report.
+    stdout_to is an optional callable stdout_to(key) that returns a writable binary file-like object
+    for each attempt; the command's stdout is then streamed into it (and it is closed) instead of captured.
+    Returns a dict with items 'key': subprocess.CompletedProcess (stdout and stderr as bytes), in the order of commands.
+    With check = True a subprocess.CalledProcessError is raised for the first failed command once all have finished.
+    """
+    if not commands:
+        return {}
+    outcomes = asyncio.run(run_batch(commands, jobs or os.cpu_count() or 1, timeout, retries, stdout_to))
+
+    results = {}
+    for key, (result, seconds) in outcomes.items():
+        if stage_name is not None:
+            instrument.add_recording(stage_name, key, seconds, 1)
+        results[key] = result
+    if check:
+        for result in results.values():
+            result.check_returncode()
+    return results
+
+
+def run_command(args, timeout = TIMEOUT, retries = RETRIES, check = True):
+    """Runs 1 command (see run_commands) and returns its subprocess.CompletedProcess."""
+    return run_commands({0: args}, 1, timeout, retries, check)[0]
+
+
+def failed_commands(results):
+    """Returns a dict with items 'key': 'stderr of the command' for the failed commands in the results of run_commands."""
+    return {key: result.stderr.decode("utf-8", errors="replace").strip()
+            for key, result in results.items() if result.returncode != 0}
@@ -1,81 +1,352 @@
 """
 @Author: Bo Molenaar
 @Date: 22 March 2023
-@Last edited: 3 April 2023
+@Last edited:    18 October 2026
 
 This script can be ran after uber_serda.py to generate bootstrapped segments for SERDA v1 story tasks.
-It uses ASR output to get timestamps for end of utterances automatically.
-Ideally these correspond to the end of the sentences/lines in the reading prompts.
+It uses ASR output to get timestamps for the start and end of utterances automatically.
+The words of the story prompt (story{1,2,3}_clean.txt, 1 sentence per line) are aligned with the
+ASR words of each recording, and every prompt line gets the start/end time of the ASR words aligned to it.
+The alignment is a banded dynamic-programming alignment (edit distance), so memory and time stay
+linear in the length of the story. Recordings are aligned on a pool of worker processes.
+Each worker then reads the story recording once and writes all of its line segments (with 0.3s padding)
+and a matching .prompt file per line, without calling sox. With --output kaldi, no audio is written;
+Kaldi manifests pointing into the full story recordings are written instead.
+When the project has a catalog (see catalog.py), ASR output, recordings and prompts are looked up in it
+and the segments and their prompts are added to it.
 
-Input: 
-1.  path to directory of story task audio
-2.  path to directory of ASR output for these recordings
-3.  path to directory to place audio segments
+Input:
+1.  path to project directory
+2.  name of the audio directory in the project
+3.  name of the ASR output directory in the project (.json files, see asr_index.py)
+4.  name of the prompt directory in the project
 
 Output:
-Segmented audio in dir 3.
+Table with 1 row per prompt line of each story recording (rec_id, line, start, end, prompt)
+in audio/stories/story_segments.tsv, and
+line segments in audio/stories/segments + prompts/stories/segments (--output files, default) or
+wav.scp, segments, text and utt2spk in audio/stories/kaldi (--output kaldi)
 """
 
-# create a dict with rec_id, story audio, story AO
+import os
+import re
+import pathlib
+import argparse
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import asr_index
+import audio_io
+import scheduler
+from catalog import open_catalog
+from serda_data_prep import SEGMENT_PAD, write_kaldi_dir
 
+# default half width of the alignment band (in words) around the diagonal
+BAND_WIDTH = 50
+STORY_SEGMENTS_NAME = "story_segments.tsv"
 
-# then run segmentation on each entry
 
-def segment_story(full_rec_path, rec_AO, full_prompt_path,  rec_segments_path):
+def normalize_token(word):
+    """Lowercase word without accents and punctuation, for comparing prompt words with ASR words."""
+    word = unicodedata.normalize("NFKD", word.lower())
+    return re.sub(r"[^a-z0-9']", "", "".join(c for c in word if not unicodedata.combining(c)))
+
+
+def prompt_tokens(prompt_lines):
+    """Returns the normalized words of all prompt lines and the line number of each word."""
+    tokens, token_lines = [], []
+    for line_nr, line in enumerate(prompt_lines):
+        for word in line.split():
+            token = normalize_token(word)
+            if token:
+                tokens.append(token)
+                token_lines.append(line_nr)
+    return tokens, np.array(token_lines, dtype=int)
+
+
+def asr_words(rec_words, rec_segments):
+    """
+    Returns the normalized ASR words of 1 recording with their start and end times (s).
+    Uses the word timestamps when the ASR output has them; otherwise the words of each segment
+    get equal parts of the segment duration.
+    """
+    if len(rec_words):
+        rec_words = rec_words[rec_words['text'].map(normalize_token) != '']
+        return (list(rec_words['text'].map(normalize_token)),
+                rec_words['start'].to_numpy(dtype=float), rec_words['end'].to_numpy(dtype=float))
+
+    tokens, starts, ends = [], [], []
+    for seg_start, seg_end, seg_text in zip(rec_segments['start'], rec_segments['end'], rec_segments['text']):
+        seg_tokens = [token for token in map(normalize_token, seg_text.split()) if token]
+        bounds = np.linspace(seg_start, seg_end, len(seg_tokens) + 1)
+        tokens += seg_tokens
+        starts += list(bounds[:-1])
+        ends += list(bounds[1:])
+    return tokens, np.array(starts, dtype=float), np.array(ends, dtype=float)
+
+
+def band_limits(n, m, band):
+    """Returns the first and last column (ASR word) of the band for each row (prompt word) 0..n."""
+    centers = np.round(np.arange(n + 1) * (m / max(n, 1))).astype(int)
+    # the band has to be wide enough for consecutive rows to overlap
+    band = max(band, int(np.ceil(m / max(n, 1))) + 1)
+    return np.clip(centers - band, 0, m), np.clip(centers + band, 0, m)
+
+
+def align(tokens, asr_tokens, band = BAND_WIDTH):
+    """
+    Banded edit distance alignment of prompt tokens (rows) and ASR tokens (columns).
+    Only cells within `band` words of the diagonal are computed, and per cell only the move is kept,
+    so memory is O(len(tokens) * band).
+    Returns an array with for each prompt token the index of the ASR token it is aligned to, or -1.
+    """
+    n, m = len(tokens), len(asr_tokens)
+    aligned = np.full(n, -1)
+    if n == 0 or m == 0:
+        return aligned
+    asr_tokens = np.array(asr_tokens, dtype=object)
+    lows, highs = band_limits(n, m, band)
+
+    # row 0: only ASR insertions
+    prev_cost = np.arange(lows[0], highs[0] + 1, dtype=float)
+    moves = [np.full(len(prev_cost), 2, dtype=np.int8)]
+    for i in range(1, n + 1):
+        low, high = lows[i], highs[i]
+        cols = np.arange(low, high + 1)
+        prev_low, prev_high = lows[i - 1], highs[i - 1]
+
+        # cost of arriving from the previous row: prompt word deleted (up) or matched/substituted (diagonal)
+        up = np.full(len(cols), np.inf)
+        in_prev = (cols >= prev_low) & (cols <= prev_high)
+        up[in_prev] = prev_cost[cols[in_prev] - prev_low] + 1
+        diag = np.full(len(cols), np.inf)
+        has_diag = (cols - 1 >= prev_low) & (cols - 1 <= prev_high) & (cols >= 1)
+        substitution = (asr_tokens[cols[has_diag] - 1] != tokens[i - 1]).astype(float)
+        diag[has_diag] = prev_cost[cols[has_diag] - 1 - prev_low] + substitution
+
+        best = np.minimum(diag, up)
+        move = np.where(diag <= up, 0, 1).astype(np.int8)
+        # ASR word inserted (left): cost[j] = min over k <= j of best[k] + (j - k), computed with a running minimum
+        cost = np.minimum.accumulate(best - cols) + cols
+        move[cost < best] = 2
+        moves.append(move)
+        prev_cost = cost
+
+    # trace back from the last prompt word and the last ASR word
+    i, j = n, m
+    while i > 0:
+        move = moves[i][j - lows[i]]
+        if move == 0:
+            aligned[i - 1] = j - 1
+            i, j = i - 1, j - 1
+        elif move == 1:
+            i -= 1
+        else:
+            j -= 1
+    return aligned
+
+
+def line_times(token_lines, aligned, starts, ends, n_lines):
     """
-    Takes a story audio file and matches it to its story prompt.
-    Then, bootstrapped segments generated by WhisperX ASR are searched 
-    to identify start/end timestamps in the audio for each line in the prompt.
-    
+    Start/end time of each prompt line: the first start and last end of the ASR words aligned to its words.
+    Lines without aligned (timed) words are placed between their neighbours.
     """
+    line_starts = np.full(n_lines, np.nan)
+    line_ends = np.full(n_lines, np.nan)
+    for line_nr in range(n_lines):
+        line_aligned = aligned[(token_lines == line_nr) & (aligned >= 0)]
+        if len(line_aligned):
+            if np.isfinite(starts[line_aligned]).any():
+                line_starts[line_nr] = np.nanmin(starts[line_aligned])
+            if np.isfinite(ends[line_aligned]).any():
+                line_ends[line_nr] = np.nanmax(ends[line_aligned])
+
+    # fill the gaps: start at the end of the previous line, end at the start of the next line
+    last_end = np.nanmax(ends) if np.isfinite(ends).any() else 0.0
+    prev_end = pd.Series(np.where(np.isnan(line_ends), line_starts, line_ends)).ffill().shift(fill_value=0.0).to_numpy()
+    next_start = pd.Series(np.where(np.isnan(line_starts), line_ends, line_starts)).bfill().shift(-1, fill_value=last_end).to_numpy()
+    line_starts = np.where(np.isnan(line_starts), prev_end, line_starts)
+    line_ends = np.where(np.isnan(line_ends), np.maximum(next_start, line_starts), line_ends)
+    return line_starts, line_ends
 
+
+def segment_story(rec_id, rec_words, rec_segments, full_prompt_path, band = BAND_WIDTH):
+    """
+    Takes the ASR words and segments of 1 story recording (see asr_index.split_asr) and matches them to its story prompt.
+    Returns a list of 5-tuples (rec_id, line number, start, end, prompt line) with the start/end timestamps (s)
+    in the audio for each line in the prompt.
+    """
     # first off let's store all prompt lines in memory
-    # because it will be much easier to deal with than nested loops
-    prompt_segments = {}
-    with open(full_prompt_path, 'r', encoding='utf-8').readlines() as prompt_lines:
-        for prompt_nr, prompt_text in enumerate(prompt_lines):
-            prompt_segments[prompt_nr] = prompt_text
-
-    # make a dict of segments in the ASR output
-    # key = 'id'
-    # value = 3-tuple of (start, end, text)
-    ao_segments = {}
-    with open(rec_AO, 'r', encoding='utf-8').readlines() as ao_lines:
-        for i, line in enumerate(ao_lines):
-            if (i >= 3) and ('{' in line):
-
-                # collect segment details in a dict
-                seg_nr = ao_lines[i+1]
-                seg_start = ao_lines[i+3]
-                seg_end = ao_lines[i+4]
-                seg_text = ao_lines[i+5]
-
-                ao_segments[seg_nr] = seg_start, seg_end, seg_text
-
-    # now do something with them
-
-
-    # this is probably better to leave for version 2 of this script
-    if len(prompt_segments.items()) == len(ao_segments.items()):
-        # this is the ideal case where the number of
-        # lines in the prompt is equal to the number of
-        # segments in the ASR output
-        # TODO
-        # probably get start time with ao_segments[prompt_nr][0]
-        # and end time with  ao_segments[prompt_nr][1]
-
-        print('great! there are as many prompt as ao segments.')
+    with open(full_prompt_path, 'r', encoding='utf-8') as prompt_in:
+        prompt_lines = [line.strip() for line in prompt_in if line.strip()]
+
+    tokens, token_lines = prompt_tokens(prompt_lines)
+    asr_tokens, starts, ends = asr_words(rec_words, rec_segments)
+    aligned = align(tokens, asr_tokens, band)
+    line_starts, line_ends = line_times(token_lines, aligned, starts, ends, len(prompt_lines))
+    return [(rec_id, line_nr, start, end, line)
+            for line_nr, (start, end, line) in enumerate(zip(line_starts, line_ends, prompt_lines))]
+
+
+def line_segment_ids(rec_id, story_rows):
+    """Returns the segment (utterance) IDs of the prompt lines of 1 story recording, named like the word segments."""
+    segment_chunks = rec_id.rsplit("-", 1)
+    return [f"{segment_chunks[0]}_{line_nr}-{segment_chunks[1]}" for _, line_nr, _, _, _ in story_rows]
 
+
+def cut_story(full_rec_path, story_rows, audio_segments_path, prompt_segments_path):
+    """
+    Writes an audio segment (with SEGMENT_PAD silence on both sides) and a .prompt file for every prompt line
+    of 1 story recording. The recording is memory-mapped and read once; each segment is a view on it.
+    Segments get the format of the recording; .flac recordings are cut with 1 sox call per line.
+    Returns a list of the paths that were written.
+    """
+    rec_id = story_rows[0][0]
+    extension = os.path.splitext(full_rec_path)[1]
+    segment_ids = line_segment_ids(rec_id, story_rows)
+    written = []
+    for segment_id, (_, line_nr, start, end, line) in zip(segment_ids, story_rows):
+        prompt_path = os.path.join(prompt_segments_path, f"{segment_id}.prompt")
+        with open(prompt_path, "w", encoding="utf-8") as prompt_out:
+            prompt_out.write(line)
+        written += [os.path.join(audio_segments_path, f"{segment_id}{extension}"), prompt_path]
+
+    if extension != ".wav":
+        # this runs in a worker process already, so the sox calls of 1 recording run one at a time
+        scheduler.run_commands({segment_path: ["sox", "-V1", full_rec_path, segment_path, "trim", start, f"={end}",
+                                               "pad", SEGMENT_PAD, SEGMENT_PAD]
+                                for segment_path, (_, line_nr, start, end, line) in zip(written[::2], story_rows)},
+                               jobs=1, check=True)
+        return written
+    with audio_io.WavReader(full_rec_path) as full_rec:
+        for segment_path, (_, line_nr, start, end, line) in zip(written[::2], story_rows):
+            audio_io.write_wav(segment_path, full_rec.info, full_rec.segment(start, end), pad=SEGMENT_PAD)
+    return written
+
+
+def kaldi_story_entries(full_rec_path, story_rows):
+    """
+    Returns a list of 5-tuples ('utterance ID', 'rec_id', start, end, 'prompt line') for Kaldi manifests,
+    with the padding applied by widening each segment, clamped to the recording (like kaldi_word_entries).
+    Segments that are empty after clamping are left out.
+    """
+    rec_id = story_rows[0][0]
+    rec_duration = audio_io.probe_duration(full_rec_path)
+    entries = []
+    for segment_id, (_, line_nr, start, end, line) in zip(line_segment_ids(rec_id, story_rows), story_rows):
+        start = max(start - SEGMENT_PAD, 0)
+        end = min(end + SEGMENT_PAD, rec_duration)
+        if end <= start:
+            print(f"\tWARNING: left out empty segment {segment_id} ({start:.2f}s to {end:.2f}s,"
+                  f" {rec_id} is {rec_duration:.2f}s long)")
+            continue
+        entries.append((segment_id, rec_id, start, end, line))
+    return entries
+
+
+def segment_story_job(job):
+    """
+    Runs segment_story for 1 job (rec_id, words, segments, prompt path, band, full audio path,
+    audio segments dir, prompt segments dir) in a worker process, and cuts the story into line segments
+    when the segment dirs are given. Returns the line rows and the paths that were written.
+    """
+    story_rows = segment_story(*job[:5])
+    full_rec_path, audio_segments_path, prompt_segments_path = job[5:]
+    if audio_segments_path is None or not story_rows:
+        return story_rows, []
+    return story_rows, cut_story(full_rec_path, story_rows, audio_segments_path, prompt_segments_path)
+
+
+def segment_stories(asr_dir, prompt_dir, audio_dir, band = BAND_WIDTH, jobs = None, output = "files", catalog = None):
+    """
+    Aligns all story recordings in audio_dir with ASR output and a prompt file in prompt_dir/{rec_id}.prompt
+    on a pool of `jobs` worker processes (default: number of cores), and writes the line timestamps to
+    audio_dir/story_segments.tsv. With output = "files", every line is also written as an audio segment
+    (audio_dir/segments) with a .prompt file (prompt_dir/segments); with output = "kaldi", Kaldi manifests
+    for the line segments are written to audio_dir/kaldi instead.
+    With a catalog.Catalog, the ASR output, recordings and prompts are looked up in it (instead of
+    checking the disk for each recording) and the written segments and prompts are added to it.
+    """
+    audio_segments_path = os.path.join(audio_dir, "segments")
+    prompt_segments_path = os.path.join(prompt_dir, "segments")
+    if output == "files":
+        pathlib.Path(audio_segments_path).mkdir(parents=True, exist_ok=True)
+        pathlib.Path(prompt_segments_path).mkdir(parents=True, exist_ok=True)
+
+    # create a dict with rec_id, story audio, story AO
+    table = asr_index.get_asr_index(asr_dir, jobs=jobs, catalog=catalog)
+    story_table = table[table['rec_id'].str.contains('story')]
+    words = asr_index.split_asr(story_table, 'word')
+    segments = asr_index.split_asr(story_table, 'segment')
+    no_words = story_table.iloc[:0]
+
+    if catalog is not None:
+        known_files = {os.path.normpath(f) for f in catalog.find("recording", audio_dir) + catalog.find("prompt", prompt_dir)}
+        exists = lambda path: os.path.normpath(path) in known_files
     else:
-        # in this case, there will be >= 1 major differences between prompt and ao segments
-        # TODO
-        # do something
-        # think about what we want in this scenario
-        # we can probably still match the prompt_nr to ao segment start and end
-        # but then we're left with a bunch of segments after prompt line enumerator runs out
-        print('the number of segments in ao is not equal to the number of lines in the prompt')
-
-        # do manual inspection for case 2.
-        # this works best if subset 2 is small,
-        # so try to write a small script to check the distribution over these two cases.
+        exists = os.path.isfile
+
+    job_list = []
+    recordings = {}
+    for rec_id in sorted(segments.keys() | words.keys()):
+        full_prompt_path = os.path.join(prompt_dir, f"{rec_id}.prompt")
+        full_rec_path = next((os.path.join(audio_dir, f"{rec_id}{extension}") for extension in audio_io.AUDIO_EXTENSIONS
+                              if exists(os.path.join(audio_dir, f"{rec_id}{extension}"))), None)
+        if not exists(full_prompt_path) or full_rec_path is None:
+            print(f"\tNo prompt or audio for {rec_id}, skipping.")
+            continue
+        recordings[rec_id] = full_rec_path
+        job_list.append((rec_id, words.get(rec_id, no_words), segments.get(rec_id, no_words), full_prompt_path, band,
+                         full_rec_path) + ((audio_segments_path, prompt_segments_path) if output == "files" else (None, None)))
+    print(f"Aligning {len(job_list)} story recordings with their prompts...")
+
+    # then run segmentation on each entry
+    rows = []
+    n_written = 0
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        for job, (story_rows, written) in zip(job_list, pool.map(segment_story_job, job_list, chunksize=8)):
+            rows += story_rows
+            n_written += len(written) // 2
+            if catalog is not None:
+                catalog.add("prompt", [f for f in written if f.endswith(".prompt")], job[0])
+                catalog.add("segment", [f for f in written if not f.endswith(".prompt")], job[0])
+    if catalog is not None:
+        catalog.save()
+
+    outfile = os.path.join(audio_dir, STORY_SEGMENTS_NAME)
+    story_segments = pd.DataFrame(rows, columns=['rec_id', 'line', 'start', 'end', 'prompt'])
+    story_segments.to_csv(outfile, sep='\t', index=False, float_format='%.3f')
+    print(f"Done.\nTimestamps of {len(story_segments)} prompt lines are in {outfile}.")
+
+    if output == "kaldi":
+        kaldi_entries = []
+        for rec_id, story_rows in story_segments.groupby('rec_id', sort=False):
+            kaldi_entries += kaldi_story_entries(recordings[rec_id], list(story_rows.itertuples(index=False, name=None)))
+        write_kaldi_dir(os.path.join(audio_dir, "kaldi"), recordings, kaldi_entries)
+        print(f"Wrote Kaldi manifests for {len(kaldi_entries)} line segments to {os.path.join(audio_dir, 'kaldi')}.")
+    else:
+        print(f"Wrote {n_written} line segments to {audio_segments_path} and their prompts to {prompt_segments_path}.")
+    return story_segments
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('project_dir', help = "Project directory used for uber_serda.py")
+    parser.add_argument('audio_dirname', help = "Name of the audio directory in the project, e.g. audio")
+    parser.add_argument('asr_dirname', help = "Name of the ASR output directory in the project, e.g. asr/stories")
+    parser.add_argument('prompt_dirname', help = "Name of the prompt directory in the project, e.g. prompts")
+    parser.add_argument('-b', '--band', type=int, default=BAND_WIDTH,
+                        help = f"Half width of the alignment band in words. Default = {BAND_WIDTH}")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help = "Number of recordings aligned in parallel. Default = number of cores")
+    parser.add_argument('--output', choices=["files", "kaldi"], default="files",
+                        help = "files: write an audio segment + .prompt file per line (default)."
+                        " kaldi: only write Kaldi manifests (wav.scp, segments, text, utt2spk) to audio/stories/kaldi")
+    args = parser.parse_args()
 
+    segment_stories(os.path.join(args.project_dir, args.asr_dirname),
+                    os.path.join(args.project_dir, args.prompt_dirname, "stories"),
+                    os.path.join(args.project_dir, args.audio_dirname, "stories"),
+                    args.band, args.jobs, args.output, open_catalog(args.project_dir))
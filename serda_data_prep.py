@@ -2,7 +2,7 @@
 @Author:        Bo Molenaar
 @Date:          1 February 2023
 
-@Last edited:    17 March 2023
+@Last edited:    18 October 2026
 
 This script processes SERDA v1 data after they have been organised into task directories.
 It requires a dict from serda_data_sel.py with recording IDs and paths to the audio and log for that recording.
@@ -16,51 +16,152 @@ Audio files for word tasks are split on single words with added word ID tag.
 
 import os
 import pathlib
-from subprocess import run
-import pandas as pd
+import audio_io
+import instrument
+import scheduler
+import log_store
+from manifest import file_state
 
 
-def segment_words(full_rec_path, rec_segments_path, words_dict):
+# items that are the first word of a task and get 2 segment variants
+FIRST_ITEMS = {101, 201, 301}
+# time between the end of the previous word and the appearance of the next word on screen (ms)
+WORD_APPEAR_OFFSET = 1323
+# silence padding around each segment (s)
+SEGMENT_PAD = 0.3
+
+
+def word_segment_times(words_dict):
     """
-    Takes a dict for 1 word task with items 'prompt_id': ('prompt_id', 'segment_start', 'segment_end').
-    Then recalculates start time as word appearance (= prev word end + 1323ms).
-    Finally the timestamps are used to create an audio file for each segment.
+    Takes a dict for 1 word task with items 'prompt_id': ('segment_start', 'segment_end') in ms.
+    Recalculates start time as word appearance (= prev word end + 1323ms) for all regular items
+    and generates 2 variants for the first item of a task (from the start of the recording / from the log timestamp).
+    Returns a list of 3-tuples ('segment tag', start in s, end in s).
     """
     segments = list(words_dict.items())
+    segment_times = []
     for counter, (prompt_id, (start_time, end_time)) in enumerate(segments):
-        segment_chunks = rec_segments_path[:-4].rsplit("-", 1)
-        if prompt_id in {101, 201, 301}:
-
-            # 1. create backup segment starting from the beginning of the recording
-            segment_path_start = f"{segment_chunks[0]}_{prompt_id}_taskstart-{segment_chunks[1]}.wav"
-            soxcommand_start = f"sox {full_rec_path} {segment_path_start} trim 0 ={end_time/1000} pad 0.3 0.3"
-            # print(soxcommand_start)
-            run(soxcommand_start, check=True, shell=True)
-
-            # 2. create segment starting from the start_speak timestamp in the task log
-            segment_path_timestamp = f"{segment_chunks[0]}_{prompt_id}_logstamp-{segment_chunks[1]}.wav"
-            soxcommand_timestamp = f"sox {full_rec_path} {segment_path_timestamp} trim {start_time/1000} ={end_time/1000} pad 0.3 0.3"
-            # print(soxcommand_timestamp)
-            run(soxcommand_timestamp, check=True, shell=True)
-        
+        if prompt_id in FIRST_ITEMS:
+            # 1. backup segment starting from the beginning of the recording
+            segment_times.append((f"{prompt_id}_taskstart", 0, end_time/1000))
+            # 2. segment starting from the start_speak timestamp in the task log
+            segment_times.append((f"{prompt_id}_logstamp", start_time/1000, end_time/1000))
         else:
             # regular case for all other items
-            start_time = segments[counter-1][1][1] + 1323
-            segment_path = f"{segment_chunks[0]}_{prompt_id}-{segment_chunks[1]}.wav"
-            soxcommand = f"sox -V1 {full_rec_path} {segment_path} trim {start_time/1000} ={end_time/1000} pad 0.3 0.3"
-            # print(soxcommand)
-            run(soxcommand, check=True, shell=True)
+            start_time = segments[counter-1][1][1] + WORD_APPEAR_OFFSET
+            segment_times.append((str(prompt_id), start_time/1000, end_time/1000))
+    return segment_times
+
+
+def segment_words(full_rec_path, rec_segments_path, words_dict, engine = "python"):
+    """
+    Takes a dict for 1 word task with items 'prompt_id': ('segment_start', 'segment_end').
+    Then recalculates start time as word appearance (= prev word end + 1323ms).
+    Finally the timestamps are used to create an audio file for each segment.
+    By default the full recording is read once and all segments are written in-process.
+    Use engine = "sox" to fall back to 1 sox call per segment; the sox calls of a recording
+    are submitted at once and run in parallel. Segments get the format of the full recording,
+    so .flac recordings are always cut with sox.
+    Returns a list of the segment paths that were written.
+    """
+    segments_root, extension = os.path.splitext(rec_segments_path)
+    segment_chunks = segments_root.rsplit("-", 1)
+    segment_times = word_segment_times(words_dict)
+    segment_paths = [f"{segment_chunks[0]}_{segment_tag}-{segment_chunks[1]}{extension}"
+                     for segment_tag, start_time, end_time in segment_times]
+
+    if engine == "sox" or extension != ".wav":
+        soxcommands = {segment_path: ["sox", "-V1", full_rec_path, segment_path, "trim", start_time, f"={end_time}",
+                                      "pad", SEGMENT_PAD, SEGMENT_PAD]
+                       for segment_path, (segment_tag, start_time, end_time) in zip(segment_paths, segment_times)}
+        scheduler.run_commands(soxcommands, check=True)
+
+        # TODO
+        # investigate sox warning
+        # potential fix is to use end of audio instead of log timestamp
+        # --> Currently ignored by suppressing warning messages
+        # ! There are also 2 Premature EOF on .wav input file warnings
+        return segment_paths
 
-            # TODO
-            # investigate sox warning
-            # potential fix is to use end of audio instead of log timestamp
-            # --> Currently ignored by suppressing warning messages
-            # ! There are also 2 Premature EOF on .wav input file warnings
+    # segments past the end of the recording (the sox warnings above) are clamped to the end of the audio
+    # the recording is memory-mapped, so each segment is a view on the file and not a copy
+    with audio_io.WavReader(full_rec_path) as full_rec:
+        for segment_path, (segment_tag, start_time, end_time) in zip(segment_paths, segment_times):
+            audio_io.write_wav(segment_path, full_rec.info, full_rec.segment(start_time, end_time), pad=SEGMENT_PAD)
+    return segment_paths
 
 
-def prepare_data(clean_dirs, full_dict, audio_path, log_path, prompts_source, prompt_path):
+def word_segment_ids(rec_id, segment_times):
+    """Returns the segment (utterance) IDs for the segment tags of 1 word task, matching the segment_words filenames."""
+    segment_chunks = rec_id.rsplit("-", 1)
+    return [f"{segment_chunks[0]}_{segment_tag}-{segment_chunks[1]}" for segment_tag, start_time, end_time in segment_times]
+
+
+def kaldi_word_entries(rec_id, full_rec_path, words_dict, prompts):
     """
-    docstring
+    Takes a dict for 1 word task with items 'prompt_id': ('segment_start', 'segment_end')
+    and a dict with items 'prompt_id': 'prompt'.
+    Returns a list of 5-tuples ('utterance ID', 'rec_id', start in s, end in s, 'prompt') for Kaldi manifests,
+    with the same segment boundaries as segment_words. Kaldi segments can't contain added silence,
+    so the 0.3s padding is applied by widening each segment, clamped to the recording.
+    Segments that are empty after clamping (past the end of the recording) are left out.
+    """
+    rec_duration = audio_io.probe_duration(full_rec_path)
+    segment_times = word_segment_times(words_dict)
+    entries = []
+    for segment_id, (segment_tag, start_time, end_time) in zip(word_segment_ids(rec_id, segment_times), segment_times):
+        prompt_id = segment_tag.split("_")[0]
+        start_time = max(start_time - SEGMENT_PAD, 0)
+        end_time = min(end_time + SEGMENT_PAD, rec_duration)
+        if end_time <= start_time:
+            # Kaldi rejects empty segments, e.g. when the log timestamps lie past the end of the recording
+            print(f"\tWARNING: left out empty segment {segment_id} ({start_time:.2f}s to {end_time:.2f}s,"
+                  f" {rec_id} is {rec_duration:.2f}s long)")
+            continue
+        entries.append((segment_id, rec_id, start_time, end_time, prompts[prompt_id]))
+    return entries
+
+
+def write_kaldi_dir(kaldi_dir, recordings, entries):
+    """
+    Writes wav.scp, segments, text and utt2spk to kaldi_dir.
+    recordings is a dict with items 'rec_id': 'full audio path',
+    entries is a list of ('utterance ID', 'rec_id', start, end, 'prompt') tuples from kaldi_word_entries.
+    Speaker IDs are the first part of the recording ID, which is also the prefix of each utterance ID.
+    Recordings that are not .wav (e.g. .flac) are decoded by sox in a wav.scp pipe.
+    Files are sorted as Kaldi expects.
+    """
+    pathlib.Path(kaldi_dir).mkdir(parents=True, exist_ok=True)
+    entries = sorted(entries)
+    with open(os.path.join(kaldi_dir, "wav.scp"), "w", encoding="utf-8") as wav_scp:
+        for rec_id in sorted(recordings):
+            full_rec_path = os.path.abspath(recordings[rec_id])
+            if full_rec_path.endswith(".wav"):
+                wav_scp.write(f"{rec_id} {full_rec_path}\n")
+            else:
+                wav_scp.write(f"{rec_id} sox {full_rec_path} -t wav - |\n")
+    with open(os.path.join(kaldi_dir, "segments"), "w", encoding="utf-8") as segments_out, \
+         open(os.path.join(kaldi_dir, "text"), "w", encoding="utf-8") as text_out, \
+         open(os.path.join(kaldi_dir, "utt2spk"), "w", encoding="utf-8") as utt2spk_out:
+        for segment_id, rec_id, start_time, end_time, prompt in entries:
+            speaker_id = rec_id.split("-")[0]
+            segments_out.write(f"{segment_id} {rec_id} {start_time:.3f} {end_time:.3f}\n")
+            text_out.write(f"{segment_id} {' '.join(prompt.split())}\n")
+            utt2spk_out.write(f"{segment_id} {speaker_id}\n")
+
+
+def prepare_data(clean_dirs, full_dict, audio_path, log_path, prompts_source, prompt_path, segment_engine = "python",
+                 manifest = None, output = "files", catalog = None):
+    """
+    Generates prompt files for all story and word recordings in full_dict
+    and segments word task recordings into single words with segment_words,
+    using segment_engine ("python" or "sox").
+    When a manifest.Manifest is given, recordings whose audio, log and prompt source
+    did not change since their outputs were written are skipped.
+    With output = "kaldi", no word segments or word prompt files are written. Instead, Kaldi-style
+    wav.scp, segments, text and utt2spk files in audio/words/kaldi point into the full recordings.
+    When a catalog.Catalog is given, the prompts and segments that are written are added to it
+    and the logs are looked up in it.
     """
     words_dir = "words"
     stories_dir = "stories"
@@ -73,21 +174,46 @@ def prepare_data(clean_dirs, full_dict, audio_path, log_path, prompts_source, pr
     prompt_words_path = os.path.join(prompt_path, words_dir)
     prompt_stories_path = os.path.join(prompt_path, stories_dir)
     words_segments_path = os.path.join(audio_path, words_dir, segments_dir)
+    words_kaldi_path = os.path.join(audio_path, words_dir, "kaldi")
 
     #  remove working directories for audio and logs and create fresh ones
     if clean_dirs:
-        dir_lst = [prompt_words_path, prompt_stories_path,
-                   words_segments_path]
+        dir_lst = [prompt_words_path, prompt_stories_path]
+        if output == "files":
+            dir_lst.append(words_segments_path)
         for mydir in dir_lst:
-            pathlib.Path(mydir).mkdir(parents=True, exist_ok=False)
+            pathlib.Path(mydir).mkdir(parents=True, exist_ok=manifest is not None)
 
+    # parse all task logs once (or load them from the stored log table)
+    rec_logs = log_store.split_logs(log_store.get_log_store(log_path, catalog=catalog))
 
+    n_skipped = n_done = 0
+    kaldi_recordings = {}
+    kaldi_entries = []
     for rec_id, (full_audio, log) in full_dict.items():
-        # handle story tasks
+        if output == "kaldi" and "words" in rec_id:
+            # manifests are rebuilt for all word tasks in every run, without touching any audio
+            log_data = rec_logs[rec_id]
+            word_segments = dict(zip(log_data.index, zip(log_data['start_speak'], log_data['stop_speak'])))
+            prompts = dict(zip(log_data.index.astype(str), log_data['prompt'].astype(str)))
+            kaldi_recordings[rec_id] = full_audio
+            kaldi_entries += kaldi_word_entries(rec_id, full_audio, word_segments, prompts)
+            continue
+
+        inputs = {full_audio: file_state(full_audio), log: file_state(log)}
         if "story" in rec_id:
             storynum = rec_id.split("-")[1].replace("_", "")
             infile = os.path.join(prompts_source, f"{storynum}_clean.txt")
+            inputs[infile] = file_state(infile)
+        if manifest is not None and manifest.is_fresh(rec_id, "prepare", inputs):
+            n_skipped += 1
+            continue
+        outputs = []
+
+        # handle story tasks
+        if "story" in rec_id:
             outfile = os.path.join(prompt_stories_path, f"{rec_id}.prompt")
+            outputs.append(outfile)
 
             # generate prompt file
             prompt = ""
@@ -105,19 +231,16 @@ def prepare_data(clean_dirs, full_dict, audio_path, log_path, prompts_source, pr
         # handle word tasks
         elif "words" in rec_id:
             # print(rec_id, full_audio, log)
-            word_segments = {}
             audio_segments_path = full_audio.replace(audio_words_path, words_segments_path)
-            # load logfile to get the word timestamps
-            log_data = pd.read_csv(log, delimiter=";", index_col="user_id")
+            # get the word timestamps from the log table
+            log_data = rec_logs[rec_id]
+            word_segments = dict(zip(log_data.index, zip(log_data['start_speak'], log_data['stop_speak'])))
+            segment_chunks = rec_id.rsplit("-", 1)
 
-            for speaker_id, row in log_data.iterrows():
-                word_segments[row['prompt_id']] = (row['start_speak'], row['stop_speak'])
-                prompt = str(row['prompt'])
-                prompt_id = row['prompt_id']
-                segment_chunks = rec_id.rsplit("-", 1)
+            for prompt_id, prompt in zip(log_data.index, log_data['prompt'].astype(str)):
 
                 # generate separate prompts matching each variant of the 1st segment case
-                if prompt_id in {101, 201, 301}:
+                if prompt_id in FIRST_ITEMS:
                     outfile_start_path = os.path.join(prompt_words_path,
                                         f"{segment_chunks[0]}_{prompt_id}_taskstart-{segment_chunks[1]}.prompt")
                     with open(outfile_start_path, "w", encoding="utf-8") as prompt_out:
@@ -126,6 +249,7 @@ def prepare_data(clean_dirs, full_dict, audio_path, log_path, prompts_source, pr
                     outfile_timestamp_path = outfile_start_path.replace('taskstart', 'logstamp')
                     with open(outfile_timestamp_path, "w", encoding="utf-8") as prompt_out:
                         prompt_out.write(prompt)
+                    outputs += [outfile_start_path, outfile_timestamp_path]
 
                 # create regular prompt files for all other segments
                 else:
@@ -133,5 +257,31 @@ def prepare_data(clean_dirs, full_dict, audio_path, log_path, prompts_source, pr
                                            f"{segment_chunks[0]}_{prompt_id}-{segment_chunks[1]}.prompt")
                     with open(outfile, "w", encoding="utf-8") as prompt_out:
                         prompt_out.write(prompt)
+                    outputs.append(outfile)
+
+            with instrument.recording("segment", rec_id):
+                outputs += segment_words(full_audio, audio_segments_path, word_segments, segment_engine)
+
+        instrument.add_files(len(outputs), instrument.file_sizes(outputs))
+        if catalog is not None:
+            catalog.add("prompt", [f for f in outputs if f.endswith(".prompt")], rec_id)
+            catalog.add("segment", [f for f in outputs if not f.endswith(".prompt")], rec_id)
+
+        if manifest is not None:
+            manifest.record(rec_id, "prepare", inputs, outputs)
+            n_done += 1
+            # save regularly, so a crashed run can resume close to where it stopped
+            if n_done % 50 == 0:
+                manifest.save()
+                if catalog is not None:
+                    catalog.save()
+
+    if manifest is not None:
+        manifest.save()
+        print(f"\tSkipped {n_skipped} recordings that were already up to date.")
+    if catalog is not None:
+        catalog.save()
 
-            segment_words(full_audio, audio_segments_path, word_segments)
+    if output == "kaldi":
+        write_kaldi_dir(words_kaldi_path, kaldi_recordings, kaldi_entries)
+        print(f"\tWrote Kaldi manifests for {len(kaldi_entries)} word segments to {words_kaldi_path}.")
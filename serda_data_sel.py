@@ -5,20 +5,29 @@ import sys
 import os
 import argparse
 import shutil
-from subprocess import run, PIPE
+from concurrent.futures import ThreadPoolExecutor
 import re
 import pathlib
+import zipfile
 import pandas as pd
+import audio_io
+import instrument
+import scheduler
+import shards
+import preflight
+from manifest import Manifest, MANIFEST_NAME
+from catalog import Catalog, CATALOG_NAME
 
 
 """"
 @Author:        Bo Molenaar
 @Date:          13 March 2023
 
-@Last edited:    13 March 2023
+@Last edited:    18 October 2026
 
 This script takes SERDA v1 audio and log files and sorts them on task.
-The audio files are .webm format, so ffmpeg is called to convert them into .wav (maintaining 32-bit encoding)
+The audio files are .webm format, so ffmpeg is called to convert them into .wav (maintaining 32-bit encoding,
+or in another audio_io.AudioFormat: sample rate, bit depth and .wav or .flac)
 Log files are matched to the corresponding audio file in a dict.
 Audio files for story tasks with duration > 3 minutes are trimmed to 3 minutes.
 Audio files for word tasks are split on single words with added word ID tag.
@@ -26,13 +35,194 @@ Audio files for word tasks are split on single words with added word ID tag.
 
 
 
-def gen_clean_dict(audio_dir, log_dir, ignore_recs, clean_dirs, audio_raw = None, log_raw = None):
+def convert_command(infile, audio_format = audio_io.DEFAULT_FORMAT):
+    """
+    Returns the ffmpeg command that converts a single .webm file to audio_format
+    (default: .wav with encoding = pcm_s32le at the source sample rate).
+    """
+    return ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", infile, *audio_io.ffmpeg_args(audio_format),
+            f"{os.path.splitext(infile)[0]}{audio_format.extension}"]
+
+
+def convert_audio(webm_files, faulty_recs, jobs = None, audio_format = audio_io.DEFAULT_FORMAT):
+    """
+    Takes a list of .webm paths and converts them to audio_format (default: 32-bit .wav), running `jobs`
+    ffmpeg processes at the same time (default: number of cores). Recordings listed in faulty_recs are deleted
+    instead of converted and the source of each successful conversion is removed.
+    A failed conversion leaves no (partial) output behind and does not stop the batch; failures are collected
+    and returned as a dict with items 'webm path': 'error message', next to the list of converted audio paths.
+    """
+    to_convert = {}
+    for infile in webm_files:
+        rec_id = os.path.splitext(os.path.basename(infile))[0]
+        if rec_id in faulty_recs:
+            os.remove(infile)
+        else:
+            to_convert[rec_id] = infile
+
+    results = scheduler.run_commands({rec_id: convert_command(infile, audio_format) for rec_id, infile in to_convert.items()},
+                                     jobs, stage_name="convert")
+    failed = scheduler.failed_commands(results)
+    failures = {to_convert[rec_id]: error for rec_id, error in failed.items()}
+
+    converted = []
+    for rec_id, result in results.items():
+        if rec_id in failed:
+            # a killed or failed ffmpeg can leave a partial output that would be picked up as a recording
+            if os.path.isfile(result.args[-1]):
+                os.remove(result.args[-1])
+        else:
+            os.remove(to_convert[rec_id])
+            converted.append(result.args[-1])
+    return sorted(converted), failures
+
+
+def decode_command(infile, audio_format = audio_io.DEFAULT_FORMAT):
+    """Returns the ffmpeg command that decodes a .webm file to a .wav stream in audio_format on stdout, without metadata."""
+    return ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", infile, *audio_io.ffmpeg_args(audio_format),
+            "-bitexact", "-f", "wav", "-"]
+
+
+def process_stories(webm_files, faulty_recs, long_stories_path, jobs = None, audio_format = audio_io.DEFAULT_FORMAT):
+    """
+    Fused story path: converts, measures and trims story recordings with a single decode of each .webm.
+    The decoded audio of each story is streamed into long_stories_path (`jobs` ffmpeg processes at
+    the same time, default: number of cores), while the audio around 180s is kept in memory.
+    Stories up to 180s are then moved to the folder of their .webm. Longer stories stay in long_stories_path
+    as the original, and their trimmed version is written next to the .webm straight away, cut at the
+    first silence found in the kept audio (see trim_long_stories), so no untrimmed copy is left in stories.
+    Recordings listed in faulty_recs are deleted instead of converted.
+    audio_format sets the sample rate and bit depth of the output, which is always .wav.
+    Returns the list of converted .wav paths, a dict with items 'webm path': 'error message' for failed stories
+    and a dict with items 'rec_id': ('audio path', 'original duration') of the stories that were trimmed.
+    """
+    if audio_format.extension != ".wav":
+        raise ValueError("Stories can only be processed in one pass when they are written as .wav")
+    to_convert = {}
+    for infile in webm_files:
+        rec_id = os.path.splitext(os.path.basename(infile))[0]
+        if rec_id in faulty_recs:
+            os.remove(infile)
+        else:
+            to_convert[rec_id] = infile
+
+    streams = {}
+    def open_stream(rec_id):
+        # the sample rate is only known from the stream, so the kept audio starts 1s before 180s
+        streams[rec_id] = audio_io.WavStream(os.path.join(long_stories_path, f"{rec_id}.wav.part"),
+                                             STORY_MAX - 1, SILENCE_SEARCH_END)
+        return streams[rec_id]
+
+    results = scheduler.run_commands({rec_id: decode_command(infile, audio_format) for rec_id, infile in to_convert.items()},
+                                     jobs, stage_name="convert", stdout_to=open_stream)
+    failed = scheduler.failed_commands(results)
+    failures = {to_convert[rec_id]: error for rec_id, error in failed.items()}
+
+    converted = []
+    long_stories = {}
+    for rec_id, infile in to_convert.items():
+        stream = streams.get(rec_id)
+        if rec_id in failed:
+            if stream is not None and os.path.isfile(stream.path):
+                os.remove(stream.path)
+            continue
+        os.remove(infile)
+        audio = f"{os.path.splitext(infile)[0]}.wav"
+        audio_length = stream.duration
+        if audio_length <= STORY_MAX:
+            os.replace(stream.path, audio)
+        else:
+            audio_original = os.path.join(long_stories_path, f"{rec_id}.wav")
+            os.replace(stream.path, audio_original)
+            with instrument.recording("trim", rec_id), audio_io.WavReader(audio_original) as wav:
+                if audio_length <= STORY_TOLERANCE:
+                    cut_point = audio_length
+                else:
+                    window, window_start = stream.kept_samples()
+                    cut_point = window_cut_point(window, stream.info, window_start)
+                audio_io.write_wav(audio, wav.info, wav.segment(0, cut_point), pad=STORY_PAD)
+            long_stories[rec_id] = audio, audio_length
+        converted.append(audio)
+    return sorted(converted), failures, long_stories
+
+
+def task_dir(filename, words_path, stories_path):
+    """Returns the task folder a file belongs in based on its name, or None for unknown task types."""
+    if "words" in filename:
+        return words_path
+    if "story" in filename:
+        return stories_path
+    return None
+
+
+def extract_zip(zip_path, extension, words_path, stories_path, faulty_recs = frozenset(), skip = None, shard = None):
+    """
+    Reads the central directory of zip_path and streams every member with the given extension
+    straight into its task folder (words_path or stories_path), in a single pass.
+    Members of recordings in faulty_recs are never extracted and the redundant '-$...' part
+    of log filenames is removed on the way. Like `unzip -j`, paths inside the zip are ignored.
+    With shard = (i, n), only members of speakers in shard i of n are extracted (see shards.py).
+    skip is an optional callable skip(rec_id, inputs) that returns True for members that
+    don't need to be extracted again, where inputs = {'zipname:member': [CRC, size]}.
+    Returns a dict with items 'extracted file path': inputs.
+    """
+    extracted = {}
+    with zipfile.ZipFile(zip_path) as zipped:
+        for member in zipped.infolist():
+            filename = os.path.basename(member.filename)
+            if member.is_dir() or not filename.endswith(extension):
+                continue
+            if "$" in filename:
+                filename = f"{filename.split('-$')[0]}{extension}"
+            rec_id = filename.split('.')[0]
+            if rec_id in faulty_recs or not shards.in_shard(rec_id, shard):
+                continue
+            target_dir = task_dir(filename, words_path, stories_path)
+            if target_dir is None:
+                continue
+            inputs = {f"{os.path.basename(zip_path)}:{member.filename}": [member.CRC, member.file_size]}
+            if skip is not None and skip(rec_id, inputs):
+                continue
+            target = os.path.join(target_dir, filename)
+            with zipped.open(member) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            extracted[target] = inputs
+    return extracted
+
+
+def gen_clean_dict(audio_dir, log_dir, ignore_recs, clean_dirs, audio_raw = None, log_raw = None, jobs = None,
+                   ingest = "stream", manifest = None, trim_engine = "fused", shard = None,
+                   audio_format = audio_io.DEFAULT_FORMAT, drop_flagged = False, catalog = None):
     """
     This function encapsulates the entire data selection procedure,
     from audio and log zips + prompt files to directories of stories and segmented words.
     Story audio over 3 minutes is trimmed and specified recordings are ignored.
+    Audio conversion runs on `jobs` parallel workers (default: number of cores).
+    With ingest = "stream" the zips are extracted straight into their task folders,
+    with ingest = "unzip" they are unzipped with `unzip` into a flat folder and sorted afterwards.
+    When a manifest.Manifest is given (stream ingest only), zip members that were already
+    extracted, converted and trimmed in an earlier run are skipped.
+    Long stories are trimmed with trim_engine ("fused", "python" or "ffmpeg"). With "fused" (stream ingest only)
+    stories are converted, measured and trimmed with a single decode, see process_stories;
+    otherwise see trim_long_stories.
+    With shard = (i, n) (stream ingest only), only the recordings of speakers in shard i of n are extracted.
+    Recordings are converted to audio_format (an audio_io.AudioFormat, default: 32-bit .wav at the source rate);
+    .flac recordings are always trimmed with ffmpeg and sox.
+    Converted recordings that are empty, truncated or shorter than preflight.MIN_SECONDS are flagged
+    and listed in audio_dir/flagged_recordings.txt. With drop_flagged = True, empty zip members are
+    not extracted and the flagged recordings are removed before they are probed, trimmed or segmented;
+    with a manifest, they are recorded as dropped and not extracted again by later runs with drop_flagged.
+    When a catalog.Catalog is given, the recordings and logs written by this run are added to it
+    (with their durations) and existing recordings and logs are looked up in it instead of walking
+    audio_dir and log_dir.
     """
 
+    if shard is not None and ingest != "stream":
+        raise ValueError("Sharding requires ingest = 'stream'")
+    if audio_format.extension != ".wav" and trim_engine != "ffmpeg":
+        print(f"\tStories in {audio_format.extension} format are trimmed with ffmpeg and sox.")
+        trim_engine = "ffmpeg"
+
     # declare some directories to use
     words_dir = "words"
     stories_dir = "stories"
@@ -50,6 +240,14 @@ def gen_clean_dict(audio_dir, log_dir, ignore_recs, clean_dirs, audio_raw = None
     with open(ignore_recs, "r", encoding="utf-8") as recs:
         faulty_stories = {x.strip("\n ") for x in recs.readlines()}
 
+    if clean_dirs and drop_flagged:
+        # empty recordings and logs can be found in the zip listings, before anything is extracted
+        with instrument.stage("preflight"):
+            flagged_members = preflight.preflight(audio_raw, log_raw)
+        if flagged_members:
+            print(f"\tWARNING: {len(flagged_members)} recording(s) have an empty audio or log file and are left out.")
+        faulty_stories |= flagged_members.keys()
+
     if clean_dirs:
         print("\tCreating new subfolders...")
 
@@ -60,108 +258,168 @@ def gen_clean_dict(audio_dir, log_dir, ignore_recs, clean_dirs, audio_raw = None
             pathlib.Path(mydir).mkdir(parents=True, exist_ok=True)
         print("\tDone.")
 
-        # unzip audio and log files into the path specified at call
-        print("\tUnzipping audio files...")
-        run(f"unzip -ojqq {audio_raw} -d {audio_dir}", shell=True, check=True)
-        print("\tDone.")
-        print("\tUnzipping log files...")
-        run(f"unzip -ojqq {log_raw} -d {log_dir}", shell=True, check=True)
-        print("\tDone.")
-
-        # gather audio files in a list
-        audio_filelist = []
-        for dirpath, dirnames, filenames in os.walk(audio_dir):
-            for filename in filenames:
-                if filename.endswith(".webm"):
-                    #  remove stories with faulty recordings from the dataset
-                    rec_id = filename.rstrip('.webm')
-                    if rec_id in faulty_stories:
-                        # print(os.path.join(dirpath, filename))
-                        run(f"rm {os.path.join(dirpath, filename)}", shell=True, check=True)
-                    else:
-                        audio_filelist.append(filename)
-        
-        # convert .webm files in audio dir to .wav with encoding = pcm_s32le
-        print("\tConverting audio files from .webm to .wav...")
-        for file in audio_filelist:
-            infile = os.path.join(audio_dir, file)
-            outfile = infile.replace('webm', 'wav')
-            run(f"ffmpeg -hide_banner -loglevel error -i {infile} -c:a pcm_s32le {outfile}", shell=True, check=True)
-            run(f"rm {infile}", shell=True, check=True)
-        print("\tDone.")
-
-        # TODO
-        # check audio filesize with command below
-        # and when it's < 2MB (under 1 min)
-        # 1. add it to a list
-        # 2. raise a warning saying how many items were found that are very small
-        # 3. ask to append this list of rec ids to recs_to_ignore.txt?
-        #
-        # size_command = "du -k $filename | cut -f 1"
-        # example output --> 7036
-        # so check if < 2000
-
-        # move audio files to the correct folder based on task type (words or story)
-        print("\tMoving audio files...")
-        for f in audio_filelist:
-            f_old = os.path.join(audio_dir, f)
-            if "words" in f:
-                f_new = os.path.join(audio_words_path, f)   # keep target as var
-                shutil.move(f_old, f_new)                 # move to target location
-            elif "story" in f:
-                f_new = os.path.join(audio_stories_path, f)     # keep target as var
-                shutil.move(f_old, f_new)                     # move to target location
+        if ingest == "stream":
+            # read both zips' central directories and stream every member straight to its task folder
+            print("\tExtracting audio and log files into task folders...")
+            skip_audio = skip_logs = None
+            if manifest is not None:
+                # recordings dropped by an earlier --drop-flagged run are not extracted again either
+                skip_audio = lambda rec_id, inputs: (manifest.is_fresh(rec_id, "audio", inputs) or
+                                                     drop_flagged and manifest.is_fresh(rec_id, "dropped", inputs))
+                skip_logs = lambda rec_id, inputs: manifest.is_fresh(rec_id, "log", inputs)
+            with instrument.stage("ingest"), ThreadPoolExecutor(max_workers=2) as pool:
+                audio_future = pool.submit(extract_zip, audio_raw, ".webm",
+                                           audio_words_path, audio_stories_path, faulty_stories, skip_audio, shard)
+                log_future = pool.submit(extract_zip, log_raw, ".csv",
+                                         log_words_path, log_stories_path, faulty_stories, skip_logs, shard)
+                audio_members = audio_future.result()
+                log_members = log_future.result()
+                instrument.add_files(len(audio_members) + len(log_members),
+                                     instrument.file_sizes(audio_members) + instrument.file_sizes(log_members))
+            webm_files = list(audio_members)
+            print(f"\tDone. Extracted {len(audio_members)} audio and {len(log_members)} log files.")
+        else:
+            # unzip audio and log files into the path specified at call
+            with instrument.stage("ingest"):
+                print("\tUnzipping audio and log files...")
+                scheduler.run_commands({"audio": ["unzip", "-ojqq", audio_raw, "-d", audio_dir],
+                                        "log": ["unzip", "-ojqq", log_raw, "-d", log_dir]},
+                                       timeout=None, retries=0, check=True)
+                print("\tDone.")
+
+            # gather audio files in a list
+            webm_files = []
+            for dirpath, dirnames, filenames in os.walk(audio_dir):
+                for filename in filenames:
+                    if filename.endswith(".webm"):
+                        webm_files.append(os.path.join(dirpath, filename))
+
+        # convert .webm files in audio dir to audio_format (default: .wav with encoding = pcm_s32le)
+        # stories with faulty recordings are removed from the dataset by the conversion pool
+        print(f"\tConverting audio files from .webm to {audio_format.extension} ({audio_format.bits_per_sample}-bit,"
+              f" {audio_format.sample_rate or 'source'} Hz, {jobs or os.cpu_count()} jobs)...")
+        # with the fused story path, stories are converted, measured and trimmed with a single decode
+        fused_stories = {}
+        with instrument.stage("convert"):
+            if trim_engine == "fused" and ingest == "stream":
+                story_files = [f for f in webm_files if "story" in os.path.basename(f)]
+                word_files = [f for f in webm_files if "story" not in os.path.basename(f)]
+                wav_files, failed = convert_audio(word_files, faulty_stories, jobs, audio_format)
+                story_wavs, story_failed, fused_stories = process_stories(story_files, faulty_stories,
+                                                                          long_stories_path, jobs, audio_format)
+                wav_files = sorted(wav_files + story_wavs)
+                failed.update(story_failed)
+                print(f"\tTrimmed {len(fused_stories)} stories to 3 mins while converting them.")
             else:
-                f_new = ''
+                wav_files, failed = convert_audio(webm_files, faulty_stories, jobs, audio_format)
+            instrument.add_files(len(wav_files), instrument.file_sizes(wav_files))
+        audio_filelist = [os.path.basename(f) for f in wav_files]
+        if failed:
+            print(f"\tWARNING: {len(failed)} file(s) could not be converted and are left out:")
+            for infile, error in sorted(failed.items()):
+                print(f"\t\t{infile}\t{error}")
         print("\tDone.")
 
-        # gather log files in a list and prepare a dict
-        log_filelist = []
-        for dirpath, dirnames, filenames in os.walk(log_dir):
-            for filename in filenames:
-                if filename.endswith(".csv"):
-                    log_filelist.append(filename)
-        log_files = {}
-
-        # move log files and assign their location to their rec id in the dict
-        print("\tMoving log files...")
-        for f in log_filelist:
-            f_old = os.path.join(log_dir, f)
-            if "$" in f:
-                f = f"{f.split('-$')[0]}.csv"
-            if "words" in f:
-                f_new = os.path.join(log_words_path, f)     # keep target as var
-                shutil.move(f_old, f_new)                   # move to target location
-            elif "story" in f:
-                f_new = os.path.join(log_stories_path, f)       # keep target as var
-                shutil.move(f_old, f_new)                       # move to target location
+        # flag very short (under 1 min), empty and truncated recordings from their headers
+        dropped = set()
+        with instrument.stage("preflight"):
+            flagged = preflight.scan_audio(wav_files, jobs=jobs)
+        instrument.set_info("flagged_recordings", flagged)
+        with open(os.path.join(audio_dir, "flagged_recordings.txt"), "w", encoding="utf-8") as flagged_out:
+            for rec_id, reason in sorted(flagged.items()):
+                flagged_out.write(f"{rec_id}\t{reason}\n")
+        if flagged:
+            print(f"\tWARNING: {len(flagged)} recording(s) are short, empty or truncated"
+                  f" (see {os.path.join(audio_dir, 'flagged_recordings.txt')}).")
+            if drop_flagged:
+                for audio in [f for f in wav_files if preflight.member_rec_id(f) in flagged]:
+                    os.remove(audio)
+                wav_files = [f for f in wav_files if preflight.member_rec_id(f) not in flagged]
+                fused_stories = {rec_id: story for rec_id, story in fused_stories.items() if rec_id not in flagged}
+                dropped = set(flagged)
+                audio_filelist = [os.path.basename(f) for f in wav_files]
+                print("\tThey were removed.")
             else:
-                f_new = ''
-            # use the filename to generate a recording ID tag
-            rec_id = f.split('.')[0]
-            # then link full path to audio to rec ID in a dict
-            log_files[rec_id] = f_new
-        print("\tDone.")
+                print(f"\tAdd them to {ignore_recs} with preflight.py, or rerun with --drop-flagged to leave them out.")
 
+        if ingest == "stream":
+            # use the filename to generate a recording ID tag and link the log path to it
+            log_files = {os.path.basename(f).split('.')[0]: f for f in log_members}
+        else:
+            # move audio files to the correct folder based on task type (words or story)
+            print("\tMoving audio files...")
+            for f in audio_filelist:
+                f_old = os.path.join(audio_dir, f)
+                if "words" in f:
+                    f_new = os.path.join(audio_words_path, f)   # keep target as var
+                    shutil.move(f_old, f_new)                 # move to target location
+                elif "story" in f:
+                    f_new = os.path.join(audio_stories_path, f)     # keep target as var
+                    shutil.move(f_old, f_new)                     # move to target location
+                else:
+                    f_new = ''
+            print("\tDone.")
+
+            # gather log files in a list and prepare a dict
+            log_filelist = []
+            for dirpath, dirnames, filenames in os.walk(log_dir):
+                for filename in filenames:
+                    if filename.endswith(".csv"):
+                        log_filelist.append(filename)
+            log_files = {}
+
+            # move log files and assign their location to their rec id in the dict
+            print("\tMoving log files...")
+            for f in log_filelist:
+                f_old = os.path.join(log_dir, f)
+                if "$" in f:
+                    f = f"{f.split('-$')[0]}.csv"
+                if "words" in f:
+                    f_new = os.path.join(log_words_path, f)     # keep target as var
+                    shutil.move(f_old, f_new)                   # move to target location
+                elif "story" in f:
+                    f_new = os.path.join(log_stories_path, f)       # keep target as var
+                    shutil.move(f_old, f_new)                       # move to target location
+                else:
+                    f_new = ''
+                # use the filename to generate a recording ID tag
+                rec_id = f.split('.')[0]
+                # then link full path to audio to rec ID in a dict
+                log_files[rec_id] = f_new
+            print("\tDone.")
+
+        if catalog is not None:
+            # add the converted recordings (in their task folders by now) and the logs of this run to the catalog
+            catalog.add("recording", [os.path.join(task_dir(f, audio_words_path, audio_stories_path), f)
+                                      for f in audio_filelist if task_dir(f, audio_words_path, audio_stories_path)])
+            catalog.add("log", [f for f in log_files.values() if f])
+
+    if catalog is not None:
+        # look up the recordings and logs in the catalog (audio_dir and log_dir are only walked the first time)
+        if not clean_dirs or manifest is not None:
+            log_files = {os.path.basename(f).split('.')[0]: f for f in catalog.find("log", log_dir)}
+        audio_files = {os.path.basename(f).split('.')[0]: f for f in catalog.find("recording", audio_dir)}
     else:
-        # gather log files in a list and prepare a dict
-        log_filelist = []
-        log_files = {}
-        for dirpath, dirnames, filenames in os.walk(log_dir):
+        if not clean_dirs or manifest is not None:
+            # gather log files in a list and prepare a dict
+            # (for incremental runs this includes the logs extracted in earlier runs)
+            log_filelist = []
+            log_files = {}
+            for dirpath, dirnames, filenames in os.walk(log_dir):
+                for filename in filenames:
+                    if filename.endswith(".csv"):
+                        log_filelist.append(filename)
+                        rec_id = filename.split('.')[0]
+                        log_files[rec_id] = os.path.join(dirpath, filename)
+
+        # gather converted audio files in a list and assign their location to their rec id in a dict
+        audio_files = {}
+        for dirpath, dirnames, filenames in os.walk(audio_dir):
             for filename in filenames:
-                if filename.endswith(".csv"):
-                    log_filelist.append(filename)
+                if (filename.endswith(audio_io.AUDIO_EXTENSIONS)) and ('segments' not in dirpath) and (long_stories_dir not in dirpath):
                     rec_id = filename.split('.')[0]
-                    log_files[rec_id] = os.path.join(dirpath, filename)
-
-    # gather converted audio files in a list and assign their location to their rec id in a dict
-    audio_files = {}
-    for dirpath, dirnames, filenames in os.walk(audio_dir):
-        for filename in filenames:
-            if (filename.endswith(".wav")) and ('segments' not in dirpath):
-                rec_id = filename.split('.')[0]
-                filepath = os.path.join(dirpath, filename)
-                audio_files[rec_id] = filepath
+                    filepath = os.path.join(dirpath, filename)
+                    audio_files[rec_id] = filepath
 
     # link the audio file and the corresponding log file to their rec id in a dict
     full_dict = {}
@@ -174,75 +432,209 @@ def gen_clean_dict(audio_dir, log_dir, ignore_recs, clean_dirs, audio_raw = None
         #  Now we can use the dict to pull matching audio and log files and process them
         #  e.g. with sox and pandas, respectively
         long_stories = {}  #  dict of story audio files that are over 3 min long and need to be cropped
-
+        new_recs = {os.path.basename(f).split('.')[0] for f in wav_files}
+
+        # get audio length of all recordings from their headers and check if stories are over 3 minutes long
+        with instrument.stage("probe"):
+            durations = audio_io.probe_durations([audio for audio, log in full_dict.values()], jobs)
+        # storage per second of audio, to compare output formats
+        audio_seconds = sum(audio_length for audio_length in durations.values() if audio_length)
+        audio_bytes = instrument.file_sizes(durations)
+        instrument.set_info("audio", {"format": audio_format._asdict(), "recordings": len(durations),
+                                      "seconds": audio_seconds, "bytes": audio_bytes})
+        print(f"\t{audio_seconds / 3600:.1f} hours of audio in {audio_bytes / 2 ** 20:.1f} MB"
+              f" ({audio_bytes / 1000 / max(audio_seconds, 1e-9):.1f} kB per second of audio).")
+        # the headers of stories trimmed by the fused path already show their trimmed duration, but the reports
+        # list their original duration (like the stories trimmed below), so that is used from here on
+        header_durations = dict(durations)
+        durations.update({audio: audio_length for audio, audio_length in fused_stories.values()})
         for rec_id, (audio, log) in full_dict.items():
-            if "story" in rec_id:
-                # get audio length and check if recordings are over 3 minutes long
-                audio_length = float(
-                    run(['soxi', '-D', audio], stdout=PIPE, check=True).stdout.decode('utf-8').strip("\n "))
-                if audio_length > 180:
-                    # print(f"{rec_id}\t\tThis story reading is {audio_length}s long."
-                    # "This is longer than 3 minutes, please crop it.")
-                    long_stories[rec_id] = audio, audio_length
+            audio_length = durations[audio]
+            if audio_length is None:
+                print(f"\tWARNING: could not read the duration of {audio}")
+            elif "story" in rec_id and rec_id in new_recs and audio_length > STORY_MAX:
+                # print(f"{rec_id}\t\tThis story reading is {audio_length}s long."
+                # "This is longer than 3 minutes, please crop it.")
+                long_stories[rec_id] = audio, audio_length
+
+        recordings_data = pd.DataFrame.from_dict(
+            {rec_id: (audio, durations[audio]) for rec_id, (audio, log) in full_dict.items()},
+            orient='index', columns=['Path', 'Duration (s)']).rename_axis("Recording ID")
+        recordings_data.to_excel(os.path.join(audio_dir, "recordings.xlsx"))
+
+        long_stories_data = pd.DataFrame.from_dict(long_stories, orient='index', columns=['Path', 'Duration (s)'])
+        long_stories_data = long_stories_data.rename_axis("Recording ID")
+        long_stories_report = os.path.join(audio_dir, "long_stories.xlsx")
+        if manifest is not None and os.path.isfile(long_stories_report):
+            # keep the long stories found in earlier runs in the report
+            previous_data = pd.read_excel(long_stories_report, index_col=0)
+            previous_data = previous_data[~previous_data.index.isin(long_stories_data.index)]
+            long_stories_data = pd.concat([previous_data, long_stories_data]).rename_axis("Recording ID")
+        long_stories_data.to_excel(long_stories_report)
+
+        with instrument.stage("trim"):
+            to_trim = {rec_id: story for rec_id, story in long_stories.items() if rec_id not in fused_stories}
+            trim_long_stories(to_trim, audio_dir, trim_engine, jobs)
+            # stories trimmed by the fused path are counted in the convert stage
+            instrument.add_files(len(to_trim), instrument.file_sizes(audio for audio, length in to_trim.values()))
+
+        if catalog is not None:
+            catalog.set_durations(header_durations)
+            # trimmed stories replace their recording, the originals are kept in long_stories
+            trimmed = [audio for audio, audio_length in to_trim.values()]
+            catalog.add("recording", trimmed, durations=audio_io.probe_durations(trimmed, jobs))
+            originals = [os.path.join(long_stories_path, os.path.basename(audio))
+                         for audio, audio_length in list(to_trim.values()) + list(fused_stories.values())]
+            catalog.add("long_story", originals, durations=audio_io.probe_durations(originals, jobs))
+            catalog.save()
+
+        if manifest is not None and ingest == "stream":
+            # record what was produced in this run, so an incremental rerun can skip it
+            for webm, inputs in audio_members.items():
+                rec_id = os.path.basename(webm).split('.')[0]
+                if rec_id in dropped:
+                    # a dropped recording has no outputs, it is skipped until its zip member changes
+                    manifest.record(rec_id, "dropped", inputs, [])
+                    continue
+                if rec_id not in new_recs:
+                    continue
+                audio = full_dict[rec_id][0]
+                outputs = [audio]
+                if rec_id in long_stories:
+                    outputs.append(audio.replace("stories", "long_stories"))
+                manifest.record(rec_id, "audio", inputs, outputs)
+            for log, inputs in log_members.items():
+                manifest.record(os.path.basename(log).split('.')[0], "log", inputs, [log])
+            manifest.save()
+
+    return full_dict
 
-        long_stories_data = pd.DataFrame(long_stories).T.rename_axis("Recording ID")
-        long_stories_data.columns = ['Path', 'Duration (s)']
-        long_stories_data.to_excel(os.path.join(audio_dir, "long_stories.xlsx"))
 
-        trim_long_stories(long_stories, audio_dir)
+# maximum story duration (s)
+STORY_MAX = 180
+# stories up to this duration (s) are not searched for a silence
+STORY_TOLERANCE = 181
+# minimal silence duration (s) to cut at
+SILENCE_DURATION = 0.1
+# silence padding added around trimmed stories (s)
+STORY_PAD = 0.3
+# (noise level in dB, search window in s) in order of preference
+SILENCE_SEARCH = [(-50, (180, 182)), (-70, (180, 182)), (-70, (180, 184))]
+# end of the audio (s) that is searched for silences
+SILENCE_SEARCH_END = max(high for noise_level, (low, high) in SILENCE_SEARCH) + SILENCE_DURATION
 
-    return full_dict
+
+def silence_window(sample_rate):
+    """Returns the (start, end) time in s of the audio around 180s that is searched for silences."""
+    # start 1 frame before 180s so silences that already started before 180s are not mistaken for new ones
+    first_frame = max(audio_io.time_to_frame(STORY_MAX, sample_rate) - 1, 0)
+    return first_frame / sample_rate, SILENCE_SEARCH_END
+
+
+def window_cut_point(window, info, window_start):
+    """
+    Takes the (frames x channels) samples of a long story that start at window_start (s)
+    and finds the first silence of at least 0.1s that starts between 180s and 182s at -50dB,
+    then at -70dB, then between 180s and 184s at -70dB. Both noise levels are evaluated in one pass.
+    Returns the start of that silence in seconds, or 180 if no silence is found.
+    """
+    noise_levels = sorted({noise_level for noise_level, window_range in SILENCE_SEARCH})
+    starts = audio_io.silence_starts(window, info, noise_levels, SILENCE_DURATION)
+    for noise_level, (low, high) in SILENCE_SEARCH:
+        start_times = starts[noise_level] + window_start
+        candidates = start_times[(start_times >= low) & (start_times < high)]
+        if candidates.size:
+            return float(candidates[0])
+    return STORY_MAX
+
+
+def find_cut_point(wav):
+    """
+    Takes an open audio_io.WavReader of a long story and finds its cut point with window_cut_point.
+    Only the audio around the search windows is read.
+    """
+    window_start, window_end = silence_window(wav.info.sample_rate)
+    return window_cut_point(wav.segment(window_start, window_end), wav.info, window_start)
 
 
-def trim_long_stories(stories_dict, audio_dir):
+def trim_long_stories(stories_dict, audio_dir, engine = "python", jobs = None):
     """
     Takes a dict with items 'rec_id': ('audio path', 'audio duration').
     Recs in this dict should be audio of length > 180s.
     Tries to find the first 0.1s silence after 180s, trims the file from start to
     that silence marker, then saves it, overwriting the original file.
     If no silence is found, trims at 180s.
+    The original file is moved to long_stories. By default the silence is detected in-process
+    on the audio around 180s and the trimmed file is written directly from the archived original.
+    Use engine = "ffmpeg" to fall back to ffmpeg silencedetect and sox, with `jobs` commands
+    running at the same time (default: number of cores). Any other engine (e.g. "fused", for stories
+    that were not converted by process_stories) trims in-process.
     """
     print(f"\tTrimming {len(stories_dict.items())} stories to 3 mins...")
-    
-    audio_tmp_dir = os.path.join(audio_dir, "tmp")
-    run(f"mkdir {audio_tmp_dir}", check=True, shell=True)
+
+    if engine == "ffmpeg":
+        trim_long_stories_ffmpeg(stories_dict, audio_dir, jobs)
+        print("\tDone.")
+        return
 
     for rec_id, (audio, audio_length) in stories_dict.items():
         audio_new = audio.replace("stories", "long_stories")
-        # this is somehow broken now because os thinks old and new location are the same and will not move them
-        # currently using force flag to override
-        run(f"cp -f {audio} {audio_new}", check=True, shell=True)
-        audio_tmp = audio.replace("stories", "tmp")
-
-        noiselvl = "-50"
-        ffcommand = f"ffmpeg -hide_banner -i {audio_new} -af silencedetect=noise={noiselvl}dB:d=0.1 -f null -"
-        ff_out = run(ffcommand, check=True, shell=True, capture_output=True)
-
-        silence_start = re.search(r"silence_start: 18[01].*", ff_out.stderr.decode('utf-8'))
-        if audio_length <= 181:
-            cut_point = audio_length
-        elif silence_start:
-            cut_point = float(silence_start.group(0).split(" ")[1].strip(" "))
-        else:
-            noiselvl = "-70"
-            ffcommand = f"ffmpeg -hide_banner -i {audio_new} -af silencedetect=noise={noiselvl}dB:d=0.1 -f null -"
-            ff_out = run(ffcommand, check=True, shell=True, capture_output=True)
-
-            silence_start = re.search(r"silence_start: 18[01].*", ff_out.stderr.decode('utf-8'))
-            if silence_start:
-                cut_point = float(silence_start.group(0).split(" ")[1].strip(" "))
+        # keep the original in long_stories; a rename within audio_dir doesn't copy any data
+        os.replace(audio, audio_new)
+        with instrument.recording("trim", rec_id), audio_io.WavReader(audio_new) as wav:
+            if audio_length <= STORY_TOLERANCE:
+                cut_point = audio_length
             else:
-                silence_start = re.search(r"silence_start: 18[0-3].*", ff_out.stderr.decode('utf-8'))
+                cut_point = find_cut_point(wav)
+            audio_io.write_wav(audio, wav.info, wav.segment(0, cut_point), pad=STORY_PAD)
+    print("\tDone.")
+
+
+def silencedetect_command(audio, noise_level):
+    """Returns the ffmpeg command that lists the silences of at least 0.1s in audio at noise_level dB."""
+    return ["ffmpeg", "-hide_banner", "-i", audio, "-af", f"silencedetect=noise={noise_level}dB:d={SILENCE_DURATION}",
+            "-f", "null", "-"]
+
+
+def trim_long_stories_ffmpeg(stories_dict, audio_dir, jobs = None):
+    """
+    ffmpeg/sox version of trim_long_stories, decoding each long story with ffmpeg
+    silencedetect (once or twice) and trimming it with sox.
+    Each step is submitted for all stories at once, so `jobs` stories are processed at the same time.
+    """
+    audio_tmp_dir = os.path.join(audio_dir, "tmp")
+    pathlib.Path(audio_tmp_dir).mkdir(exist_ok=True)
+
+    # keep a copy of each original in long_stories
+    originals = {}
+    for rec_id, (audio, audio_length) in stories_dict.items():
+        originals[rec_id] = audio.replace("stories", "long_stories")
+        shutil.copyfile(audio, originals[rec_id])
+
+    # stories up to 181s are kept whole, the others are searched at -50dB, then at -70dB
+    cut_points = {rec_id: audio_length for rec_id, (audio, audio_length) in stories_dict.items()
+                  if audio_length <= STORY_TOLERANCE}
+    for noise_level, patterns in [(-50, [r"silence_start: 18[01].*"]),
+                                  (-70, [r"silence_start: 18[01].*", r"silence_start: 18[0-3].*"])]:
+        to_search = {rec_id: silencedetect_command(original, noise_level)
+                     for rec_id, original in originals.items() if rec_id not in cut_points}
+        results = scheduler.run_commands(to_search, jobs, check=True, stage_name="trim")
+        for rec_id, ff_out in results.items():
+            ff_err = ff_out.stderr.decode('utf-8', errors='replace')
+            for pattern in patterns:
+                silence_start = re.search(pattern, ff_err)
                 if silence_start:
-                    cut_point = float(silence_start.group(0).split(" ")[1].strip(" "))
-                else:
-                    cut_point = 180
-        soxcommand = f"sox {audio_new} {audio_tmp} trim 0 ={cut_point} pad 0.3 0.3"
-        run(soxcommand, check=True, shell=True)
-        run(f"rm {audio}", check=True, shell=True)
-        run(f"mv {audio_tmp} {audio}", check=True, shell=True)
+                    cut_points[rec_id] = float(silence_start.group(0).split(" ")[1].strip(" "))
+                    break
+
+    trimmed = {rec_id: audio.replace("stories", "tmp") for rec_id, (audio, audio_length) in stories_dict.items()}
+    soxcommands = {rec_id: ["sox", originals[rec_id], trimmed[rec_id], "trim", "0", f"={cut_points.get(rec_id, STORY_MAX)}",
+                            "pad", str(STORY_PAD), str(STORY_PAD)]
+                   for rec_id in stories_dict}
+    scheduler.run_commands(soxcommands, jobs, check=True, stage_name="trim")
+    for rec_id, (audio, audio_length) in stories_dict.items():
+        os.replace(trimmed[rec_id], audio)
     shutil.rmtree(audio_tmp_dir)
-    print("\tDone.")
 
 if __name__ == "__main__":
 
@@ -255,14 +647,46 @@ if __name__ == "__main__":
     parser.add_argument('audio_dir', help = "Name of audio processing and storing dir")
     parser.add_argument('log_dir', help = "Name of log processing and storing dir")
     parser.add_argument('recs_to_ignore', help = "Location of a file specifying recordings to ignore")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help = "Number of parallel audio conversion jobs. Default = number of cores")
+    parser.add_argument('--ingest', choices=['stream', 'unzip'], default='stream',
+                        help = "How to extract the zips: 'stream' extracts members straight into task folders,"
+                        " 'unzip' unzips everything and sorts it afterwards. Default = 'stream'")
+    parser.add_argument('--trim-engine', choices=['fused', 'python', 'ffmpeg'], default='fused',
+                        help = "Engine used to find silences in and trim long stories. 'fused' converts, measures"
+                        " and trims each story with a single decode (stream ingest only). Default = 'fused'")
+    parser.add_argument('--drop-flagged', action='store_true',
+                        help = "Leave out recordings that are short, empty or truncated (see preflight.py)")
+    parser.add_argument('--sample-rate', type=int, default=None,
+                        help = "Sample rate (Hz) of converted recordings. Default = the source sample rate")
+    parser.add_argument('--bit-depth', type=int, choices=[16, 24, 32], default=32,
+                        help = "Bits per sample of converted recordings. Default = 32")
+    parser.add_argument('--audio-format', choices=['wav', 'flac'], default='wav',
+                        help = "File format of converted recordings. Default = 'wav'")
+    parser.add_argument('--shard', type=shards.parse_shard, default=None,
+                        help = "Only process shard i of n, e.g. --shard 2/4, in project_dir/shards/shard_i_of_n"
+                        " (see shards.py). Requires --ingest stream")
     args = parser.parse_args()
     if args.clean and (args.audiozip is None or args.logzip is None):
         parser.error("--clean requires --audiozip and --logzip.")
+    if args.shard and args.ingest != 'stream':
+        parser.error("--shard requires --ingest stream.")
+    try:
+        audio_format = audio_io.audio_format(args.sample_rate, args.bit_depth, args.audio_format)
+    except ValueError as err:
+        parser.error(str(err))
         
-    audio_path = os.path.join(args.project_dir, args.audio_dir)
-    log_path = os.path.join(args.project_dir, args.log_dir)
+    # like uber_serda.py: a shard works in its own project dir, which keeps its own manifest and catalog
+    project_dir = args.project_dir if args.shard is None else shards.shard_dir(args.project_dir, args.shard)
+    audio_path = os.path.join(project_dir, args.audio_dir)
+    log_path = os.path.join(project_dir, args.log_dir)
+    pathlib.Path(project_dir).mkdir(parents=True, exist_ok=True)
+    catalog = Catalog(os.path.join(project_dir, CATALOG_NAME))
 
     if args.clean:
-        gen_clean_dict(audio_path, log_path, args.recs_to_ignore, args.clean, args.audiozip, args.logzip)
+        gen_clean_dict(audio_path, log_path, args.recs_to_ignore, args.clean, args.audiozip, args.logzip, args.jobs, args.ingest,
+                       Manifest(os.path.join(project_dir, MANIFEST_NAME)), args.trim_engine, args.shard,
+                       audio_format, args.drop_flagged, catalog)
     else:
-        gen_clean_dict(audio_path, log_path, args.recs_to_ignore, args.clean)
+        gen_clean_dict(audio_path, log_path, args.recs_to_ignore, args.clean, catalog=catalog)
+    catalog.close()
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""""
+@Author:        Bo Molenaar
+@Date:          18 October 2026
+
+@Last edited:    18 October 2026
+
+Speaker sharding for running uber_serda.py on several nodes (e.g. as a job array).
+With --shard i/n, recordings are assigned to shard i of n by the CRC32 of their speaker ID,
+so every shard gets the same speakers in every run, and a shard only extracts and processes
+its own recordings into project_dir/shards/shard_i_of_n.
+When all shards have finished, this script merges their manifests (with paths rewritten to project_dir),
+catalogs, recordings.xlsx and long_stories.xlsx and (optionally) diagnostics matrices into project_dir.
+
+Expected input: 1) project directory, 2) audio dirname, 3) optional -d/--diagnostics with
+the paths of diagnostics matrices relative to each shard directory
+"""
+
+import os
+import re
+import json
+import zlib
+import argparse
+import pandas as pd
+from manifest import MANIFEST_NAME
+from catalog import Catalog, CATALOG_NAME
+
+SHARDS_DIR = "shards"
+
+
+def parse_shard(shard):
+    """Parses 'i/n' (1 <= i <= n) into a tuple (i, n). Raises ValueError for anything else."""
+    match = re.fullmatch(r"(\d+)/(\d+)", shard.strip())
+    if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"A shard should look like i/n with 1 <= i <= n, not '{shard}'")
+    return int(match.group(1)), int(match.group(2))
+
+
+def speaker_id(rec_id):
+    """Returns the speaker ID of a recording ID (<speaker ID>-<task>-<timestamp>)."""
+    return rec_id.split("-")[0]
+
+
+def shard_of(rec_id, n_shards):
+    """Returns the shard (1 to n_shards) that the speaker of rec_id belongs to."""
+    return zlib.crc32(speaker_id(rec_id).encode("utf-8")) % n_shards + 1
+
+
+def in_shard(rec_id, shard):
+    """Checks whether rec_id belongs to shard (i, n); every recording belongs to shard None."""
+    return shard is None or shard_of(rec_id, shard[1]) == shard[0]
+
+
+def shard_dir(project_dir, shard):
+    """Returns the project dir of shard (i, n): project_dir/shards/shard_i_of_n."""
+    return os.path.join(project_dir, SHARDS_DIR, f"shard_{shard[0]}_of_{shard[1]}")
+
+
+def find_shard_dirs(project_dir):
+    """
+    Returns the project dirs of all shards under project_dir, in shard order.
+    Raises ValueError when shards of different runs (different n) are mixed or a shard is missing.
+    """
+    shards = {}
+    shards_path = os.path.join(project_dir, SHARDS_DIR)
+    for dirname in sorted(os.listdir(shards_path)) if os.path.isdir(shards_path) else []:
+        match = re.fullmatch(r"shard_(\d+)_of_(\d+)", dirname)
+        if match:
+            shards[int(match.group(1)), int(match.group(2))] = os.path.join(shards_path, dirname)
+    counts = {n_shards for i, n_shards in shards}
+    if len(counts) != 1:
+        raise ValueError(f"Expected the shards of 1 run under {shards_path}, found {sorted(shards)}")
+    n_shards = counts.pop()
+    missing = [i for i in range(1, n_shards + 1) if (i, n_shards) not in shards]
+    if missing:
+        raise ValueError(f"Shard(s) {missing} of {n_shards} are missing under {shards_path}")
+    return [shards[i, n_shards] for i in range(1, n_shards + 1)]
+
+
+def rebase_path(path, shard_path, project_dir):
+    """
+    Returns path with shard_path replaced by project_dir (e.g. project/shards/shard_1_of_2/audio/x.wav
+    becomes project/audio/x.wav). Paths (and other keys) outside shard_path are returned as they are.
+    """
+    relative_path = os.path.relpath(path, shard_path)
+    if relative_path == os.pardir or relative_path.startswith(os.pardir + os.sep) or os.path.isabs(relative_path):
+        return path
+    return os.path.join(project_dir, relative_path)
+
+
+def rebase_record(stages, shard_path, project_dir):
+    """Rebases the input and output paths of all stages of 1 manifest record from shard_path onto project_dir."""
+    return {stage: {part: {rebase_path(key, shard_path, project_dir): state for key, state in record[part].items()}
+                    for part in ("inputs", "outputs")}
+            for stage, record in stages.items()}
+
+
+def merge_manifests(shard_dirs, outfile):
+    """
+    Merges the manifests of all shards into outfile (in project_dir). The input and output paths
+    of each shard are rewritten relative to project_dir, so an --incremental run in project_dir skips the
+    recordings whose outputs are in place there (e.g. after moving the shard outputs into project_dir).
+    Returns the number of recordings in it.
+    """
+    project_dir = os.path.dirname(outfile)
+    records = {}
+    for shard_path in shard_dirs:
+        manifest_path = os.path.join(shard_path, MANIFEST_NAME)
+        if not os.path.isfile(manifest_path):
+            print(f"\tWARNING: {shard_path} has no manifest")
+            continue
+        with open(manifest_path, "r", encoding="utf-8") as manifest_in:
+            shard_records = json.load(manifest_in)
+        duplicates = records.keys() & shard_records.keys()
+        if duplicates:
+            print(f"\tWARNING: {len(duplicates)} recording(s) of {shard_path} are also in an earlier shard")
+        records.update({rec_id: rebase_record(stages, shard_path, project_dir) for rec_id, stages in shard_records.items()})
+    with open(outfile, "w", encoding="utf-8") as manifest_out:
+        json.dump(records, manifest_out)
+    return len(records)
+
+
+def merge_catalogs(shard_dirs, outfile):
+    """
+    Merges the catalogs of all shards into the catalog at outfile (in project_dir). Like the manifest,
+    the paths of each shard are rebased onto project_dir, so the catalog lists the files once the
+    shard outputs are moved into project_dir. Returns the number of files in it.
+    """
+    catalog = Catalog(outfile)
+    for shard_path in shard_dirs:
+        shard_catalog = os.path.join(shard_path, CATALOG_NAME)
+        if os.path.isfile(shard_catalog):
+            catalog.merge(shard_catalog, catalog.root)
+        else:
+            print(f"\tWARNING: {shard_path} has no catalog")
+    n_files = sum(n_kind for n_kind, n_bytes, seconds in catalog.summary().values())
+    catalog.close()
+    return n_files
+
+
+def merge_reports(shard_dirs, audio_dirname, report_name, outfile):
+    """Concatenates the report_name sheets (e.g. long_stories.xlsx) of all shards into outfile."""
+    reports = []
+    for shard_path in shard_dirs:
+        report_path = os.path.join(shard_path, audio_dirname, report_name)
+        if os.path.isfile(report_path):
+            reports.append(pd.read_excel(report_path, index_col=0))
+    if not reports:
+        return 0
+    merged = pd.concat(reports).rename_axis("Recording ID").sort_index()
+    merged.to_excel(outfile)
+    return len(merged)
+
+
+def merge_matrices(shard_dirs, matrix_path, outfile):
+    """
+    Joins the item x speaker diagnostics matrices at matrix_path (relative to each shard dir)
+    into 1 matrix with the speakers of all shards, sorted on both axes like diagnostics.py.
+    """
+    # local import: diagnostics pulls in the data preparation modules
+    from diagnostics import read_table, write_table
+    matrices = []
+    for shard_path in shard_dirs:
+        shard_matrix = os.path.join(shard_path, matrix_path)
+        if os.path.isfile(shard_matrix):
+            matrix = read_table(shard_matrix)
+            if matrix.columns[0] == "Item ID":
+                matrix = matrix.set_index("Item ID")
+            matrices.append(matrix)
+        else:
+            print(f"\tWARNING: {shard_matrix} does not exist")
+    merged = pd.concat(matrices, axis=1).sort_index()
+    merged = merged[sorted(merged.columns)].rename_axis(index="Item ID", columns="Speaker ID")
+    write_table(merged, outfile)
+    return merged
+
+
+def merge_shards(project_dir, audio_dirname, diagnostics = ()):
+    """
+    Merges the outputs of all shards under project_dir into project_dir: the manifests,
+    audio_dirname/recordings.xlsx, audio_dirname/long_stories.xlsx and the diagnostics matrices
+    at the paths in diagnostics (relative to each shard dir, written to the same path under project_dir).
+    The catalogs of the shards are merged into the catalog of project_dir.
+    """
+    shard_dirs = find_shard_dirs(project_dir)
+    print(f"Merging {len(shard_dirs)} shards...")
+
+    n_recs = merge_manifests(shard_dirs, os.path.join(project_dir, MANIFEST_NAME))
+    print(f"\tManifest with {n_recs} recordings.")
+    n_files = merge_catalogs(shard_dirs, os.path.join(project_dir, CATALOG_NAME))
+    print(f"\tCatalog with {n_files} files.")
+
+    audio_path = os.path.join(project_dir, audio_dirname)
+    os.makedirs(audio_path, exist_ok=True)
+    for report_name in ["recordings.xlsx", "long_stories.xlsx"]:
+        n_rows = merge_reports(shard_dirs, audio_dirname, report_name, os.path.join(audio_path, report_name))
+        print(f"\t{report_name} with {n_rows} recordings.")
+
+    for matrix_path in diagnostics:
+        outfile = os.path.join(project_dir, matrix_path)
+        os.makedirs(os.path.dirname(outfile) or ".", exist_ok=True)
+        merged = merge_matrices(shard_dirs, matrix_path, outfile)
+        print(f"\t{matrix_path}: {merged.shape[0]} items x {merged.shape[1]} speakers.")
+    print("Done.")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('project_dir', help = "Project directory that the shards were run in (with uber_serda.py --shard i/n)")
+    parser.add_argument('audio_dir', help = "Name of the audio dir in each shard, e.g. 'audio'")
+    parser.add_argument('-d', '--diagnostics', nargs='+', default=[],
+                        help = "Paths of diagnostics.py matrices relative to each shard dir, e.g. diagnostics/correct.tsv."
+                        " The merged matrix is written to the same path under project_dir")
+    args = parser.parse_args()
+
+    merge_shards(args.project_dir, args.audio_dir, args.diagnostics)
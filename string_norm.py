@@ -1,101 +1,163 @@
-""""
-@Author:        Bo Molenaar
-@Date:          3 June 2022
-
-@Lastedited:    12 April 2023
-
-This script performs text_filter.py for a given input folder 
-and stores filtered output to given output folder.
-Optionally you can select to use text_filter_no-unk.py with opt -u False or --unk=False
-
-Expected input: 1) folder to read files from, 2) folder to place output, 
-3) extension of files to read, 4) optional -u or --unk flag
-"""
-
-#!usr/bin/python3
-# -*- coding: utf-8 -*-
-
-import os
-import sys
-import shutil
-import getopt
-import ast
-
-unk = True
-infolder = sys.argv[1]
-outfolder = sys.argv[2]
-filetype = sys.argv[3]
-argv = sys.argv[4:]
-
-try:
-    opts, args = getopt.getopt(argv, "u:", ["unk="])
-except getopt.GetoptError as err:
-    print(err)
-    opts = []
-
-for opt, arg in opts:
-    if opt in ["-u", "--unk"]:
-        unk = ast.literal_eval(unk)
-
-
-def string_norm(infolder, outfolder, use_unk):
-    # location of text_filter script (originally by Cristian Tejedor Garcia, edited by Bo Molenaar)
-    if not use_unk:
-        textfilter_path = './string_norm/text_filter_no-unk.py'
-    else:
-        textfilter_path = './string_norm/text_filter_adapt.py'
-
-    # get files from indir to be filtered
-    file_lst = []
-    for dirpath, dirnames, filenames in os.walk(infolder):
-        for file in filenames:
-            if (filetype in file) and ('_tmp' not in file) and ('README' not in file):
-                file_lst.append(file)
-    print(f"Normalising {len(file_lst)} {filetype} files...")
-
-    # make a temp dir to put the text filter output if infolder name = outfolder name
-    if infolder == outfolder:
-        outfolder = outfolder.rstrip('/', 2) + '_filtered/'
-
-        if os.path.isdir(outfolder):
-            shutil.rmtree(outfolder)
-        os.mkdir(outfolder)
-
-        # handle archiving of original files > indir_unfiltered
-        infolder_archive = ""
-        infolder_fields = infolder.split('/')
-        if infolder_fields[-1] != "":
-            infolder_archive = "/".join(infolder_fields[:-1]) + "/." + infolder_fields[-1] + "_unfiltered"
-        else:
-            infolder_archive = "/".join(infolder_fields[:-2]) + "/." + infolder_fields[-2] + "_unfiltered"
-
-        # start with a clean indir archive
-        if os.path.isdir(infolder_archive):
-            shutil.rmtree(infolder_archive)
-
-        # run the filter for each file in indir
-        for file in file_lst:
-            os.system(f"python3 {textfilter_path} {infolder}{file} {outfolder}{file}")
-
-        print("Done.\nMoving files...")
-
-        # make outdir name = indir name
-        os.system(f"mv {infolder} {infolder_archive}")
-        os.system(f"mv {outfolder} {infolder}")
-
-        print(f"Done.\nNormalised files are in {infolder}."
-              f"\nOriginal files are in {infolder_archive}")
-
-    else:
-        if os.path.isdir(outfolder):
-            shutil.rmtree(outfolder)
-        os.mkdir(outfolder)
-
-        # run the filter for each file in indir
-        for file in file_lst:
-            os.system(f"python3 {textfilter_path} {os.path.join(infolder, file)} {os.path.join(outfolder, file)}")
-
-        print(f"Done.\nNormalised files are in {outfolder}.")
-
-if __name__ == "__main__":
-    string_norm(infolder, outfolder, unk)
+""""
+@Author:        Bo Molenaar
+@Date:          3 June 2022
+
+@Lastedited:    18 October 2026
+
+This script performs text_filter.py for a given input folder
+and stores filtered output to given output folder.
+Optionally you can select to use text_filter_no-unk.py with opt -u False or --unk=False
+The filter is imported once per worker and files are spread over a pool of worker processes
+(opt -j or --jobs, default = number of cores).
+Optionally a JSON run report (time, files, bytes) is written with -r or --report.
+Optionally the input files are looked up in a project catalog (see catalog.py) with -c or --catalog,
+which is updated with the normalised files. The catalog only lists .json and .txt ASR output,
+other extensions are looked up by walking the input folder.
+
+Expected input: 1) folder to read files from, 2) folder to place output,
+3) extension of files to read, 4) optional -u or --unk flag, 5) optional -j or --jobs flag,
+6) optional -r or --report flag, 7) optional -c or --catalog flag
+"""
+
+#!usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import getopt
+import ast
+from concurrent.futures import ProcessPoolExecutor
+import instrument
+from catalog import Catalog, KINDS
+
+# text filter (originally by Cristian Tejedor Garcia, edited by Bo Molenaar)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "string_norm"))
+from text_filter_adapt import TextNormalizer
+
+
+# normalizer of the current worker process, set up once by init_worker
+normalizer = None
+
+
+def init_worker(use_unk):
+    """Sets up the text normalizer once for each worker process."""
+    global normalizer
+    normalizer = TextNormalizer(unk=use_unk)
+
+
+def normalize_file(in_out):
+    """Normalizes 1 (input file, output file) pair with the normalizer of this worker."""
+    normalizer.normalize_file(*in_out)
+
+
+def normalize_files(file_pairs, use_unk, jobs = None):
+    """
+    Takes a list of (input file, output file) pairs and normalizes them
+    on a pool of `jobs` worker processes (default: number of cores).
+    """
+    with instrument.stage("string_norm"):
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1,
+                                 initializer=init_worker, initargs=(use_unk,)) as pool:
+            for _ in pool.map(normalize_file, file_pairs, chunksize=64):
+                pass
+        instrument.add_files(len(file_pairs), instrument.file_sizes(out_file for in_file, out_file in file_pairs))
+
+
+def string_norm(infolder, outfolder, use_unk, filetype, jobs = None, catalog = None):
+    # get files from indir to be filtered (from the project catalog, if given and it lists files of this type)
+    if catalog is not None and not any(extension.endswith(filetype) for extension in KINDS["asr"][0]):
+        print(f"The catalog does not list {filetype} files, walking {infolder} instead.")
+        catalog = None
+    if catalog is not None:
+        filenames = [os.path.basename(path) for path in catalog.find("asr", infolder)]
+    else:
+        filenames = [file for dirpath, dirnames, dir_files in os.walk(infolder) for file in dir_files]
+    file_lst = []
+    for file in filenames:
+        if (filetype in file) and ('_tmp' not in file) and ('README' not in file):
+            file_lst.append(file)
+    print(f"Normalising {len(file_lst)} {filetype} files...")
+
+    # make a temp dir to put the text filter output if infolder name = outfolder name
+    if infolder == outfolder:
+        outfolder = outfolder.rstrip('/') + '_filtered/'
+
+        if os.path.isdir(outfolder):
+            shutil.rmtree(outfolder)
+        os.mkdir(outfolder)
+
+        # handle archiving of original files > indir_unfiltered
+        infolder_archive = ""
+        infolder_fields = infolder.split('/')
+        if infolder_fields[-1] != "":
+            infolder_archive = "/".join(infolder_fields[:-1]) + "/." + infolder_fields[-1] + "_unfiltered"
+        else:
+            infolder_archive = "/".join(infolder_fields[:-2]) + "/." + infolder_fields[-2] + "_unfiltered"
+
+        # start with a clean indir archive
+        if os.path.isdir(infolder_archive):
+            shutil.rmtree(infolder_archive)
+
+        # run the filter for each file in indir
+        normalize_files([(os.path.join(infolder, file), os.path.join(outfolder, file)) for file in file_lst],
+                        use_unk, jobs)
+
+        print("Done.\nMoving files...")
+
+        # make outdir name = indir name
+        shutil.move(infolder, infolder_archive)
+        shutil.move(outfolder, infolder)
+
+        print(f"Done.\nNormalised files are in {infolder}."
+              f"\nOriginal files are in {infolder_archive}")
+        normalised_folder = infolder
+
+    else:
+        if os.path.isdir(outfolder):
+            shutil.rmtree(outfolder)
+        os.mkdir(outfolder)
+
+        # run the filter for each file in indir
+        normalize_files([(os.path.join(infolder, file), os.path.join(outfolder, file)) for file in file_lst],
+                        use_unk, jobs)
+
+        print(f"Done.\nNormalised files are in {outfolder}.")
+        normalised_folder = outfolder
+
+    if catalog is not None:
+        # the normalised files replace everything that was in their folder
+        catalog.remove_under(normalised_folder, "asr")
+        catalog.add("asr", [os.path.join(normalised_folder, file) for file in file_lst])
+        catalog.save()
+
+if __name__ == "__main__":
+    unk = True
+    jobs = None
+    report = None
+    catalog = None
+    infolder = sys.argv[1]
+    outfolder = sys.argv[2]
+    filetype = sys.argv[3]
+    argv = sys.argv[4:]
+
+    try:
+        opts, args = getopt.getopt(argv, "u:j:r:c:", ["unk=", "jobs=", "report=", "catalog="])
+    except getopt.GetoptError as err:
+        print(err)
+        opts = []
+
+    for opt, arg in opts:
+        if opt in ["-u", "--unk"]:
+            unk = ast.literal_eval(arg)
+        elif opt in ["-j", "--jobs"]:
+            jobs = int(arg)
+        elif opt in ["-r", "--report"]:
+            report = arg
+        elif opt in ["-c", "--catalog"]:
+            catalog = Catalog(arg)
+
+    string_norm(infolder, outfolder, unk, filetype, jobs, catalog)
+
+    if report:
+        instrument.print_summary(instrument.write_report(report))
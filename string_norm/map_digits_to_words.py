@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# How to run it: ### echo "12 appels" | python3 map_digits_to_words.py
+# Or import it: ### from map_digits_to_words import map_digits
+
+"""
+Python port of map_digits_to_words_v2.pl (Radboud University, CLST, Nijmegen, NL, AGPL-3.0).
+Maps all numbers into Dutch verbal expressions, e.g. 21 -> een en twintig.
+The rules are applied in the same order as in the perl script, so the output is the same,
+including its extra spaces. Results are cached, so repeated numbers are only converted once.
+One difference: the perl script shares a loop counter between tokens and can skip tokens
+after numbers with leading zeros; here every token of a line is mapped.
+"""
+
+import re
+import sys
+from functools import lru_cache
+
+NUMBER_WORDS = {
+    "0": "nul", "1": "een", "2": "twee", "3": "drie", "4": "vier", "5": "vijf", "6": "zes",
+    "7": "zeven", "8": "acht", "9": "negen", "10": "tien", "11": "elf", "12": "twaalf",
+    "13": "dertien", "14": "veertien", "15": "vijftien", "16": "zestien", "17": "zeventien",
+    "18": "achttien", "19": "negentien", "20": "twintig", "30": "dertig", "40": "veertig",
+    "50": "vijftig", "60": "zestig", "70": "zeventig", "80": "tachtig", "90": "negentig",
+    "100": "honderd", "1000": "duizend", "10000": "tienduizend", "100000": "honderdduizend",
+    "1000000": "miljoen", "10000000": "tien miljoen", "100000000": "honderd miljoen",
+}
+
+NUMBER_TOKEN = re.compile(r"[.,\-0-9]+")
+TWO_DIGITS = re.compile(r"([0-9])([0-9])")
+THREE_DIGITS = re.compile(r"([0-9])([0-9][0-9])")
+LEADING_ZEROS = re.compile(r"(0+)(.+)")
+FOUR_DIGITS = re.compile(r"([1-9])([0-9])([0-9][0-9])")
+THOUSANDS = re.compile(r"([1-9][0-9]{1,2})([0-9]{3})")
+MILLIONS = re.compile(r"([1-9][0-9]{0,2})([0-9]{6})")
+DECIMAL_COMMA = re.compile(r"(.+),(.+)")
+DECIMAL_POINT = re.compile(r"(.+)\.(.+)")
+NEGATIVE = re.compile(r"-(.+)")
+
+
+def fapz(digits):
+    """forget about prepending zeroes"""
+    return digits.lstrip("0")
+
+
+@lru_cache(maxsize=None)
+def num2str(word):
+    """Converts 1 number token (digits, optionally with , . or -) to words."""
+    word = NUMBER_WORDS.get(word, word)
+
+    match = TWO_DIGITS.fullmatch(word)
+    if match:
+        a, b = match.groups()
+        if int(a) > 0:
+            word = num2str(b) + " en " + num2str(a + "0")
+        else:
+            word = num2str(a) + " " + num2str(b)
+
+    match = THREE_DIGITS.fullmatch(word)
+    if match:
+        a, b = match.groups()
+        if int(a) > 1:
+            word = num2str(a) + " honderd " + num2str(fapz(b))
+        elif int(a) == 1:
+            word = "honderd " + num2str(fapz(b))
+        else:
+            word = num2str(a) + " " + num2str(fapz(b))
+
+    match = LEADING_ZEROS.fullmatch(word)
+    if match:
+        a, b = match.groups()
+        word = "nul " * len(a) + "".join(" " + num2str(character) for character in b)
+
+    match = FOUR_DIGITS.fullmatch(word)
+    if match:
+        a, b, c = match.groups()
+        if int(a) == 1 and int(b) == 0:
+            word = "duizend " + num2str(fapz(c))
+        elif int(b) == 0:
+            word = num2str(a) + " duizend " + num2str(fapz(c))
+        else:
+            word = num2str(a + b) + " honderd " + num2str(fapz(c))
+
+    match = THOUSANDS.fullmatch(word)
+    if match:
+        a, b = match.groups()
+        word = num2str(a) + " duizend " + num2str(fapz(b))
+
+    match = MILLIONS.fullmatch(word)
+    if match:
+        a, b = match.groups()
+        word = num2str(a) + " miljoen " + num2str(fapz(b))
+
+    match = DECIMAL_COMMA.fullmatch(word)
+    if match:
+        a, b = match.groups()
+        word = num2str(a) + " komma " + num2str(fapz(b))
+
+    match = DECIMAL_POINT.fullmatch(word)
+    if match:
+        a, b = match.groups()
+        word = num2str(a) + " punt " + num2str(fapz(b))
+
+    match = NEGATIVE.fullmatch(word)
+    if match:
+        word = "min " + num2str(match.group(1))
+
+    return word
+
+
+@lru_cache(maxsize=65536)
+def map_digits(text):
+    """Maps every number token in a line of text to words, leaving all other tokens as they are."""
+    tokens = re.split(r"\s+", text)
+    # like perl's split, drop trailing empty fields but keep a leading one
+    while tokens and tokens[-1] == "":
+        tokens.pop()
+    return " ".join(num2str(token) if NUMBER_TOKEN.fullmatch(token) else token for token in tokens)
+
+
+if __name__ == "__main__":
+    for line in sys.stdin:
+        print(map_digits(line.rstrip("\n")))
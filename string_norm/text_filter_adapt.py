@@ -1,127 +1,217 @@
-#!/usr/bin/python3
-# -*- coding: utf-8 -*-
-# How to run it: ### python3 text_filter.py $my_dir/data/train/text $my_dir/data/train/text_filter
-
-import os, sys
-from re import sub
-
-# Perl file which converts digits into their orthographical transcription.
-DIGITS_TO_WORDS_FILE_PATH = '/vol/tensusers4/bmolenaar/jasmin_data_prep/string_norm/map_digits_to_words_v2.pl'
-
-if (len(sys.argv) < 3):
-    print("You must add two arguments: input file and output file paths")
-    sys.exit(-1)
-input_file = sys.argv[1]
-output_file = sys.argv[2]
-
-TEXT_SEPARATOR = ' '
-REPLACE_SYMBOLS = {'.': '', '?': '', '!': '', 'SIL': '', ',': '', '=': '-', "’": "'", '-': ''}  # +lowercase
-REPLACE_WORDS = {'xxx': '<unk>', 'ggg': '<unk>'}
-# DELETE_ONLY_BEGIN_END = ["-"]  # We want to keep "\'" 's 't
-TEMPORAL_FILE = f"{input_file}_tmp"
-FEATURES_FILE = "/vol/tensusers4/bmolenaar/ADAPT/ADAPT_python2/features-grapheme-levenshtein.txt"
-
-
-adapt_symbols = set()
-with open(FEATURES_FILE, "r", encoding = "utf-8") as f:
-    file = f.readlines()
-    for i, s in enumerate(file):
-        if(s[0] != " " and s[0] != "\n" and s[0] != "\t"):
-            symbol = s[0]
-            adapt_symbols.add(symbol)
-        if i == 92:
-            break
-
-def map_digits(digits):
-    m_text = digits
-    if os.path.isfile(DIGITS_TO_WORDS_FILE_PATH):
-        os.system(("echo \"" + m_text + "\"| perl " +
-                   DIGITS_TO_WORDS_FILE_PATH + " > " + TEMPORAL_FILE))
-        m_text = str(open(TEMPORAL_FILE, 'r').read()).replace('\n', '')
-    else:
-        print("DIGITS_TO_WORDS_FILE not found")
-    return m_text
-
-
-'''
-Lowercase word with symbols replaced.
-Also deletes any - at the beg/end of the word
-'''
-
-
-def clean_word(m_word):
-    m_word = m_word.lower()
-    for symbol in REPLACE_SYMBOLS:
-        m_word = m_word.replace(symbol, REPLACE_SYMBOLS[symbol])
-    # for m_symbol in DELETE_ONLY_BEGIN_END:
-    #     if m_word.startswith(m_symbol):
-    #         m_word = m_word[1:]
-    #     if m_word.endswith(m_symbol):
-    #         m_word = m_word[:m_word.rindex(m_symbol)]
-    if m_word in REPLACE_WORDS:
-        m_word = REPLACE_WORDS[m_word]
-    if '*' in m_word:
-        m_word = m_word[:m_word.index('*')]
-    if '[' in m_word:
-        m_word = m_word[:m_word.index('[')]
-    if m_word.isdigit():
-        m_word = map_digits(m_word)
-    else:
-        for character in m_word:
-            if character.isdigit():
-                # print(f"{input_file.rsplit('/', 1)[1]}\t{m_word}")
-                m_word = m_word[:m_word.index(character)] + map_digits(character) + m_word[m_word.index(character)+1:]
-            elif character not in adapt_symbols:
-                m_word = m_word[:m_word.index(character)] + m_word[m_word.index(character)+1:]
-    return m_word.lower()
-
-
-def remove_accents_from_lower(raw_text):
-    """Removes common accent characters from lowercase strings.
-    Our goal is to brute force login mechanisms, and I work primary with
-    companies deploying English-language systems. From my experience, user
-    accounts tend to be created without special accented characters. This
-    function tries to swap those out for standard English alphabet.
-    """
-    raw_text = sub(u"[àáâãäå]", 'a', raw_text)
-    raw_text = sub(u"[èéêë]", 'e', raw_text)
-    raw_text = sub(u"[ìíîï]", 'i', raw_text)
-    raw_text = sub(u"[òóôõö]", 'o', raw_text)
-    raw_text = sub(u"[ùúûü]", 'u', raw_text)
-    raw_text = sub(u"[ýÿ]", 'y', raw_text)
-    raw_text = sub(u"[ß]", 'ss', raw_text)
-    raw_text = sub(u"[ñ]", 'n', raw_text)
-    return raw_text
-
-
-filtered_lines = []
-set_symbols = set()
-
-if os.stat(input_file).st_size == 0:
-    with open(output_file, 'w', encoding='utf-8') as output_text:
-        output_text.write('')
-
-else:
-    with open(input_file, 'r', encoding='utf-8') as input_text:
-        for line in input_text:
-            line = line.strip()
-            fields = line.split(TEXT_SEPARATOR)
-            # id=fields[0]
-            utt = fields[0:]
-            filtered_utt = []
-            for word in utt:
-                m_word = remove_accents_from_lower(clean_word(word))
-                for i in m_word:
-                    set_symbols.add(i)
-                filtered_utt.append(m_word)
-            filtered_lines.append(' '.join(filtered_utt))
-
-    # for symbol in sorted(set_symbols):
-    #     print(symbol,end=' ')
-    # print()
-
-    with open(output_file, 'w', encoding='utf-8') as output_text:
-        output_text.write('\n'.join(filtered_lines) + '\n')
-
-if os.path.exists(TEMPORAL_FILE):
-    os.remove(TEMPORAL_FILE)
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# How to run it: ### python3 text_filter.py $my_dir/data/train/text $my_dir/data/train/text_filter
+# Or import it: ### normalizer = TextNormalizer(unk=True); normalizer.normalize_file(infile, outfile)
+
+import os, sys
+from re import sub
+from string import ascii_lowercase
+# Python port of map_digits_to_words_v2.pl, which converts digits into their orthographical transcription.
+from map_digits_to_words import map_digits
+
+TEXT_SEPARATOR = ' '
+REPLACE_SYMBOLS = {'.': '', '?': '', '!': '', 'SIL': '', ',': '', '=': '-', "’": "'", '-': ''}  # +lowercase
+REPLACE_WORDS = {'xxx': '<unk>', 'ggg': '<unk>'}
+REPLACE_WORDS_NO_UNK = {'xxx': '', 'ggg': ''}
+# DELETE_ONLY_BEGIN_END = ["-"]  # We want to keep "\'" 's 't
+FEATURES_FILE = "/vol/tensusers4/bmolenaar/ADAPT/ADAPT_python2/features-grapheme-levenshtein.txt"
+ACCENTS = {**dict.fromkeys("àáâãäå", 'a'), **dict.fromkeys("èéêë", 'e'), **dict.fromkeys("ìíîï", 'i'),
+           **dict.fromkeys("òóôõö", 'o'), **dict.fromkeys("ùúûü", 'u'), **dict.fromkeys("ýÿ", 'y'),
+           'ß': 'ss', 'ñ': 'n'}
+
+
+def load_adapt_symbols(features_file):
+    """Reads the set of graphemes ADAPT knows from the first 93 lines of its features file."""
+    adapt_symbols = set()
+    with open(features_file, "r", encoding = "utf-8") as f:
+        file = f.readlines()
+        for i, s in enumerate(file):
+            if(s[0] != " " and s[0] != "\n" and s[0] != "\t"):
+                symbol = s[0]
+                adapt_symbols.add(symbol)
+            if i == 92:
+                break
+    return adapt_symbols
+
+
+def remove_accents_from_lower(raw_text):
+    """Removes common accent characters from lowercase strings.
+    Our goal is to brute force login mechanisms, and I work primary with
+    companies deploying English-language systems. From my experience, user
+    accounts tend to be created without special accented characters. This
+    function tries to swap those out for standard English alphabet.
+    """
+    raw_text = sub(u"[àáâãäå]", 'a', raw_text)
+    raw_text = sub(u"[èéêë]", 'e', raw_text)
+    raw_text = sub(u"[ìíîï]", 'i', raw_text)
+    raw_text = sub(u"[òóôõö]", 'o', raw_text)
+    raw_text = sub(u"[ùúûü]", 'u', raw_text)
+    raw_text = sub(u"[ýÿ]", 'y', raw_text)
+    raw_text = sub(u"[ß]", 'ss', raw_text)
+    raw_text = sub(u"[ñ]", 'n', raw_text)
+    return raw_text
+
+
+def compile_symbols(replace_symbols):
+    """
+    Compiles the sequential str.replace calls of REPLACE_SYMBOLS into 1 translation table.
+    Multi-character symbols containing uppercase letters (SIL) can never match lowercased text
+    and are left out; any other multi-character symbol can't be compiled and returns None.
+    """
+    table = {}
+    for symbol in replace_symbols:
+        if len(symbol) > 1:
+            if symbol != symbol.lower():
+                continue
+            return None
+        replacement = symbol
+        for other in replace_symbols:
+            replacement = replacement.replace(other, replace_symbols[other])
+        table[ord(symbol)] = replacement
+    return table
+
+
+class CharTable(dict):
+    """
+    Lookup table for str.translate that computes the output of each character
+    the first time it is seen, using char_fn, and caches it.
+    """
+
+    def __init__(self, char_fn):
+        super().__init__()
+        self.char_fn = char_fn
+
+    def __missing__(self, codepoint):
+        output = self.char_fn(chr(codepoint))
+        self[codepoint] = output
+        return output
+
+
+class TextNormalizer:
+    """
+    Text filter that can be set up once and reused for many files, e.g. in a worker pool.
+    With unk=True (default) it behaves like text_filter_adapt.py: xxx/ggg become <unk> and
+    characters ADAPT doesn't know are removed, so the ADAPT features file is read once here.
+    With unk=False it behaves like text_filter_no-unk.py: xxx/ggg are removed and no ADAPT filtering is done.
+    """
+
+    def __init__(self, unk = True, features_file = FEATURES_FILE):
+        self.unk = unk
+        self.replace_symbols = REPLACE_SYMBOLS
+        self.replace_words = REPLACE_WORDS if unk else REPLACE_WORDS_NO_UNK
+        self.adapt_symbols = load_adapt_symbols(features_file) if unk else None
+
+        # compiled tables for normalize_line: the symbol replacements, the digit mapping + ADAPT filter
+        # and the accent folding of clean_word and remove_accents_from_lower, applied in 1 pass per word.
+        # The in-place edits of clean_word only equal a per-character mapping if number words survive
+        # the ADAPT filter; otherwise normalize_line falls back to the word-by-word version.
+        self.symbol_table = compile_symbols(self.replace_symbols)
+        self.compiled = self.symbol_table is not None and (not unk or set(ascii_lowercase) <= self.adapt_symbols)
+        self.char_table = CharTable(self.normalize_char)
+        self.accent_table = str.maketrans(ACCENTS)
+
+    def normalize_char(self, character):
+        """Output of clean_word + remove_accents_from_lower for 1 character of a non-numeric word."""
+        if self.unk:
+            if character.isdigit():
+                character = map_digits(character)
+            elif character not in self.adapt_symbols:
+                return ''
+        return ''.join(ACCENTS.get(c, c) for c in character)
+
+    def clean_word(self, m_word):
+        '''
+        Lowercase word with symbols replaced.
+        Also deletes any - at the beg/end of the word
+        '''
+        m_word = m_word.lower()
+        for symbol in self.replace_symbols:
+            m_word = m_word.replace(symbol, self.replace_symbols[symbol])
+        # for m_symbol in DELETE_ONLY_BEGIN_END:
+        #     if m_word.startswith(m_symbol):
+        #         m_word = m_word[1:]
+        #     if m_word.endswith(m_symbol):
+        #         m_word = m_word[:m_word.rindex(m_symbol)]
+        if m_word in self.replace_words:
+            m_word = self.replace_words[m_word]
+        if '*' in m_word:
+            m_word = m_word[:m_word.index('*')]
+        if '[' in m_word:
+            m_word = m_word[:m_word.index('[')]
+        if m_word.isdigit():
+            m_word = map_digits(m_word)
+        elif self.unk:
+            for character in m_word:
+                if character.isdigit():
+                    m_word = m_word[:m_word.index(character)] + map_digits(character) + m_word[m_word.index(character)+1:]
+                elif character not in self.adapt_symbols:
+                    m_word = m_word[:m_word.index(character)] + m_word[m_word.index(character)+1:]
+        else:
+            for character in m_word:
+                if character.isdigit():
+                    # the no-unk filter keeps the word up to its first digit. text_filter_no-unk.py went on
+                    # to the next digit and raised a ValueError on words with more than 1 digit (e.g. 'a12'),
+                    # which stopped the whole file; those words are now cut at their first digit as well
+                    m_word = m_word[:m_word.index(character)] + map_digits(character)
+                    break
+        return m_word.lower()
+
+    def normalize_line_legacy(self, line):
+        """Normalizes every word in 1 line of text with clean_word and remove_accents_from_lower."""
+        fields = line.strip().split(TEXT_SEPARATOR)
+        # id=fields[0]
+        utt = fields[0:]
+        return ' '.join(remove_accents_from_lower(self.clean_word(word)) for word in utt)
+
+    def normalize_line(self, line):
+        """
+        Normalizes every word in 1 line of text. Same output as normalize_line_legacy,
+        but lowercasing and symbol replacement run once over the whole line and
+        every word is then mapped in a single pass through the compiled character table.
+        """
+        if not self.compiled:
+            return self.normalize_line_legacy(line)
+
+        filtered_utt = []
+        for m_word in line.strip().lower().translate(self.symbol_table).split(TEXT_SEPARATOR):
+            if m_word in self.replace_words:
+                m_word = self.replace_words[m_word]
+            if '*' in m_word:
+                m_word = m_word[:m_word.index('*')]
+            if '[' in m_word:
+                m_word = m_word[:m_word.index('[')]
+            if m_word.isdigit():
+                # numbers are written out and not filtered any further
+                filtered_utt.append(map_digits(m_word).translate(self.accent_table))
+                continue
+            if not self.unk and not m_word.isalpha():
+                for i, character in enumerate(m_word):
+                    if character.isdigit():
+                        # the no-unk filter keeps the word up to its first digit (see clean_word)
+                        m_word = m_word[:i] + map_digits(character)
+                        break
+            filtered_utt.append(m_word.translate(self.char_table))
+        return ' '.join(filtered_utt)
+
+    def normalize_file(self, input_file, output_file):
+        """Normalizes input_file line by line and writes the result to output_file."""
+        if self.unk and os.stat(input_file).st_size == 0:
+            with open(output_file, 'w', encoding='utf-8') as output_text:
+                output_text.write('')
+            return
+
+        with open(input_file, 'r', encoding='utf-8') as input_text:
+            filtered_lines = [self.normalize_line(line) for line in input_text]
+
+        with open(output_file, 'w', encoding='utf-8') as output_text:
+            output_text.write('\n'.join(filtered_lines) + '\n')
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 3):
+        print("You must add two arguments: input file and output file paths")
+        sys.exit(-1)
+    input_file = sys.argv[1]
+    output_file = sys.argv[2]
+
+    TextNormalizer(unk=True).normalize_file(input_file, output_file)
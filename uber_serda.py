@@ -5,25 +5,74 @@ import os
 import sys
 import argparse
 import shutil
-import time
+import pathlib
 import serda_data_sel as data_sel
 import serda_data_prep as data_prep
+import audio_io
+import instrument
+import shards
+from manifest import Manifest, MANIFEST_NAME
+from catalog import Catalog, CATALOG_NAME
 
 
-t = time.process_time()
-
 parser = argparse.ArgumentParser()
-parser.add_argument('--clean', action = 'store_true', required=False,
+# --clean removes the project dir with its manifest, so it can't be combined with --incremental
+run_mode = parser.add_mutually_exclusive_group()
+run_mode.add_argument('--clean', action = 'store_true', required=False,
                     help = "Flag specifying whether you want to generate new directories."
                     " When True, script will delete everything under project_dir"
                     " and generate new directories and files starting from audio zip and logs zip."
                     " When False, will leave files as is"
                     " and only collect their paths for data preparation steps."
                     " Default=False")
+run_mode.add_argument('--incremental', action = 'store_true', required=False,
+                    help = "Flag specifying whether you want to update an existing project dir."
+                    " Uses the manifest written by earlier runs to only redo recordings that are new,"
+                    " changed or have missing outputs. With -a and -l, new recordings in the zips are"
+                    " extracted and converted; without them, only data preparation is updated."
+                    " Default=False")
 parser.add_argument('-a', '--audiozip', required='--clean' in sys.argv,
                     help = "Path to raw audio zip. Required when using --clean.")
 parser.add_argument('-l', '--logzip', required='--clean' in sys.argv,
                     help = "Path to raw log zip. Required when using --clean.")
+parser.add_argument('-j', '--jobs', type=int, default=None,
+                    help = "Number of parallel jobs used for audio conversion."
+                    " Default = number of cores")
+parser.add_argument('--ingest', choices=['stream', 'unzip'], default='stream',
+                    help = "How to extract the zips when using --clean. 'stream' extracts members straight"
+                    " into their task folders, 'unzip' unzips everything and sorts it afterwards."
+                    " Default = 'stream'")
+parser.add_argument('--trim-engine', choices=['fused', 'python', 'ffmpeg'], default='fused',
+                    help = "Engine used to find silences in and trim stories over 3 minutes. 'fused' decodes"
+                    " each story once and converts, measures and trims it in that one pass (with --ingest"
+                    " stream; otherwise it works like 'python'), 'python' reads only the audio around 180s"
+                    " of the converted story in-process, 'ffmpeg' decodes the full story with"
+                    " ffmpeg silencedetect and trims it with sox. Default = 'fused'")
+parser.add_argument('--segment-engine', choices=['python', 'sox'], default='python',
+                    help = "Engine used to cut word segments. 'python' reads each recording once"
+                    " and writes all segments in-process, 'sox' calls sox once per segment."
+                    " Default = 'python'")
+parser.add_argument('--output', choices=['files', 'kaldi'], default='files',
+                    help = "Output of word task preparation. 'files' writes a .wav and .prompt file for each"
+                    " word segment, 'kaldi' writes Kaldi-style wav.scp, segments, text and utt2spk files"
+                    " in audio_dir/words/kaldi that point into the full recordings. Default = 'files'")
+parser.add_argument('--sample-rate', type=int, default=None,
+                    help = "Sample rate (Hz) of converted recordings, e.g. 16000. Trimmed stories and"
+                    " segments keep the format of their recording. Default = the source sample rate")
+parser.add_argument('--bit-depth', type=int, choices=[16, 24, 32], default=32,
+                    help = "Bits per sample of converted recordings. Default = 32")
+parser.add_argument('--audio-format', choices=['wav', 'flac'], default='wav',
+                    help = "File format of converted recordings. .flac takes less disk space, but its stories are"
+                    " trimmed with ffmpeg and sox and its segments are cut with sox. Default = 'wav'")
+parser.add_argument('--drop-flagged', action='store_true',
+                    help = "Leave out recordings with an empty audio or log file in the zips and converted recordings"
+                    " that are shorter than 1 minute, empty or truncated (see preflight.py). Without this flag they"
+                    " are only listed in audio_dir/flagged_recordings.txt")
+parser.add_argument('--shard', type=shards.parse_shard, default=None,
+                    help = "Only process shard i of n, e.g. --shard 2/4, as one job of a job array."
+                    " Recordings are assigned to shards by speaker ID and each shard works in"
+                    " project_dir/shards/shard_i_of_n; --clean only removes that dir."
+                    " Merge the shards afterwards with shards.py. Requires --ingest stream")
 parser.add_argument('project_dir',
                     help = "Parent project directory where you want to process and store audio, logs, prompts and ASR transcriptions.")
 parser.add_argument('audio_dir',
@@ -46,37 +95,71 @@ parser.add_argument('recs_to_ignore',
 args = parser.parse_args()
 if args.clean and (args.audiozip is None or args.logzip is None):
     parser.error("--clean requires -a/--audiozip and -l/--logzip.")
+if args.incremental and (args.audiozip is None) != (args.logzip is None):
+    parser.error("--incremental requires both or neither of -a/--audiozip and -l/--logzip.")
+if args.incremental and args.ingest != 'stream':
+    parser.error("--incremental requires --ingest stream.")
+if args.shard and args.ingest != 'stream':
+    parser.error("--shard requires --ingest stream.")
+try:
+    audio_format = audio_io.audio_format(args.sample_rate, args.bit_depth, args.audio_format)
+except ValueError as err:
+    parser.error(str(err))
+
+# a shard only owns its own project dir under project_dir/shards
+project_dir = args.project_dir if args.shard is None else shards.shard_dir(args.project_dir, args.shard)
 
-audio_path = os.path.join(args.project_dir, args.audio_dir)
-logs_path = os.path.join(args.project_dir, args.log_dir)
-prompts_path = os.path.join(args.project_dir, args.prompt_dir)
+audio_path = os.path.join(project_dir, args.audio_dir)
+logs_path = os.path.join(project_dir, args.log_dir)
+prompts_path = os.path.join(project_dir, args.prompt_dir)
 
 print("\n###\tSERDA v1 data processing\t###\n")
+if args.shard:
+    print(f"Processing shard {args.shard[0]} of {args.shard[1]} in {project_dir}")
 
 # remove project folder and audio, logs and prompts subfolders if they already exist
-for mydir in [args.project_dir, args.audio_dir, args.log_dir, args.prompt_dir]:
+for mydir in [project_dir, args.audio_dir, args.log_dir, args.prompt_dir]:
     if args.clean and os.path.isdir(mydir):
         print("Creating new project dir...")
         shutil.rmtree(mydir)
         os.mkdir(mydir)
     
+pathlib.Path(project_dir).mkdir(parents=True, exist_ok=True)
+# every run keeps a catalog of the files in the project, so files are looked up instead of walking the project dirs
+catalog = Catalog(os.path.join(project_dir, CATALOG_NAME))
+
+# clean and incremental runs keep a manifest of what was produced for each recording
+manifest = None
+if args.clean or args.incremental:
+    manifest = Manifest(os.path.join(project_dir, MANIFEST_NAME))
+
 print("\n# 1. Data selection  #\n")
 print("Creating dict of selected data...")
-if args.clean:
-    full_dict = data_sel.gen_clean_dict(audio_path, logs_path, args.recs_to_ignore, args.clean, args.audiozip, args.logzip)
-else:
-    full_dict = data_sel.gen_clean_dict(audio_path, logs_path, args.recs_to_ignore, args.clean)
+with instrument.stage("data_selection"):
+    if args.clean or (args.incremental and args.audiozip):
+        full_dict = data_sel.gen_clean_dict(audio_path, logs_path, args.recs_to_ignore, True, args.audiozip, args.logzip,
+                                            args.jobs, args.ingest, manifest, args.trim_engine, args.shard,
+                                            audio_format, args.drop_flagged, catalog)
+    else:
+        full_dict = data_sel.gen_clean_dict(audio_path, logs_path, args.recs_to_ignore, args.clean, catalog=catalog)
 print("Done.")
 
 print("\n# 2. Data preparation #\n")
 print("Segmenting data and matching prompts...")
-data_prep.prepare_data(args.clean, full_dict, audio_path, logs_path, args.raw_prompts, prompts_path)
+with instrument.stage("data_preparation"):
+    data_prep.prepare_data(args.clean or args.incremental, full_dict, audio_path, logs_path, args.raw_prompts, prompts_path,
+                           args.segment_engine, manifest, args.output, catalog)
 print("Done.")
 
 print("\n# Finished preparing data #\n")
+catalog.close()
 
-elapsed_time = time.process_time() - t
-print(f"Elapsed time: {elapsed_time} s")
+# wall time and child process CPU time per stage (process_time alone leaves out ffmpeg, sox and the workers)
+report_path = os.path.join(project_dir, instrument.RUN_REPORT_NAME)
+instrument.print_summary(instrument.write_report(report_path))
+print(f"Run report is in {report_path}.")
 
 print("\nPlease prepare a folder with ASR output for story tasks in"
-      f" {os.path.join(args.project_dir, 'asr')}, so you can run segment_stories.py")
+      f" {os.path.join(project_dir, 'asr')}, so you can run segment_stories.py")
+if args.shard:
+    print(f"When all {args.shard[1]} shards have finished, merge them with: shards.py {args.project_dir} {args.audio_dir}")